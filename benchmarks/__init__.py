@@ -0,0 +1,15 @@
+"""
+Benchmarks for encoding data, building chart URLs and rendering the chart
+tags, in airspeed velocity (asv) style: time_* methods are timed, and
+track_* methods record the sizes of the URLs and tags produced, so both can
+be compared from release to release.
+
+Run them with asv (see asv.conf.json)::
+
+    asv run
+    asv compare v1.0 HEAD
+
+or, without asv, with the runner in this package::
+
+    python -m benchmarks [--json results.json] [--compare old.json] [pattern]
+"""
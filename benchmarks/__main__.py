@@ -0,0 +1,165 @@
+"""
+Run the benchmarks without asv::
+
+    python -m benchmarks [options] [pattern]
+
+Only benchmarks whose names (e.g. "Encoding.time_encode_text") match the
+pattern, a regular expression, are run.
+"""
+import os
+import re
+import sys
+import time
+import itertools
+import subprocess
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+import benchmarks
+
+def find_benchmarks(pattern=None):
+    """(name, class, method name) for each benchmark, in module order."""
+    directory = os.path.dirname(benchmarks.__file__)
+    found = []
+    for filename in sorted(os.listdir(directory)):
+        if not (filename.startswith("bench_") and filename.endswith(".py")):
+            continue
+        module_name = "benchmarks.%s" % filename[:-3]
+        __import__(module_name)
+        module = sys.modules[module_name]
+        classes = [value for value in vars(module).values()
+                   if isinstance(value, type) and value.__module__ == module_name]
+        for cls in sorted(classes, key=lambda cls: cls.__name__):
+            for attr in sorted(dir(cls)):
+                if not attr.startswith(("time_", "timeraw_", "track_")):
+                    continue
+                name = "%s.%s" % (cls.__name__, attr)
+                if pattern is None or re.search(pattern, name):
+                    found.append((name, cls, attr))
+    return found
+
+def parameters(cls):
+    """Every combination of cls's parameters, as a list of tuples."""
+    params = getattr(cls, "params", None)
+    if params is None:
+        return [()]
+    if not params or not isinstance(params[0], list):
+        params = [params]
+    return list(itertools.product(*params))
+
+def timeit(func, args, min_time=0.1, repeat=3):
+    """The best time for one call of func(*args), in seconds."""
+    number, best = 1, None
+    while True:
+        start = time.time()
+        for i in range(number):
+            func(*args)
+        elapsed = time.time() - start
+        if elapsed >= min_time or elapsed * 10 > min_time * repeat:
+            break
+        number *= 10
+    best = elapsed / number
+    for i in range(repeat - 1):
+        start = time.time()
+        for i in range(number):
+            func(*args)
+        best = min(best, (time.time() - start) / number)
+    return best
+
+# Runs a timeraw_ benchmark's code after its setup, and prints how long the
+# code took.
+_raw_harness = """
+import time
+exec compile(%r, "<setup>", "exec")
+started = time.time()
+exec compile(%r, "<benchmark>", "exec")
+print time.time() - started
+"""
+
+def timeraw(code, setup="", repeat=5):
+    """
+    The best time for code, in seconds, each time run in a new interpreter
+    after setup.
+    """
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(benchmarks.__file__)))
+    best = None
+    for i in range(repeat):
+        process = subprocess.Popen([sys.executable, "-c", _raw_harness % (setup, code)],
+                                   stdout=subprocess.PIPE, cwd=directory)
+        output = process.communicate()[0]
+        if process.returncode:
+            raise RuntimeError("timeraw benchmark failed: %r" % code)
+        elapsed = float(output.split()[-1])
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run(pattern=None, max_points=None, out=sys.stdout):
+    """Run the benchmarks; returns {"name(params)": result}."""
+    results = {}
+    for name, cls, attr in find_benchmarks(pattern):
+        names = getattr(cls, "param_names", [])
+        for args in parameters(cls):
+            bound = dict(zip(names, args))
+            if max_points is not None and bound.get("points", 0) > max_points:
+                continue
+            key = "%s(%s)" % (name, ", ".join(map(repr, args)))
+            instance = cls()
+            if hasattr(instance, "setup"):
+                instance.setup(*args)
+            method = getattr(instance, attr)
+            if attr.startswith("time_"):
+                value = timeit(method, args)
+                shown = format_time(value)
+            elif attr.startswith("timeraw_"):
+                code = method(*args)
+                if isinstance(code, tuple):
+                    value = timeraw(*code)
+                else:
+                    value = timeraw(code)
+                shown = format_time(value)
+            else:
+                value = method(*args)
+                shown = "%s %s" % (value, getattr(method, "unit", ""))
+            results[key] = value
+            out.write("%-70s %s\n" % (key, shown))
+            out.flush()
+    return results
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e3), ("us", 1e6)):
+        if seconds * scale >= 1:
+            return "%.3g%s" % (seconds * scale, unit)
+    return "%.3gns" % (seconds * 1e9)
+
+def compare(old, new, out=sys.stdout):
+    """Show how each result changed: new / old."""
+    for key in sorted(new):
+        if key in old and old[key]:
+            out.write("%-70s %6.2fx\n" % (key, float(new[key]) / old[key]))
+
+def main(argv=None):
+    parser = OptionParser(usage="python -m benchmarks [options] [pattern]")
+    parser.add_option("--max-points", type="int",
+                      help="skip synthetic datasets with more points than this")
+    parser.add_option("--json", metavar="FILE", help="save the results to FILE")
+    parser.add_option("--compare", metavar="FILE",
+                      help="compare the results with ones saved with --json")
+    options, args = parser.parse_args(argv)
+    results = run(args and args[0] or None, options.max_points)
+    if options.json:
+        f = open(options.json, "w")
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    if options.compare:
+        print
+        compare(json.load(open(options.compare)), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Building charts' URLs and <img> tags.
+"""
+from benchmarks.common import sizes, timeout, synthetic
+
+from googlecharts.templatetags import charts
+
+class ChartURL(object):
+    params = [sizes, ["extended", "simple", "text"]]
+    param_names = ["points", "encoding"]
+    timeout = timeout
+
+    def setup(self, points, encoding):
+        self.dataset = charts.Dataset(synthetic(points))
+
+    def make_chart(self, encoding):
+        # A new chart every time: charts keep their encoded data.
+        c = charts.Chart()
+        c.options["chs"] = "600x300"
+        c.options["chco"] = "336699"
+        c.encoding = encoding
+        c.datasets.append(self.dataset)
+        c.axes.append(charts.Axis("x"))
+        return c
+
+    def time_url(self, points, encoding):
+        self.make_chart(encoding).url()
+
+    def time_img(self, points, encoding):
+        self.make_chart(encoding).img()
+
+    def track_url_length(self, points, encoding):
+        return len(self.make_chart(encoding).url())
+    track_url_length.unit = "bytes"
+
+class Dataset(object):
+    params = sizes
+    param_names = ["points"]
+    timeout = timeout
+
+    def setup(self, points):
+        self.values = synthetic(points).tolist()
+
+    def time_dataset(self, points):
+        charts.Dataset(self.values)
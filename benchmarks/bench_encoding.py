@@ -0,0 +1,64 @@
+"""
+Encoding datasets, and the helpers that build chart URLs.
+"""
+from benchmarks.common import sizes, timeout, synthetic, value_range
+
+from googlecharts.templatetags import charts
+
+class Encoding(object):
+    params = sizes
+    param_names = ["points"]
+    timeout = timeout
+
+    def setup(self, points):
+        self.values = synthetic(points)
+        self.range = value_range(self.values)
+
+    def time_encode_extended(self, points):
+        charts.encode_extended(self.values, self.range)
+
+    def time_encode_simple(self, points):
+        charts.encode_simple(self.values, self.range)
+
+    def time_encode_text(self, points):
+        charts.encode_text(self.values)
+
+    def time_encode_text_rounded(self, points):
+        charts.encode_text(self.values, 1)
+
+    def track_extended_length(self, points):
+        return len(charts.encode_extended(self.values, self.range))
+    track_extended_length.unit = "bytes"
+
+    def track_text_length(self, points):
+        return len(charts.encode_text(self.values))
+    track_text_length.unit = "bytes"
+
+class Norm(object):
+    # norm() is called point by point, so the biggest datasets are left out.
+    params = [size for size in sizes if size <= 100000]
+    param_names = ["points"]
+
+    def setup(self, points):
+        self.values = synthetic(points)
+        self.range = value_range(self.values)
+
+    def time_norm(self, points):
+        norm, value_range = charts.norm, self.range
+        for n in self.values:
+            norm(n, value_range)
+
+class URLEncode(object):
+    params = [1, 10, 100]
+    param_names = ["options"]
+
+    def setup(self, options):
+        self.query = [("chl%d" % i, "Label %d|with: punctuation, & more" % i)
+                      for i in range(options)]
+
+    def time_urlencode(self, options):
+        charts.urlencode(self.query)
+
+    def track_urlencode_length(self, options):
+        return len(charts.urlencode(self.query))
+    track_urlencode_length.unit = "bytes"
@@ -0,0 +1,27 @@
+"""
+Cold starts: importing the tag library, loading it into a template and
+drawing the first chart, each in a fresh interpreter.
+"""
+
+# Configure Django and import what the tag library needs from it, so that
+# only the library's own import is timed.
+setup = """
+from django.conf import settings
+settings.configure(INSTALLED_APPS=["googlecharts"])
+import django.template
+import django.utils.html
+import django.utils.safestring
+import django.utils.datastructures
+"""
+
+class Import(object):
+    def timeraw_import_charts(self):
+        return "import googlecharts.templatetags.charts", setup
+
+    def timeraw_load_library(self):
+        return 'django.template.Template("{% load charts %}")', setup
+
+    def timeraw_first_chart(self):
+        return ('django.template.Template("{% load charts %}{% chart %}'
+                '{% chart-data \\"1,2,3\\" %}{% endchart %}").render(django.template.Context())',
+                setup)
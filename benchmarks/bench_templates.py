@@ -0,0 +1,68 @@
+"""
+Rendering {% chart %} tags: the examples in docs/examples.txt, and line
+charts of synthetic data, with a template and with ChartBuilder.
+"""
+from benchmarks.common import sizes, timeout, synthetic, examples, example_data
+
+from django import template
+
+from googlecharts.templatetags.charts import ChartBuilder
+
+class Examples(object):
+    params = [title for title, source in examples()]
+    param_names = ["example"]
+
+    def setup(self, example):
+        source = dict(examples())[example]
+        self.template = template.Template("{% load charts %}" + source)
+
+    def render(self):
+        # A new context every time, as for a request: charts can set
+        # variables in it.
+        return self.template.render(template.Context(dict(example_data)))
+
+    def time_render(self, example):
+        self.render()
+
+    def track_output_length(self, example):
+        return len(self.render())
+    track_output_length.unit = "bytes"
+
+class Compile(object):
+    def setup(self):
+        self.sources = ["{% load charts %}" + source for title, source in examples()]
+
+    def time_compile_examples(self):
+        for source in self.sources:
+            template.Template(source)
+
+class LineChart(object):
+    params = sizes
+    param_names = ["points"]
+    timeout = timeout
+
+    source = """{% load charts %}
+        {% chart %}
+          {% chart-type "line" %}
+          {% chart-size "600x300" %}
+          {% chart-data data %}
+          {% chart-colors "336699" %}
+          {% axis "left" %}{% endaxis %}
+        {% endchart %}"""
+
+    def setup(self, points):
+        self.template = template.Template(self.source)
+        self.context = template.Context({"data": synthetic(points).tolist()})
+
+    def time_render(self, points):
+        self.template.render(self.context)
+
+    def time_builder(self, points):
+        builder = (ChartBuilder().type("line").size("600x300")
+                   .data(self.context["data"]).colors("336699"))
+        builder.axis("left")
+        builder.img()
+
+    def track_output_length(self, points):
+        return len(self.template.render(self.context))
+    track_output_length.unit = "bytes"
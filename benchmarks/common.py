@@ -0,0 +1,77 @@
+"""
+What the benchmarks share: Django settings, the docs/examples.txt corpus and
+synthetic datasets.
+"""
+import os
+import re
+import random
+import textwrap
+from array import array
+from math import sin
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(INSTALLED_APPS=["googlecharts"])
+
+# Sizes of the synthetic datasets, in points.
+sizes = [10, 1000, 100000, 10000000]
+
+# Benchmarks with the biggest datasets take a while to set up.
+timeout = 600
+
+# Synthetic datasets, by size; see synthetic().
+_synthetic = {}
+
+# Datasets are built by repeating a block of this many points.
+block_size = 10000
+
+def synthetic(points):
+    """
+    A dataset of `points` floats: a random walk, positive and negative, that
+    is the same every time.
+    """
+    try:
+        return _synthetic[points]
+    except KeyError:
+        pass
+    rand = random.Random(0)
+    block = array("d")
+    value = 0.0
+    for i in range(min(points, block_size)):
+        value += rand.gauss(0, 1)
+        block.append(round(value, 2))
+    values = block * (points // len(block)) + block[:points % len(block)]
+    _synthetic[points] = values
+    return values
+
+def value_range(values):
+    return (min(values), max(values))
+
+examples_path = os.path.join(os.path.dirname(__file__), os.pardir, "docs", "examples.txt")
+
+# The variables the examples use; see docs/render-examples.py.
+example_data = {
+    'data1' : [10, 20, 30],
+    'data2' : [i**2 for i in range(20)],
+    'data3' : [i**2 for i in range(20, 0, -1)],
+    'data4' : [sin(i/5.0)*5 for i in range(100)],
+    'venn' : [100, 80, 60, 30, 30, 30, 10],
+    'mapdata': {'KS': 0, 'CA': 100, "MN": 50},
+    'grid_lines_data': [(6,5), (6,10), (6,15)],
+    'grid_lines_style': [('FFFFFF','1','1'), ('FFFFFF','2','1'), ('FFFFFF','3','1'),]
+}
+
+# A section title, its underline, and the literal block after it.
+_example = re.compile(r"^(\S.*)\n-+\n\n::\n[ \t]*\n((?:(?:  .*)?\n)+)", re.M)
+
+_examples = None
+
+def examples():
+    """The (title, template source) of each example in docs/examples.txt."""
+    global _examples
+    if _examples is None:
+        source = open(examples_path).read()
+        _examples = [(title, textwrap.dedent(block).strip())
+                     for title, block in _example.findall(source)]
+    return _examples
@@ -0,0 +1,262 @@
+"""
+Building lots of charts at once, on a pool of processes.
+
+Each chart is described by a spec, a dict of ChartBuilder options:
+
+    {"id": "report-17", "type": "line", "size": "300x200",
+     "data": [[1, 2, 3], [4, 5, 6]], "colors": ["336699", "CC0000"],
+     "axes": [{"side": "left", "labels": [0, 50, 100]}],
+     "saveas": "charts"}
+
+A list is the option's arguments, anything else its only argument -- so
+"data" is a list of datasets. "axes" is a list of axes, each with a "side",
+optionally "hide", and its axis options. Options are set in the order they
+come in the spec (when it's read from a file, or is a SortedDict). "id"
+identifies the chart in the output; for files of specs, it's the line
+number by default.
+
+build_charts() builds the charts a chunk of specs at a time, and writes a
+line of JSON for each one to the output, in order, as the chunks are done:
+
+    {"id": "report-17", "url": "/media/charts/5f0c....png"}
+
+The URL is the chart's own, or the URL of its saved image when it has a
+"saveas" location (making the image if need be). Charts that can't be built
+get an "error" instead. build_file() does the same from a file of specs, one
+per line, skipping the charts already in the output file -- so an
+interrupted batch can be finished by running it again. Lines that aren't
+specs get an error too, under their line number.
+"""
+import json
+import time
+from collections import deque
+
+from django.utils.datastructures import SortedDict
+
+from googlecharts.templatetags.charts import ChartBuilder
+
+class InvalidSpec(ValueError):
+    """A line in a file of specs that isn't a spec."""
+
+def make_chart(spec):
+    """Build the Chart for a spec."""
+    builder = ChartBuilder(saveas=spec.get("saveas"))
+    for name, value in spec.items():
+        if name not in ("id", "saveas", "axes"):
+            getattr(builder, name)(*_arguments(value))
+    for axis in spec.get("axes", ()):
+        axis_builder = builder.axis(axis["side"], axis.get("hide", False))
+        for name, value in axis.items():
+            if name not in ("side", "hide"):
+                getattr(axis_builder, name)(*_arguments(value))
+    return builder.chart()
+
+def _arguments(value):
+    if isinstance(value, list):
+        return value
+    return [value]
+
+def build_chunk(chunk):
+    """
+    Build the charts for a list of (id, spec) pairs, returning a result for
+    each: a dict with the id and the chart's URL, or the error.
+    """
+    results = []
+    for id, spec in chunk:
+        try:
+            if isinstance(spec, InvalidSpec):
+                raise spec
+            chart = make_chart(spec)
+            url = chart.url()
+            if chart.saveas:
+                # Imported here so that the workers don't need the
+                # storage and the renderer unless there are images to make.
+                from googlecharts.storage import get_image_store
+                url = get_image_store(chart.saveas).url(url)
+        except Exception, e:
+            results.append({"id": id, "error": "%s: %s" % (e.__class__.__name__, e)})
+        else:
+            results.append({"id": id, "url": url})
+    return results
+
+def _chunks(specs, size):
+    chunk = []
+    for item in specs:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class Progress(object):
+    """How far along a batch is."""
+    def __init__(self, total=None, skipped=0):
+        # The number of charts to build, if it's known, not counting the
+        # ones skipped because they were already built.
+        self.total = total
+        self.skipped = skipped
+        self.charts = self.errors = 0
+        self.started = time.time()
+
+    def add(self, results):
+        self.charts += len(results)
+        self.errors += len([result for result in results if "error" in result])
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def rate(self):
+        """Charts built per second."""
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.0
+        return self.charts / elapsed
+
+    def __str__(self):
+        if self.total is None:
+            done = "%d charts" % self.charts
+        else:
+            done = "%d/%d charts" % (self.charts, self.total)
+        s = "%s, %d errors, %.1f charts/s" % (done, self.errors, self.rate())
+        if self.total and self.rate():
+            s += ", %ds left" % ((self.total - self.charts) / self.rate())
+        return s
+
+# How long to wait for a chunk. Waiting with a timeout, however long, lets
+# KeyboardInterrupt through; waiting without one doesn't.
+chunk_timeout = 7 * 24 * 3600
+
+def build_charts(specs, output, processes=None, chunk_size=100, total=None, progress=None):
+    """
+    Build the charts for specs, an iterable of (id, spec) pairs, on
+    `processes` processes (one per CPU by default), and write their results
+    to output, a file, as lines of JSON. The specs are read as they're
+    needed, and sent to the processes `chunk_size` at a time. After each
+    chunk, progress (if given) is called with a Progress; that's also what's
+    returned.
+    """
+    stats = Progress(total)
+    if processes == 1:
+        # No pool: build the charts right here.
+        pool = None
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        # Keep a couple of chunks queued for each process, and no more, so
+        # the specs aren't all read in at once.
+        backlog = 2 * (processes or multiprocessing.cpu_count())
+        pending = deque()
+
+    def write(results):
+        for result in results:
+            output.write(json.dumps(result) + "\n")
+        output.flush()
+        stats.add(results)
+        if progress is not None:
+            progress(stats)
+
+    try:
+        for chunk in _chunks(specs, chunk_size):
+            if pool is None:
+                write(build_chunk(chunk))
+                continue
+            pending.append(pool.apply_async(build_chunk, (chunk,)))
+            if len(pending) >= backlog:
+                write(pending.popleft().get(chunk_timeout))
+        while pool is not None and pending:
+            write(pending.popleft().get(chunk_timeout))
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return stats
+
+def read_done(path):
+    """The ids of the charts with URLs in an output file."""
+    done = set()
+    try:
+        f = open(path)
+    except IOError:
+        return done
+    try:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Cut off by an interruption
+                continue
+            if "url" in result:
+                done.add(_key(result["id"]))
+    finally:
+        f.close()
+    return done
+
+def _key(id):
+    # Ids are compared as JSON, so that 1 and "1" are different charts but
+    # u"a" and "a" are the same one.
+    return json.dumps(id)
+
+def read_specs(f, done=(), saveas=None):
+    """
+    Yield (id, spec) pairs for the specs in the file f, one per line,
+    skipping blank lines and the charts in done. Specs without a "saveas"
+    location get saveas. A line that isn't a JSON object comes out as its
+    line number and an InvalidSpec, for build_chunk() to report, so one bad
+    line doesn't stop the batch.
+    """
+    for number, line in enumerate(f):
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line, object_pairs_hook=SortedDict)
+        except ValueError, e:
+            spec = InvalidSpec("Line %d isn't valid JSON: %s" % (number + 1, e))
+        if not isinstance(spec, dict):
+            if not isinstance(spec, InvalidSpec):
+                spec = InvalidSpec("Line %d isn't a JSON object" % (number + 1))
+            if _key(number + 1) not in done:
+                yield number + 1, spec
+            continue
+        id = spec.get("id", number + 1)
+        if _key(id) in done:
+            continue
+        if saveas and not spec.get("saveas"):
+            spec["saveas"] = saveas
+        yield id, spec
+
+def build_file(spec_path, output_path, saveas=None, **kwargs):
+    """
+    Build the charts for the specs in the file at spec_path, appending
+    their results to the file at output_path; takes build_charts()'s
+    arguments. Charts already built -- the ones with URLs in the output
+    file -- are skipped.
+    """
+    done = read_done(output_path)
+    total = 0
+    f = open(spec_path)
+    try:
+        for id, spec in read_specs(f, done):
+            total += 1
+    finally:
+        f.close()
+
+    output = open(output_path, "a+")
+    f = open(spec_path)
+    try:
+        # Finish off a line cut short by an interruption.
+        output.seek(0, 2)
+        if output.tell():
+            output.seek(-1, 2)
+            if output.read(1) != "\n":
+                output.write("\n")
+        kwargs.setdefault("total", total)
+        stats = build_charts(read_specs(f, done, saveas), output, **kwargs)
+        stats.skipped = len(done)
+        return stats
+    finally:
+        f.close()
+        output.close()
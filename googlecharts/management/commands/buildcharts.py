@@ -0,0 +1,42 @@
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from googlecharts.batch import build_file
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes',
+            help='How many processes to build charts on. Defaults to one per CPU.'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=100,
+            help='How many charts to send to a process at a time.'),
+        make_option('--saveas', dest='saveas',
+            help='Save images of the charts without a "saveas" location here.'),
+    )
+    help = ("Builds the charts described in a file of JSON specs, one per line, "
+            "and appends their URLs to the output file. Charts already in the "
+            "output file are skipped, so an interrupted run can be resumed.")
+    args = 'specs output'
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Give a file of chart specs and an output file.")
+        spec_path, output_path = args
+        verbosity = int(options.get('verbosity', 1))
+
+        reported = [0]
+        def progress(stats):
+            # At most once a second
+            if verbosity > 0 and time.time() - reported[0] >= 1:
+                sys.stderr.write("%s\n" % stats)
+                reported[0] = time.time()
+
+        stats = build_file(spec_path, output_path, saveas=options.get('saveas'),
+                           processes=options.get('processes'),
+                           chunk_size=options.get('chunk_size') or 100,
+                           progress=progress)
+        if verbosity > 0:
+            print "Built %d charts (%d errors, %d already built) in %.1fs, %.1f charts/s" % (
+                stats.charts, stats.errors, stats.skipped, stats.elapsed(), stats.rate())
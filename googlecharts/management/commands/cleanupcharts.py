@@ -0,0 +1,21 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from googlecharts.storage import ImageStore
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--max-age', type='int', dest='max_age',
+            help='Delete images saved more than this many seconds ago.'),
+        make_option('--max-size', type='int', dest='max_size',
+            help='Delete the oldest images until the rest add up to no more than this many bytes.'),
+    )
+    help = "Deletes old chart images saved with {% chart saveas %}."
+    args = '[location ...]'
+
+    def handle(self, *locations, **options):
+        for location in locations or ["charts"]:
+            deleted = ImageStore(location).cleanup(options.get('max_age'), options.get('max_size'))
+            if int(options.get('verbosity', 1)) > 0:
+                print "%s: deleted %d files" % (location, deleted)
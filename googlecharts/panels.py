@@ -0,0 +1,82 @@
+"""
+A django-debug-toolbar panel listing every chart rendered for a request and
+what it cost. Add it to the toolbar's panels::
+
+    DEBUG_TOOLBAR_PANELS = (
+        ...
+        'googlecharts.panels.ChartsPanel',
+    )
+"""
+import thread
+
+from django import template
+from debug_toolbar.panels import DebugPanel
+
+from googlecharts import tracing
+
+class ChartsPanel(DebugPanel):
+    name = "Charts"
+    has_content = True
+
+    def __init__(self, *args, **kwargs):
+        super(ChartsPanel, self).__init__(*args, **kwargs)
+        self.traces = []
+        # Panels are made for each request, and only hear about charts
+        # rendered by the request's thread.
+        self.thread = thread.get_ident()
+        tracing.chart_rendered.connect(self.record)
+
+    def record(self, sender, trace, **kwargs):
+        if trace.thread == self.thread:
+            self.traces.append(trace)
+
+    def total(self):
+        return sum([trace.duration for trace in self.traces]) * 1000
+
+    def nav_title(self):
+        return "Charts"
+
+    def nav_subtitle(self):
+        return "%d charts in %.1fms" % (len(self.traces), self.total())
+
+    def title(self):
+        return "Charts"
+
+    def url(self):
+        return ""
+
+    def content(self):
+        rows = []
+        for trace in self.traces:
+            rows.append({
+                "trace": trace,
+                "duration": "%.2f" % (trace.duration * 1000),
+                "phases": ["%.2f" % (seconds * 1000) for seconds in trace.phases.values()],
+            })
+        return panel_template.render(template.Context({
+            "phases": tracing.phases,
+            "rows": rows,
+        }))
+
+panel_template = template.Template("""
+<table>
+  <thead>
+    <tr>
+      <th>Type</th><th>Size</th><th>Points</th><th>URL length</th><th>Total (ms)</th>
+      {% for phase in phases %}<th>{{ phase }} (ms)</th>{% endfor %}
+    </tr>
+  </thead>
+  <tbody>
+    {% for row in rows %}
+      <tr class="{% cycle 'djDebugOdd' 'djDebugEven' %}">
+        <td>{{ row.trace.type }}</td>
+        <td>{{ row.trace.size }}</td>
+        <td>{{ row.trace.points }}</td>
+        <td>{% if row.trace.cached %}cached{% else %}{{ row.trace.url_length }}{% endif %}</td>
+        <td>{{ row.duration }}</td>
+        {% for seconds in row.phases %}<td>{{ seconds }}</td>{% endfor %}
+      </tr>
+    {% endfor %}
+  </tbody>
+</table>
+""")
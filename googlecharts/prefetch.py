@@ -0,0 +1,150 @@
+"""
+Getting the images of every saveas chart in a template at once.
+
+Inside {% chart-prefetch %}, charts whose images haven't been saved yet get
+a placeholder instead of being drawn (or fetched) on the spot. When the block
+is done, the missing images are made in parallel on a thread pool, and the
+placeholders are replaced with their URLs -- or with the charts' own URLs for
+images that aren't ready within the time budget.
+"""
+import re
+import time
+import Queue
+import random
+import threading
+
+from django.conf import settings
+from django.utils.html import escape
+
+# The Prefetcher collecting images for the template being rendered in this
+# thread, if any.
+_local = threading.local()
+
+def current():
+    return getattr(_local, "prefetcher", None)
+
+def activate(prefetcher):
+    """Make prefetcher (or None) the current one; returns the previous one."""
+    previous = current()
+    _local.prefetcher = prefetcher
+    return previous
+
+class Timeout(Exception):
+    pass
+
+class ThreadPool(object):
+    """A fixed number of daemon threads working through a queue of calls."""
+    def __init__(self, size):
+        self.queue = Queue.Queue()
+        for i in range(size):
+            thread = threading.Thread(target=self.work)
+            thread.setDaemon(True)
+            thread.start()
+
+    def work(self):
+        while True:
+            result, func, args = self.queue.get()
+            result.run(func, args)
+
+    def apply_async(self, func, args=()):
+        """Call func(*args) on one of the threads; returns a Result."""
+        result = Result()
+        self.queue.put((result, func, args))
+        return result
+
+class Result(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = self.error = None
+
+    def run(self, func, args):
+        try:
+            self.value = func(*args)
+        except Exception, e:
+            self.error = e
+        self.done.set()
+
+    def get(self, timeout=None):
+        """
+        The call's return value, waiting up to timeout seconds for it. Raises
+        Timeout if it isn't done by then, or whatever the call raised.
+        """
+        self.done.wait(timeout)
+        if not self.done.isSet():
+            raise Timeout
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    The thread pool images are made on, GOOGLECHARTS_PREFETCH_THREADS threads
+    (8 by default) shared by the whole process. Each thread keeps its own
+    keep-alive connections; see googlecharts.storage.http_get().
+    """
+    global _pool
+    if _pool is None:
+        _pool_lock.acquire()
+        try:
+            if _pool is None:
+                _pool = ThreadPool(getattr(settings, "GOOGLECHARTS_PREFETCH_THREADS", 8))
+        finally:
+            _pool_lock.release()
+    return _pool
+
+class Prefetcher(object):
+    def __init__(self, budget=None):
+        if budget is None:
+            budget = getattr(settings, "GOOGLECHARTS_PREFETCH_BUDGET", 2.0)
+        # How long to wait for the images, in seconds.
+        self.budget = float(budget)
+        self.token = "%08x" % random.getrandbits(32)
+        # (placeholder, store, url) for each missing image
+        self.missing = []
+        self.placeholders = {}
+        self.placeholder_re = re.compile(r"googlecharts-prefetch-%s-(\d+)" % self.token)
+
+    def url(self, store, url):
+        """
+        The URL for the image of the chart at url, in store: its stored
+        URL if it's been saved, or a placeholder.
+        """
+        name = store.name(url)
+        if name in self.placeholders:
+            return self.placeholders[name]
+        if store.storage.exists(name):
+            return store.storage.url(name)
+        placeholder = "googlecharts-prefetch-%s-%d" % (self.token, len(self.missing))
+        self.placeholders[name] = placeholder
+        self.missing.append((placeholder, store, url))
+        return placeholder
+
+    def resolve(self, output):
+        """
+        Make the missing images and put their URLs in output. Images that
+        take longer than the budget (or fail) are replaced with the chart's
+        own URL; they're still saved when they're done, ready for next time.
+        """
+        if not self.missing:
+            return output
+        pool = get_pool()
+        results = [(url, pool.apply_async(store.url, (url,)))
+                   for placeholder, store, url in self.missing]
+        deadline = time.time() + self.budget
+        urls = []
+        for url, result in results:
+            try:
+                url = result.get(max(deadline - time.time(), 0))
+            except Exception:
+                # Too slow (a Timeout), or drawing or fetching the image
+                # failed: leave the chart's own URL.
+                pass
+            urls.append(escape(url))
+        self.missing = []
+        # All the placeholders are replaced in one pass; replacing them one
+        # at a time would also replace the start of longer ones ("-1" in
+        # "-12").
+        return self.placeholder_re.sub(lambda match: urls[int(match.group(1))], output)
@@ -0,0 +1,47 @@
+"""
+Draw charts locally instead of with the Google Chart API.
+
+The renderer reads the same options as the chart API -- it works from a
+chart's URL -- and draws line, sparkline, xy, bar, pie and scatter charts::
+
+    from googlecharts.render import render
+    png = render(chart)                 # a Chart, a ChartSpec or a URL
+    svg = render(chart, "svg")
+
+SVG output is pure Python; PNG output needs PIL. Other formats can be added
+with the GOOGLECHARTS_RENDER_BACKENDS setting, a dict mapping format names
+to the import paths of Canvas subclasses.
+"""
+from django.conf import settings
+from django.utils.importlib import import_module
+
+from googlecharts.render.parse import ChartImage, RenderError
+from googlecharts.render.draw import draw
+
+backends = {
+    "svg": "googlecharts.render.svg.SVGCanvas",
+    "png": "googlecharts.render.png.PNGCanvas",
+}
+
+def get_canvas_class(format):
+    """The Canvas subclass that draws images in `format`."""
+    path = getattr(settings, "GOOGLECHARTS_RENDER_BACKENDS", {}).get(format) or backends.get(format)
+    if not path:
+        raise RenderError("Can't draw %r images" % format)
+    module, name = path.rsplit(".", 1)
+    return getattr(import_module(module), name)
+
+def render(chart, format="png"):
+    """
+    Draw a chart -- a Chart, a ChartSpec or a chart URL -- and return the
+    image as a string.
+    """
+    if not isinstance(chart, basestring):
+        chart = chart.url()
+    return render_image(ChartImage.from_url(chart), format).getvalue()
+
+def render_image(image, format="png"):
+    """Draw a ChartImage onto a new canvas, and return the canvas."""
+    canvas = get_canvas_class(format)(image.width, image.height)
+    draw(image, canvas)
+    return canvas
@@ -0,0 +1,98 @@
+"""
+The drawing surface charts are rendered onto.
+"""
+import math
+
+class Canvas(object):
+    """
+    Something to draw charts on. Coordinates are in pixels from the top left
+    corner, and colors are (r, g, b, a) tuples.
+
+    Subclasses implement rect(), polygon(), circle(), text() and getvalue(),
+    and either line() or polyline().
+    """
+    content_type = None
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+    def rect(self, x, y, width, height, color):
+        raise NotImplementedError
+
+    def polygon(self, points, color):
+        raise NotImplementedError
+
+    def circle(self, x, y, radius, color):
+        raise NotImplementedError
+
+    def text(self, x, y, text, color, size, anchor="start"):
+        """
+        Write text with its vertical middle at y; anchor says whether x is
+        the "start", "middle" or "end" of the text.
+        """
+        raise NotImplementedError
+
+    def line(self, points, color, width):
+        """A solid line through points."""
+        raise NotImplementedError
+
+    def getvalue(self):
+        """The image, as a string."""
+        raise NotImplementedError
+
+    def polyline(self, points, color, width=1, dash=None):
+        """
+        A line through points; dash is a (line length, space length) pair
+        for a dashed line.
+        """
+        if dash and dash[1]:
+            for segment in dashes(points, dash):
+                self.line(segment, color, width)
+        else:
+            self.line(points, color, width)
+
+    def wedge(self, x, y, radius, start, end, color, tilt=1.0):
+        """
+        A pie slice from angle start to end (in radians, clockwise from three
+        o'clock); tilt squashes the pie vertically.
+        """
+        steps = max(int(abs(end - start) * radius / 3), 2)
+        points = [(x, y)]
+        for i in range(steps + 1):
+            angle = start + (end - start) * i / steps
+            points.append((x + radius * math.cos(angle), y + radius * math.sin(angle) * tilt))
+        self.polygon(points, color)
+
+    def text_width(self, text, size):
+        return len(text) * size * 0.6
+
+def dashes(points, dash):
+    """Split the line through points into the dashes of a dashed line."""
+    on, off = dash
+    if on <= 0 or off <= 0:
+        # Not dashed
+        return [points]
+    segments = []
+    segment = [points[0]]
+    drawing, left = True, on
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        length = math.hypot(x2 - x1, y2 - y1)
+        done = 0.0
+        while length - done > left:
+            done += left
+            point = (x1 + (x2 - x1) * done / length, y1 + (y2 - y1) * done / length)
+            if drawing:
+                segment.append(point)
+                segments.append(segment)
+            segment = [point]
+            drawing = not drawing
+            left = drawing and on or off
+        left -= length - done
+        if drawing:
+            segment.append((x2, y2))
+        else:
+            segment = [(x2, y2)]
+    if drawing and len(segment) > 1:
+        segments.append(segment)
+    return segments
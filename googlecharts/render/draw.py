@@ -0,0 +1,647 @@
+"""
+Drawing a ChartImage onto a canvas.
+"""
+import math
+
+from googlecharts.render.parse import RenderError, parse_color
+
+default_color = (0xFF, 0x99, 0x00, 0xFF)
+white = (0xFF, 0xFF, 0xFF, 0xFF)
+black = (0x00, 0x00, 0x00, 0xFF)
+grid_color = (0xCC, 0xCC, 0xCC, 0xFF)
+
+def draw(image, canvas, x=0, y=0):
+    """
+    Draw image (a ChartImage) onto canvas, with its top left corner at (x, y).
+    """
+    try:
+        plot_class = plots[image.type]
+    except KeyError:
+        raise RenderError("Can't draw %r charts" % image.type)
+    plot_class(image, canvas, x, y).draw()
+
+class Plot(object):
+    """
+    Draws everything but the data: the background, title, legend, grid, axes
+    and markers. The data is drawn inside the plot area, from (left, top) to
+    (right, bottom), by draw_data().
+    """
+    # Space between the plot area and anything around it.
+    padding = 4
+    line_width = 2
+    font_size = 11
+
+    def __init__(self, image, canvas, x=0, y=0):
+        self.image = image
+        self.canvas = canvas
+        self.x, self.y = x, y
+        self.left, self.top = x, y
+        self.right, self.bottom = x + image.width, y + image.height
+
+    def draw(self):
+        self.layout()
+        self.draw_background()
+        self.draw_title()
+        self.draw_legend()
+        self.draw_range_markers()
+        self.draw_grid()
+        self.draw_data()
+        self.draw_markers()
+        self.draw_axes()
+
+    #
+    # Layout
+    #
+    def layout(self):
+        """Make room around the plot area for the title, legend and axes."""
+        image, canvas = self.image, self.canvas
+        if image.title:
+            self.top += len(image.title) * (self.title_size() + 4) + self.padding
+        if image.legend:
+            width = max(canvas.text_width(label, self.font_size) for label in image.legend)
+            self.right -= width + 14 + self.padding
+        self.axis_offsets = {}
+        for axis in image.axes:
+            self.axis_offsets.setdefault(axis.side, []).append(self.axis_space(axis))
+        self.left += sum(self.axis_offsets.get("y", []))
+        self.right -= sum(self.axis_offsets.get("r", []))
+        self.top += sum(self.axis_offsets.get("t", []))
+        self.bottom -= sum(self.axis_offsets.get("x", []))
+        if image.title or image.legend or image.axes:
+            self.left += self.padding
+            self.top += self.padding
+            self.right -= self.padding
+            self.bottom -= self.padding
+        self.right = max(self.right, self.left + 1)
+        self.bottom = max(self.bottom, self.top + 1)
+
+    def axis_space(self, axis):
+        if axis.side in ("x", "t"):
+            return axis.size + 6
+        widths = [self.canvas.text_width(text, axis.size) for position, text in axis.labels]
+        return max(widths or [0]) + 6
+
+    def px(self, fraction):
+        return self.left + fraction * (self.right - self.left)
+
+    def py(self, fraction):
+        return self.bottom - fraction * (self.bottom - self.top)
+
+    #
+    # Colors
+    #
+    def series_color(self, i):
+        colors = self.image.colors or [default_color]
+        return colors[i % len(colors)]
+
+    def point_color(self, i, j):
+        if self.image.point_colors and self.image.visible == 1:
+            return self.series_color(j)
+        return self.series_color(i)
+
+    def legend_colors(self):
+        return [self.series_color(i) for i in range(len(self.image.legend))]
+
+    #
+    # Everything but the data
+    #
+    def draw_background(self):
+        image = self.image
+        fills = dict((area, (kind, args)) for area, kind, args in image.fills)
+        kind, args = fills.get("bg", ("s", ["FFFFFF"]))
+        self.fill(self.x, self.y, image.width, image.height, kind, args)
+        if "c" in fills:
+            kind, args = fills["c"]
+            self.fill(self.left, self.top, self.right - self.left, self.bottom - self.top, kind, args)
+
+    def fill(self, x, y, width, height, kind, args):
+        """
+        Fill a rectangle. Gradients and stripes run horizontally when their
+        angle is under 45 degrees and vertically otherwise.
+        """
+        canvas = self.canvas
+        if kind == "s":
+            canvas.rect(x, y, width, height, parse_color(args[0]))
+            return
+        angle = float(args[0])
+        stops = [(parse_color(c), float(o)) for c, o in zip(args[1::2], args[2::2])]
+        if not stops:
+            return
+        horizontal = abs(angle) % 180 < 45
+        if horizontal:
+            length = width
+        else:
+            length = height
+        if kind == "lg":
+            # Draw the gradient as two-pixel bands, from left to right or
+            # bottom to top.
+            for start in range(0, int(math.ceil(length)), 2):
+                color = gradient(stops, (start + 1.0) / length)
+                if horizontal:
+                    canvas.rect(x + start, y, min(2, length - start), height, color)
+                else:
+                    canvas.rect(x, y + height - start - 2, width, min(2, length - start), color)
+        elif kind == "ls":
+            # Stripe widths are fractions of the chart's size; the stripes
+            # repeat until the area's full.
+            position, i = 0.0, 0
+            while position < length:
+                color, size = stops[i % len(stops)]
+                size = max(size * length, 1)
+                if horizontal:
+                    canvas.rect(x + position, y, min(size, length - position), height, color)
+                else:
+                    canvas.rect(x, y + position, width, min(size, length - position), color)
+                position += size
+                i += 1
+
+    def title_size(self):
+        style = self.image.title_style
+        if len(style) > 1 and style[1]:
+            return float(style[1])
+        return 12
+
+    def draw_title(self):
+        image = self.image
+        if not image.title:
+            return
+        style = image.title_style
+        color = style and style[0] and parse_color(style[0]) or black
+        size = self.title_size()
+        y = self.y + self.padding + size / 2.0
+        for line in image.title:
+            self.canvas.text(self.x + image.width / 2.0, y, line, color, size, "middle")
+            y += size + 4
+
+    def draw_legend(self):
+        image = self.image
+        if not image.legend:
+            return
+        colors = self.legend_colors()
+        height = len(image.legend) * (self.font_size + 4)
+        x = self.x + image.width - self.padding - max(
+            self.canvas.text_width(label, self.font_size) for label in image.legend) - 14
+        y = self.top + (self.bottom - self.top - height) / 2.0
+        for label, color in zip(image.legend, colors):
+            middle = y + (self.font_size + 4) / 2.0
+            self.canvas.rect(x, middle - 4, 8, 8, color)
+            self.canvas.text(x + 12, middle, label, black, self.font_size)
+            y += self.font_size + 4
+
+    def draw_grid(self):
+        grid = self.image.grid
+        if not grid:
+            return
+        xstep, ystep = (grid + [0, 0])[:2]
+        # Grid lines are dashed, 4 pixels on and 1 off, unless chg says otherwise.
+        dash = (grid + [4, 1][len(grid) - 2:])[2:4]
+        for step, vertical in ((xstep, True), (ystep, False)):
+            if step <= 0:
+                continue
+            position = step
+            while position < 100:
+                if vertical:
+                    x = self.px(position / 100.0)
+                    points = [(x, self.top), (x, self.bottom)]
+                else:
+                    y = self.py(position / 100.0)
+                    points = [(self.left, y), (self.right, y)]
+                self.canvas.polyline(points, grid_color, 1, dash)
+                position += step
+
+    def draw_range_markers(self):
+        for marker in self.image.markers:
+            if marker[0] not in ("r", "R") or len(marker) < 5:
+                continue
+            color = parse_color(marker[1])
+            start, end = sorted([float(marker[3]), float(marker[4])])
+            if marker[0] == "r":
+                self.canvas.rect(self.left, self.py(end), self.right - self.left,
+                                 max(self.py(start) - self.py(end), 1), color)
+            else:
+                self.canvas.rect(self.px(start), self.top, max(self.px(end) - self.px(start), 1),
+                                 self.bottom - self.top, color)
+
+    def draw_markers(self):
+        """Shape markers, on data points, and horizontal and vertical lines."""
+        canvas = self.canvas
+        for marker in self.image.markers:
+            if marker[0] in ("r", "R", "B", "b") or len(marker) < 5:
+                continue
+            kind, color = marker[0], parse_color(marker[1])
+            size = float(marker[4] or 0)
+            if kind == "h":
+                y = self.py(float(marker[3]))
+                canvas.polyline([(self.left, y), (self.right, y)], color, size)
+                continue
+            for x, y in self.marker_points(int(marker[2]), marker[3]):
+                draw_shape(canvas, kind, x, y, size, color, self)
+
+    def marker_points(self, series, point):
+        """The points a marker on `point` (an index, or -1 for all) goes on."""
+        points = self.data_points(series)
+        if point == "-1":
+            return [p for p in points if p is not None]
+        index = float(point)
+        low = int(math.floor(index))
+        if not 0 <= low < len(points) or points[low] is None:
+            return []
+        high = min(low + 1, len(points) - 1)
+        if points[high] is None or high == low:
+            return [points[low]]
+        fraction = index - low
+        (x1, y1), (x2, y2) = points[low], points[high]
+        return [(x1 + (x2 - x1) * fraction, y1 + (y2 - y1) * fraction)]
+
+    def data_points(self, series):
+        """The points in a series, as (x, y) pixels, for markers."""
+        return []
+
+    def draw_axes(self):
+        canvas = self.canvas
+        offsets = {}
+        for axis in self.image.axes:
+            side = axis.side
+            offset = offsets.get(side, 0)
+            offsets[side] = offset + self.axis_space(axis)
+            if side == "x":
+                y = self.bottom + offset
+                if axis.line:
+                    canvas.polyline([(self.left, y), (self.right, y)], axis.color, 1)
+                for position, text in axis.labels:
+                    if text:
+                        canvas.text(self.px(position), y + 3 + axis.size / 2.0, text,
+                                    axis.color, axis.size, "middle")
+            elif side == "t":
+                y = self.top - offset
+                if axis.line:
+                    canvas.polyline([(self.left, y), (self.right, y)], axis.color, 1)
+                for position, text in axis.labels:
+                    if text:
+                        canvas.text(self.px(position), y - 3 - axis.size / 2.0, text,
+                                    axis.color, axis.size, "middle")
+            elif side in ("y", "r"):
+                if side == "y":
+                    x, anchor, gap = self.left - offset, "end", -3
+                else:
+                    x, anchor, gap = self.right + offset, "start", 3
+                if axis.line:
+                    canvas.polyline([(x, self.top), (x, self.bottom)], axis.color, 1)
+                for position, text in axis.labels:
+                    if text:
+                        canvas.text(x + gap, self.py(position), text, axis.color, axis.size, anchor)
+
+    def draw_data(self):
+        raise NotImplementedError
+
+class LinePlot(Plot):
+    """Line charts ("lc"), with each series' points spread evenly across."""
+
+    def data_points(self, series):
+        if series >= len(self.image.series):
+            return []
+        values = self.image.series[series]
+        points = []
+        for x, value in zip(spread(len(values)), values):
+            if value is None:
+                points.append(None)
+            else:
+                points.append((self.px(x), self.py(value)))
+        return points
+
+    def draw_data(self):
+        self.draw_fill_areas()
+        styles = self.image.line_styles
+        for i in range(self.image.visible):
+            style = i < len(styles) and styles[i] or []
+            width = style and style[0] or self.line_width
+            dash = len(style) > 2 and style[1:3] or None
+            for run in runs(self.data_points(i)):
+                self.canvas.polyline(run, self.series_color(i), width, dash)
+
+    def draw_fill_areas(self):
+        """
+        "B" markers fill the area under a line; "b" markers fill between
+        two lines.
+        """
+        for marker in self.image.markers:
+            if marker[0] not in ("B", "b") or len(marker) < 4:
+                continue
+            color = parse_color(marker[1])
+            upper = [p for p in self.data_points(int(marker[2])) if p is not None]
+            if not upper:
+                continue
+            if marker[0] == "B":
+                lower = [(upper[-1][0], self.bottom), (upper[0][0], self.bottom)]
+            else:
+                lower = [p for p in self.data_points(int(marker[3])) if p is not None]
+                lower.reverse()
+            self.canvas.polygon(upper + lower, color)
+
+class SparklinePlot(LinePlot):
+    """Sparklines ("ls"), line charts that use all of the image."""
+    padding = 0
+
+class XYPlot(LinePlot):
+    """
+    Line charts with x values ("lxy"): the series come in pairs, x values
+    then y values. An x series with a single missing value spreads the
+    points evenly.
+    """
+    def data_points(self, series):
+        all_series = self.image.series
+        pair = series * 2
+        if pair + 1 >= len(all_series):
+            return []
+        xs, ys = all_series[pair], all_series[pair + 1]
+        if len(xs) == 1 and xs[0] is None or not xs:
+            xs = spread(len(ys))
+        points = []
+        for x, y in zip(xs, ys):
+            if x is None or y is None:
+                points.append(None)
+            else:
+                points.append((self.px(x), self.py(y)))
+        return points
+
+    def draw_data(self):
+        self.draw_fill_areas()
+        styles = self.image.line_styles
+        for i in range(self.image.visible // 2):
+            style = i < len(styles) and styles[i] or []
+            width = style and style[0] or self.line_width
+            dash = len(style) > 2 and style[1:3] or None
+            for run in runs(self.data_points(i)):
+                self.canvas.polyline(run, self.series_color(i), width, dash)
+
+class ScatterPlot(Plot):
+    """
+    Scatter plots ("s"): x values, y values and, optionally, point sizes.
+    """
+    point_size = 9
+
+    def data_points(self, series):
+        all_series = self.image.series
+        if not all_series:
+            return []
+        if len(all_series) == 1:
+            ys = all_series[0]
+            xs = spread(len(ys))
+        else:
+            xs, ys = all_series[0], all_series[1]
+        points = []
+        for x, y in zip(xs, ys):
+            if x is None or y is None:
+                points.append(None)
+            else:
+                points.append((self.px(x), self.py(y)))
+        return points
+
+    def draw_data(self):
+        series = self.image.series
+        sizes = len(series) > 2 and series[2] or []
+        for j, point in enumerate(self.data_points(0)):
+            if point is None:
+                continue
+            size = self.point_size
+            if j < len(sizes) and sizes[j] is not None:
+                size *= sizes[j]
+            self.canvas.circle(point[0], point[1], size / 2.0, self.point_color(0, j))
+
+class BarPlot(Plot):
+    """
+    Bar charts: grouped ("bvg", "bhg") or stacked ("bvs", "bhs"), vertical
+    or horizontal. chbh sets the width of the bars and the space between
+    bars and groups; they're scaled down if the bars wouldn't fit.
+    """
+    bar_width = 23
+    bar_space = 4
+    group_space = 8
+
+    def __init__(self, *args, **kwargs):
+        super(BarPlot, self).__init__(*args, **kwargs)
+        self.horizontal = self.image.type.startswith("bh")
+        self.stacked = self.image.type.endswith("s")
+        # The middle of each bar and the value at its top, by (series, index)
+        self.tops = {}
+
+    def bar_sizes(self, groups, bars):
+        """Work out the width of each bar and of the spaces between them."""
+        sizes = [self.bar_width, self.bar_space, self.group_space]
+        auto = False
+        for i, size in enumerate(self.image.bar_width[:3]):
+            if size in ("a", "r"):
+                auto = True
+            elif size:
+                sizes[i] = float(size)
+        width, space, group_space = sizes
+        length = self.horizontal and self.bottom - self.top or self.right - self.left
+        total = groups * (bars * width + (bars - 1) * space) + (groups - 1) * group_space
+        if total and (auto or total > length):
+            scale = float(length) / total
+            width, space, group_space = width * scale, space * scale, group_space * scale
+        return width, space, group_space
+
+    def bar(self, start, width, lower, upper, color):
+        """Draw a bar `start` pixels along the category axis."""
+        if self.horizontal:
+            x1, x2 = self.px(lower), self.px(upper)
+            self.canvas.rect(min(x1, x2), self.top + start, abs(x2 - x1), width, color)
+        else:
+            y1, y2 = self.py(lower), self.py(upper)
+            self.canvas.rect(self.left + start, min(y1, y2), width, abs(y2 - y1), color)
+
+    def draw_data(self):
+        series = self.image.series[:self.image.visible]
+        if not series:
+            return
+        groups = max(len(s) for s in series)
+        bars = self.stacked and 1 or len(series)
+        width, space, group_space = self.bar_sizes(groups, bars)
+        if self.stacked:
+            # The spaces between stacked bars are bar spaces.
+            group_space = space
+        position = 0.0
+        for j in range(groups):
+            base = 0.0
+            for i, values in enumerate(series):
+                value = j < len(values) and values[j] or 0.0
+                if self.stacked:
+                    self.bar(position, width, base, base + value, self.point_color(i, j))
+                    self.tops[i, j] = (position + width / 2.0, base + value)
+                    base += value
+                else:
+                    self.bar(position, width, 0.0, value, self.point_color(i, j))
+                    self.tops[i, j] = (position + width / 2.0, value)
+                    position += width + space
+            if self.stacked:
+                position += width + group_space
+            else:
+                position += group_space - space
+
+    def data_points(self, series):
+        points = []
+        for j in range(max([len(s) for s in self.image.series] or [0])):
+            if (series, j) not in self.tops:
+                points.append(None)
+                continue
+            middle, value = self.tops[series, j]
+            if self.horizontal:
+                points.append((self.px(value), self.top + middle))
+            else:
+                points.append((self.left + middle, self.py(value)))
+        return points
+
+class PiePlot(Plot):
+    """
+    Pie charts ("p"), drawn from the first series. The slices go clockwise
+    from three o'clock, or from chp radians past it.
+    """
+    tilt = 1.0
+    depth = 0
+
+    def layout(self):
+        super(PiePlot, self).layout()
+        # Pies don't have axes, but may have labels around them.
+        self.left += self.padding
+        self.right -= self.padding
+        self.top += self.padding
+        self.bottom -= self.padding
+
+    def slice_colors(self, count):
+        """
+        One color per slice: the chart's colors if there are enough of them,
+        or shades of the first color otherwise.
+        """
+        colors = self.image.colors
+        if len(colors) >= count:
+            return colors[:count]
+        base = colors and colors[0] or default_color
+        return [lighten(base, 0.75 * j / max(count - 1, 1)) for j in range(count)]
+
+    def legend_colors(self):
+        values = self.image.series and self.image.series[0] or []
+        return self.slice_colors(max(len(values), len(self.image.legend)))
+
+    def draw_data(self):
+        image, canvas = self.image, self.canvas
+        values = [v or 0.0 for v in (image.series and image.series[0] or [])]
+        total = sum(values)
+        if total <= 0:
+            return
+        colors = self.slice_colors(len(values))
+
+        label_width = max([canvas.text_width(l, self.font_size) for l in image.labels] or [0])
+        label_space = label_width and label_width + 8 or 0
+        x = (self.left + self.right) / 2.0
+        y = (self.top + self.bottom) / 2.0
+        radius = max(min((self.right - self.left) / 2.0 - label_space,
+                         ((self.bottom - self.top) / 2.0 - (label_space and self.font_size) - self.depth) / self.tilt), 1)
+        depth = self.depth and radius * self.depth
+        y -= depth / 2.0
+
+        angles = []
+        start = image.orientation
+        for value in values:
+            end = start + 2 * math.pi * value / total
+            angles.append((start, end))
+            start = end
+
+        # The side of a 3D pie, then the top
+        for offset in range(int(depth), 0, -1):
+            for (start, end), color in zip(angles, colors):
+                canvas.wedge(x, y + offset, radius, start, end, darken(color, 0.7), self.tilt)
+        for (start, end), color in zip(angles, colors):
+            if end > start:
+                canvas.wedge(x, y, radius, start, end, color, self.tilt)
+
+        for (start, end), label in zip(angles, image.labels):
+            if not label:
+                continue
+            middle = (start + end) / 2.0
+            cos, sin = math.cos(middle), math.sin(middle)
+            canvas.text(x + (radius + 6) * cos, y + (radius * self.tilt + 6) * sin + (sin > 0 and depth or 0),
+                        label, black, self.font_size, cos < 0 and "end" or "start")
+
+class Pie3DPlot(PiePlot):
+    """3D pie charts ("p3"): a tilted pie with a side."""
+    tilt = 0.5
+    depth = 0.15
+
+plots = {
+    "lc": LinePlot,
+    "ls": SparklinePlot,
+    "lxy": XYPlot,
+    "bvg": BarPlot,
+    "bhg": BarPlot,
+    "bvs": BarPlot,
+    "bhs": BarPlot,
+    "p": PiePlot,
+    "p3": Pie3DPlot,
+    "pc": PiePlot,
+    "s": ScatterPlot,
+}
+
+#
+# Helpers
+#
+def draw_shape(canvas, kind, x, y, size, color, plot):
+    """Draw a chm shape marker centered on (x, y)."""
+    half = size / 2.0
+    if kind == "s":
+        canvas.rect(x - half, y - half, size, size, color)
+    elif kind == "d":
+        canvas.polygon([(x, y - half), (x + half, y), (x, y + half), (x - half, y)], color)
+    elif kind == "c":
+        canvas.polyline([(x - half, y), (x + half, y)], color, 2)
+        canvas.polyline([(x, y - half), (x, y + half)], color, 2)
+    elif kind == "x":
+        canvas.polyline([(x - half, y - half), (x + half, y + half)], color, 2)
+        canvas.polyline([(x - half, y + half), (x + half, y - half)], color, 2)
+    elif kind == "v":
+        canvas.polyline([(x, y), (x, plot.bottom)], color, size)
+    elif kind == "V":
+        canvas.polyline([(x, plot.top), (x, plot.bottom)], color, size)
+    else:
+        canvas.circle(x, y, half, color)
+
+def spread(count):
+    """Positions (0..1) for count points spread evenly across the chart."""
+    if count == 1:
+        return [0.5]
+    return [float(i) / (count - 1) for i in range(count)]
+
+def runs(points):
+    """Split a list of points into the runs between missing (None) points."""
+    result, run = [], []
+    for point in points:
+        if point is None:
+            if run:
+                result.append(run)
+            run = []
+        else:
+            run.append(point)
+    if run:
+        result.append(run)
+    # A single point still gets drawn, as a very short line.
+    return [len(run) > 1 and run or run * 2 for run in result]
+
+def gradient(stops, position):
+    """The color at `position` (0..1) along a gradient of (color, offset) stops."""
+    stops = sorted(stops, key=lambda stop: stop[1])
+    if position <= stops[0][1]:
+        return stops[0][0]
+    for (color1, offset1), (color2, offset2) in zip(stops, stops[1:]):
+        if position <= offset2:
+            fraction = (position - offset1) / ((offset2 - offset1) or 1)
+            return mix(color1, color2, fraction)
+    return stops[-1][0]
+
+def mix(color1, color2, fraction):
+    return tuple(int(round(a + (b - a) * fraction)) for a, b in zip(color1, color2))
+
+def lighten(color, fraction):
+    return mix(color, white[:3] + color[3:], fraction)
+
+def darken(color, fraction):
+    return tuple(int(c * fraction) for c in color[:3]) + color[3:]
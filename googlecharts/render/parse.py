@@ -0,0 +1,282 @@
+"""
+Decoding chart API options into a ChartImage, something that can be drawn.
+"""
+import re
+
+try:
+    from urlparse import parse_qsl
+except ImportError:
+    from cgi import parse_qsl
+
+from django.utils.encoding import force_unicode
+
+class RenderError(ValueError):
+    """The options don't describe a chart that can be drawn."""
+
+# The chart API's limits on the size of a chart.
+max_side = 1000
+max_pixels = 300000
+
+default_size = "200x200"
+
+# Grid lines are drawn at least this far apart, in percent of the chart, and
+# dashes are at least this many pixels long: closer lines or shorter dashes
+# can't be seen, and would take forever to draw.
+min_grid_step = 1.0
+min_dash = 1.0
+
+#
+# Data
+#
+extended_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-."
+_char_values = dict((c, i) for i, c in enumerate(extended_chars))
+
+def decode_data(chd, chds=None):
+    """
+    Decode the chd option. Returns a list of series, with each point scaled
+    to 0..1 (None for missing points), and the number of visible series.
+    """
+    if not chd:
+        return [], 0
+    prefix, data = chd.split(":", 1)
+    encoding, visible = prefix[:1], prefix[1:]
+    if encoding == "e":
+        series = [decode_extended(s) for s in data.split(",")]
+    elif encoding == "s":
+        series = [decode_simple(s) for s in data.split(",")]
+    elif encoding == "t":
+        series = decode_text(data, chds)
+    else:
+        raise RenderError("Unknown data encoding %r" % encoding)
+    if visible:
+        visible = min(int(visible), len(series))
+    else:
+        visible = len(series)
+    return series, visible
+
+def decode_extended(s):
+    values = []
+    for i in xrange(0, len(s) - 1, 2):
+        pair = s[i:i+2]
+        if pair == "__":
+            values.append(None)
+        else:
+            try:
+                values.append((_char_values[pair[0]] * 64 + _char_values[pair[1]]) / 4095.0)
+            except KeyError:
+                raise RenderError("Bad extended data %r" % pair)
+    return values
+
+def decode_simple(s):
+    values = []
+    for c in s:
+        if c == "_":
+            values.append(None)
+        else:
+            try:
+                values.append(_char_values[c] / 61.0)
+            except KeyError:
+                raise RenderError("Bad simple data %r" % c)
+    return values
+
+def decode_text(data, chds=None):
+    """
+    Text data is scaled by chds: a min,max pair for each series (the last
+    pair is used for any series left over), or 0..100 if there isn't one.
+    """
+    scales = pairs(floats(chds)) or [(0.0, 100.0)]
+    series = []
+    for i, s in enumerate(data.split("|")):
+        lower, upper = scales[min(i, len(scales) - 1)]
+        span = (upper - lower) or 1.0
+        values = []
+        for n in s.split(","):
+            if n in ("", "_"):
+                values.append(None)
+            else:
+                values.append((float(n) - lower) / span)
+        series.append(values)
+    return series
+
+#
+# Everything else
+#
+class ChartImage(object):
+    """
+    A chart described by chart API options, decoded: its type and size, the
+    data scaled to 0..1, colors, fills, axes and markers.
+    """
+    def __init__(self, options):
+        self.options = options = dict((k, force_unicode(v)) for k, v in options.items())
+        self.type = options.get("cht") or "lc"
+        self.width, self.height = parse_size(options.get("chs") or default_size)
+        self.series, self.visible = decode_data(options.get("chd"), options.get("chds"))
+
+        # Series are separated by commas; "|" gives each bar (or slice) its
+        # own color.
+        chco = options.get("chco") or ""
+        self.colors = [parse_color(c) for c in re.split(r"[,|]", chco) if c]
+        self.point_colors = "|" in chco
+
+        self.fills = parse_fills(options.get("chf"))
+        self.title = split(options.get("chtt"), "|")
+        self.title_style = split(options.get("chts"), ",")
+        self.legend = split(options.get("chdl"), "|")
+        self.labels = split(options.get("chl"), "|")
+        self.line_styles = [parse_line_style(s) for s in split(options.get("chls"), "|")]
+        self.grid = parse_grid(options.get("chg"))
+        self.bar_width = split(options.get("chbh"), ",")
+        self.orientation = number(options.get("chp"))
+        self.markers = [m.split(",") for m in split(options.get("chm"), "|")]
+        self.axes = parse_axes(options)
+
+    @classmethod
+    def from_url(cls, url):
+        """Decode a chart's URL, or just its query string."""
+        query = url.split("?", 1)[-1]
+        return cls(dict(parse_qsl(str(query), True)))
+
+class ImageAxis(object):
+    """
+    One of a chart's axes: its side ("x", "y", "t" or "r") and its labels,
+    as (position, text) pairs with positions from 0 to 1.
+    """
+    def __init__(self, side, labels, color="666666", size=11, line=True):
+        self.side = side
+        self.labels = labels
+        self.color = parse_color(color)
+        self.size = size
+        self.line = line
+
+def parse_axes(options):
+    sides = split(options.get("chxt"), ",")
+    if not sides:
+        return []
+
+    labels, positions, ranges, styles = {}, {}, {}, {}
+    index = None
+    for label in split(options.get("chxl"), "|"):
+        match = re.match(r"^(\d+):$", label)
+        if match:
+            index = int(match.group(1))
+            labels[index] = []
+        elif index is not None:
+            labels[index].append(label)
+    for option, values in ((positions, "chxp"), (ranges, "chxr"), (styles, "chxs")):
+        for value in split(options.get(values), "|"):
+            value = value.split(",")
+            option[int(value[0])] = value[1:]
+
+    axes = []
+    for i, side in enumerate(sides):
+        lower, upper = (floats(",".join(ranges.get(i, [])[:2])) or [0.0, 100.0])[:2]
+        span = (upper - lower) or 1.0
+        texts = labels.get(i)
+        if texts is None:
+            # Label the range with evenly spaced values
+            texts = ["%g" % (lower + span * n / 5.0) for n in range(6)]
+        if i in positions:
+            places = [(p - lower) / span for p in floats(",".join(positions[i]))]
+        elif len(texts) > 1:
+            places = [n / float(len(texts) - 1) for n in range(len(texts))]
+        else:
+            places = [0.0]
+
+        style = styles.get(i, [])
+        axis = ImageAxis(side, zip(places, texts))
+        if len(style) > 0 and style[0]:
+            axis.color = parse_color(style[0])
+        if len(style) > 1 and style[1]:
+            axis.size = float(style[1])
+        if len(style) > 3:
+            axis.line = "l" in style[3]
+        axes.append(axis)
+    return axes
+
+def parse_fills(chf):
+    """
+    Parse chf into (area, type, arguments) tuples, where the area is "bg" for
+    the whole image or "c" for the chart area and the type is "s" (solid),
+    "lg" (linear gradient) or "ls" (linear stripes).
+    """
+    fills = []
+    for fill in split(chf, "|"):
+        fill = fill.split(",")
+        if len(fill) < 3:
+            raise RenderError("Bad fill %r" % ",".join(fill))
+        fills.append((fill[0], fill[1], fill[2:]))
+    return fills
+
+def parse_size(chs):
+    try:
+        width, height = [int(n) for n in chs.split("x")]
+    except ValueError:
+        raise RenderError("Bad chart size %r" % chs)
+    if not (0 < width <= max_side and 0 < height <= max_side) or width * height > max_pixels:
+        raise RenderError("Charts can't be %sx%s" % (width, height))
+    return width, height
+
+def parse_color(color):
+    """Turn "RRGGBB" or "RRGGBBAA" into an (r, g, b, a) tuple."""
+    if not re.match(r"^([0-9a-fA-F]{6}|[0-9a-fA-F]{8})$", color):
+        raise RenderError("Bad color %r" % color)
+    if len(color) == 6:
+        color += "FF"
+    return tuple(int(color[i:i+2], 16) for i in range(0, 8, 2))
+
+def parse_line_style(chls):
+    """A line's thickness and, optionally, its dash and space lengths."""
+    style = floats(chls)
+    style[1:3] = parse_dash(style[1:3])
+    return style
+
+def parse_grid(chg):
+    """
+    The x and y steps between grid lines and, optionally, their dash and
+    space lengths. Steps of 0 or less mean no lines.
+    """
+    grid = floats(chg)
+    for i, step in enumerate(grid[:2]):
+        if step > 0:
+            grid[i] = max(step, min_grid_step)
+    grid[2:4] = parse_dash(grid[2:4])
+    return grid
+
+def parse_dash(dash):
+    """
+    Dash and space lengths that can be drawn: dashes are at least min_dash
+    long, and spaces of 0 or less mean a solid line.
+    """
+    lengths = []
+    for i, length in enumerate(dash):
+        if i == 0:
+            lengths.append(max(length, min_dash))
+        else:
+            lengths.append(max(length, 0.0))
+    return lengths
+
+def split(value, separator):
+    if not value:
+        return []
+    return value.split(separator)
+
+def floats(value):
+    try:
+        numbers = [float(n) for n in split(value, ",") if n]
+    except ValueError:
+        raise RenderError("Bad numbers %r" % value)
+    for n in numbers:
+        if n != n or n in (_infinity, -_infinity):
+            raise RenderError("Bad numbers %r" % value)
+    return numbers
+
+_infinity = float("inf")
+
+def number(value, default=0.0):
+    numbers = floats(value)
+    if len(numbers) > 1:
+        raise RenderError("Bad number %r" % value)
+    return numbers and numbers[0] or default
+
+def pairs(values):
+    return zip(values[::2], values[1::2])
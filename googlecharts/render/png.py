@@ -0,0 +1,101 @@
+"""
+PNG output, drawn with PIL.
+"""
+from cStringIO import StringIO
+
+from django.conf import settings
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    try:
+        import Image, ImageDraw, ImageFont
+    except ImportError:
+        Image = None
+
+from googlecharts.render.canvas import Canvas
+from googlecharts.render.parse import RenderError
+
+# Fonts, by size; see get_font().
+_fonts = {}
+
+# Font sizes come from the URL (chxs, chts), so they're rounded to whole
+# points in this range: a request can't have PIL load enormous fonts, and
+# there are only so many sizes to keep in _fonts.
+min_font_size = 1
+max_font_size = 72
+
+def get_font(size):
+    """
+    The font to write text in: the TrueType font at GOOGLECHARTS_RENDER_FONT
+    if that's set, or PIL's built-in font (which only comes in one size).
+    """
+    path = getattr(settings, "GOOGLECHARTS_RENDER_FONT", None)
+    if not path:
+        size = None
+    else:
+        try:
+            size = int(round(size))
+        except (ValueError, OverflowError):
+            # NaN or infinity
+            size = max_font_size
+        size = min(max(size, min_font_size), max_font_size)
+    key = (path, size)
+    if key not in _fonts:
+        if path:
+            _fonts[key] = ImageFont.truetype(path, size)
+        else:
+            _fonts[key] = ImageFont.load_default()
+    return _fonts[key]
+
+class PNGCanvas(Canvas):
+    content_type = "image/png"
+
+    def __init__(self, width, height):
+        if Image is None:
+            # A RenderError, like any other chart that can't be drawn, so
+            # saved images are fetched from the chart API instead.
+            raise RenderError("Drawing charts as PNG images needs PIL.")
+        super(PNGCanvas, self).__init__(width, height)
+        self.image = Image.new("RGB", (width, height), (255, 255, 255))
+        # Drawing with RGBA colors on an RGB image blends them in.
+        self.draw = ImageDraw.Draw(self.image, "RGBA")
+
+    def rect(self, x, y, width, height, color):
+        if width >= 1 and height >= 1:
+            self.draw.rectangle([_i(x), _i(y), _i(x + width) - 1, _i(y + height) - 1], fill=color)
+
+    def polygon(self, points, color):
+        self.draw.polygon([(_i(x), _i(y)) for x, y in points], fill=color)
+
+    def circle(self, x, y, radius, color):
+        self.draw.ellipse([_i(x - radius), _i(y - radius), _i(x + radius), _i(y + radius)], fill=color)
+
+    def line(self, points, color, width):
+        points = [(_i(x), _i(y)) for x, y in points]
+        self.draw.line(points, fill=color, width=max(_i(width), 1))
+        if width > 2:
+            # Round off the joins, which PIL leaves ragged.
+            radius = width / 2.0
+            for x, y in points[1:-1]:
+                self.circle(x, y, radius, color)
+
+    def text(self, x, y, text, color, size, anchor="start"):
+        font = get_font(size)
+        width, height = self.draw.textsize(text, font=font)
+        if anchor == "middle":
+            x -= width / 2.0
+        elif anchor == "end":
+            x -= width
+        self.draw.text((_i(x), _i(y - height / 2.0)), text, fill=color, font=font)
+
+    def text_width(self, text, size):
+        return self.draw.textsize(text, font=get_font(size))[0]
+
+    def getvalue(self):
+        output = StringIO()
+        self.image.save(output, "PNG")
+        return output.getvalue()
+
+def _i(n):
+    return int(round(n))
@@ -0,0 +1,70 @@
+"""
+SVG output, in pure Python.
+"""
+from xml.sax.saxutils import escape, quoteattr
+
+from googlecharts.render.canvas import Canvas
+
+font_family = "Arial, Helvetica, sans-serif"
+
+anchors = ("start", "middle", "end")
+
+class SVGCanvas(Canvas):
+    content_type = "image/svg+xml"
+
+    def __init__(self, width, height):
+        super(SVGCanvas, self).__init__(width, height)
+        self.elements = []
+
+    def rect(self, x, y, width, height, color):
+        self.elements.append('<rect x="%s" y="%s" width="%s" height="%s" %s/>' % (
+            _n(x), _n(y), _n(width), _n(height), _paint("fill", color)))
+
+    def polygon(self, points, color):
+        self.elements.append('<polygon points="%s" %s/>' % (_points(points), _paint("fill", color)))
+
+    def circle(self, x, y, radius, color):
+        self.elements.append('<circle cx="%s" cy="%s" r="%s" %s/>' % (
+            _n(x), _n(y), _n(radius), _paint("fill", color)))
+
+    def polyline(self, points, color, width=1, dash=None):
+        # SVG draws dashed lines itself.
+        dasharray = ""
+        if dash and dash[1]:
+            dasharray = ' stroke-dasharray="%s,%s"' % (_n(dash[0]), _n(dash[1]))
+        self.elements.append(
+            '<polyline points="%s" fill="none" %s stroke-width="%s" stroke-linejoin="round"%s/>' % (
+            _points(points), _paint("stroke", color), _n(width), dasharray))
+
+    def line(self, points, color, width):
+        self.polyline(points, color, width)
+
+    def text(self, x, y, text, color, size, anchor="start"):
+        if anchor not in anchors:
+            anchor = "start"
+        # Put the baseline about a third of the text's height below the middle.
+        self.elements.append(
+            '<text x="%s" y="%s" font-family=%s font-size="%s" text-anchor="%s" %s>%s</text>' % (
+            _n(x), _n(y + size * 0.35), quoteattr(font_family), _n(size), anchor,
+            _paint("fill", color), escape(text)))
+
+    def getvalue(self):
+        return (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+                u'<svg xmlns="http://www.w3.org/2000/svg" width="%s" height="%s" viewBox="0 0 %s %s">\n'
+                u'%s\n</svg>\n' % (self.width, self.height, self.width, self.height,
+                                   u"\n".join(self.elements))).encode("utf-8")
+
+def _n(n):
+    """Format a coordinate with no more than two decimal places."""
+    s = "%.2f" % n
+    return s.rstrip("0").rstrip(".")
+
+def _points(points):
+    return " ".join("%s,%s" % (_n(x), _n(y)) for x, y in points)
+
+def _paint(attribute, color):
+    r, g, b, a = color
+    paint = '%s="#%02x%02x%02x"' % (attribute, r, g, b)
+    if a < 255:
+        paint += ' %s-opacity="%s"' % (attribute, _n(a / 255.0))
+    return paint
@@ -0,0 +1,133 @@
+"""
+Drawing all the small charts in a template as one image.
+
+Inside {% chart-sprite %}, charts small enough to go in a sprite get a
+placeholder instead of an <img> tag. When the block is done, they're drawn
+side by side onto a single image (see googlecharts.render), which is saved
+like a saveas image, and each placeholder is replaced with an element showing
+its chart's part of the sprite as a CSS background. A table with a sparkline
+on every row then costs one image request instead of one per row.
+
+The chart tags check for a current sprite every time, so the renderer and
+the storage are only imported once a sprite is made.
+"""
+import re
+import random
+import threading
+
+from django.conf import settings
+from django.utils.html import escape
+
+# The Sprite collecting charts for the template being rendered in this
+# thread, if any.
+_local = threading.local()
+
+def current():
+    return getattr(_local, "sprite", None)
+
+def activate(sprite):
+    """Make sprite (or None) the current one; returns the previous one."""
+    previous = current()
+    _local.sprite = sprite
+    return previous
+
+class Sprite(object):
+    """
+    Small charts to draw onto one image, saved in the ImageStore for
+    `location`. Charts are laid out left to right in rows no wider than
+    `width` pixels (GOOGLECHARTS_SPRITE_WIDTH, 1000 by default).
+    """
+    def __init__(self, location="charts", width=None, max_height=None, max_pixels=None):
+        from googlecharts.storage import get_image_store
+        self.store = get_image_store(location)
+        self.width = width or getattr(settings, "GOOGLECHARTS_SPRITE_WIDTH", 1000)
+        # Charts that would make the sprite taller than this keep their own
+        # images, as do charts bigger than max_pixels.
+        self.max_height = max_height or getattr(settings, "GOOGLECHARTS_SPRITE_MAX_HEIGHT", 4000)
+        self.max_pixels = max_pixels or getattr(settings, "GOOGLECHARTS_SPRITE_MAX_PIXELS", 40000)
+        self.token = "%08x" % random.getrandbits(32)
+        self.placeholder_re = re.compile(r"googlecharts-sprite-%s-(\d+)" % self.token)
+        # (placeholder, url, image, x, y, alt) for each chart
+        self.charts = []
+        # Where the next chart goes, and how tall the current row is.
+        self.x = self.y = self.row_height = 0
+        self.height = 0
+
+    def img(self, url, alt=""):
+        """
+        A placeholder for the chart at url, or None if it isn't going in the
+        sprite: it's too big, there's no room left, or it can't be drawn.
+        """
+        from googlecharts.render import ChartImage, RenderError
+        from googlecharts.render.draw import plots
+        try:
+            image = ChartImage.from_url(url)
+        except RenderError:
+            return None
+        if image.type not in plots or image.width * image.height > self.max_pixels:
+            return None
+        x, y = self.x, self.y
+        if x and x + image.width > self.width:
+            # Start a new row.
+            x, y = 0, y + self.row_height
+            self.row_height = 0
+        if y + image.height > self.max_height:
+            return None
+        self.x, self.y = x + image.width, y
+        self.row_height = max(self.row_height, image.height)
+        self.height = max(self.height, y + image.height)
+
+        placeholder = "googlecharts-sprite-%s-%d" % (self.token, len(self.charts))
+        self.charts.append((placeholder, url, image, x, y, alt))
+        return placeholder
+
+    def name(self):
+        """
+        The name the sprite is stored under, from its charts' options and
+        places, so each sprite is only drawn once.
+        """
+        key = ["%d,%d %s" % (x, y, url.split("?", 1)[-1])
+               for placeholder, url, image, x, y, alt in self.charts]
+        return self.store.name("\n".join(key))
+
+    def image(self):
+        """Draw the sprite, returning the image as a string."""
+        from googlecharts.render import get_canvas_class, draw
+        width = max([x + image.width for placeholder, url, image, x, y, alt in self.charts])
+        canvas = get_canvas_class(self.store.format)(width, self.height)
+        for placeholder, url, image, x, y, alt in self.charts:
+            draw(image, canvas, x, y)
+        return canvas.getvalue()
+
+    def resolve(self, output):
+        """
+        Draw and save the sprite (unless it's already been saved), and put
+        its charts in output. If the sprite can't be drawn, its charts get
+        <img> tags pointing at their own URLs instead.
+        """
+        if not self.charts:
+            return output
+        from googlecharts.render import RenderError
+        name = self.name()
+        try:
+            if not self.store.storage.exists(name):
+                self.store.save(name, self.image())
+        except RenderError:
+            sprite_url = None
+        else:
+            sprite_url = self.store.storage.url(name)
+
+        tags = []
+        for placeholder, url, image, x, y, alt in self.charts:
+            if sprite_url is None:
+                tag = '<img src="%s" width="%d" height="%d" alt="%s" />' % (
+                    escape(url), image.width, image.height, escape(alt))
+            else:
+                tag = ('<span class="chart-sprite" role="img" aria-label="%s" style="'
+                       'display:inline-block;width:%dpx;height:%dpx;'
+                       'background:url(%s) -%dpx -%dpx no-repeat"></span>' % (
+                       escape(alt), image.width, image.height, escape(sprite_url), x, y))
+            tags.append(tag)
+        self.charts = []
+        # One pass, so that "-1" isn't replaced at the start of "-12".
+        return self.placeholder_re.sub(lambda match: tags[int(match.group(1))], output)
@@ -0,0 +1,253 @@
+"""
+Saving chart images with Django's file storage, so pages can link to a local
+copy instead of the chart API.
+
+The store is content-addressed: each image is saved once, named after a hash
+of its chart's options, so showing a chart that's already been saved only
+costs a storage existence check.
+"""
+import os
+import re
+import time
+import socket
+import logging
+import httplib
+import tempfile
+import threading
+from hashlib import sha1
+from urlparse import urlsplit
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, get_storage_class
+from django.utils.encoding import smart_str
+
+from googlecharts.render import render, RenderError
+
+# Interrupted writes leave temporary files behind; cleanup() deletes them
+# once they're this old, in seconds.
+temp_max_age = 3600
+
+# What drawing or fetching an image can fail with.
+image_errors = (RenderError, IOError, socket.error, httplib.HTTPException)
+
+logger = logging.getLogger("googlecharts.storage")
+
+def get_storage():
+    """The GOOGLECHARTS_STORAGE storage class, or Django's default storage."""
+    path = getattr(settings, "GOOGLECHARTS_STORAGE", None)
+    if path:
+        return get_storage_class(path)()
+    return default_storage
+
+class ImageStore(object):
+    """
+    Chart images saved under `location` in a Django storage.
+
+    Images are drawn locally (see googlecharts.render) unless the
+    GOOGLECHARTS_SAVEAS_SOURCE setting is "fetch", in which case -- and for
+    charts the renderer can't draw -- they're fetched from the chart API.
+    """
+    def __init__(self, location="charts", storage=None, format=None, source=None):
+        self.location = location.strip("/")
+        self.storage = storage or get_storage()
+        self.format = format or getattr(settings, "GOOGLECHARTS_SAVEAS_FORMAT", "png")
+        self.source = source or getattr(settings, "GOOGLECHARTS_SAVEAS_SOURCE", "render")
+        self.pattern = re.compile(r"^[0-9a-f]{40}\.%s$" % re.escape(self.format))
+
+    def name(self, url):
+        """
+        The name the image of the chart at url is stored under. Only the
+        query counts, so charts keep their names if GOOGLECHARTS_BASE_URL
+        changes.
+        """
+        digest = sha1(smart_str(url.split("?", 1)[-1])).hexdigest()
+        return "%s/%s.%s" % (self.location, digest, self.format)
+
+    def url(self, url):
+        """
+        The URL of the stored image of the chart at url, which is saved first
+        if it isn't there yet.
+        """
+        name = self.name(url)
+        if not self.storage.exists(name):
+            self.save(name, self.image(url))
+        return self.storage.url(name)
+
+    def url_or_chart(self, url):
+        """
+        Like url(), but if the image can't be drawn or fetched, the error is
+        logged and the chart's own URL -- url -- is returned instead.
+        """
+        try:
+            return self.url(url)
+        except image_errors, e:
+            logger.warning("Couldn't save the image of %s: %s: %s",
+                           url, e.__class__.__name__, e)
+            return url
+
+    def image(self, url):
+        """Draw (or fetch) the image of the chart at url."""
+        query = url.split("?", 1)[-1]
+        if self.source == "render":
+            try:
+                return render("?" + query, self.format)
+            except RenderError:
+                if self.format != "png":
+                    raise
+        return fetch(query)
+
+    def save(self, name, data):
+        """
+        Store an image. Local files are written to a temporary file and then
+        renamed into place, so nobody sees half an image and concurrent
+        writers of the same image don't clash.
+        """
+        try:
+            path = self.storage.path(name)
+        except NotImplementedError:
+            saved = self.storage.save(name, ContentFile(data))
+            if saved != name:
+                # Someone else saved it first; it's the same image.
+                self.storage.delete(saved)
+            return
+
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        fd, temp = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+        try:
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            os.chmod(temp, getattr(settings, "FILE_UPLOAD_PERMISSIONS", None) or 0644)
+            os.rename(temp, path)
+        except:
+            os.unlink(temp)
+            raise
+
+    def cleanup(self, max_age=None, max_size=None):
+        """
+        Delete images saved more than max_age seconds ago, then the oldest
+        of the rest until they add up to no more than max_size bytes. The
+        limits default to the GOOGLECHARTS_SAVEAS_MAX_AGE and
+        GOOGLECHARTS_SAVEAS_MAX_SIZE settings. Returns the number of files
+        deleted.
+        """
+        if max_age is None:
+            max_age = getattr(settings, "GOOGLECHARTS_SAVEAS_MAX_AGE", None)
+        if max_size is None:
+            max_size = getattr(settings, "GOOGLECHARTS_SAVEAS_MAX_SIZE", None)
+        try:
+            directories, files = self.storage.listdir(self.location)
+        except OSError:
+            return 0
+
+        now = time.time()
+        deleted = 0
+        images = []
+        for filename in files:
+            name = "%s/%s" % (self.location, filename)
+            if filename.startswith(".") and filename.endswith(".tmp"):
+                if now - self.modified(name) > temp_max_age:
+                    deleted += self.delete(name)
+            elif self.pattern.match(filename):
+                images.append((self.modified(name), self.storage.size(name), name))
+
+        # Oldest first
+        images.sort()
+        total = sum(size for modified, size, name in images)
+        for modified, size, name in images:
+            expired = max_age is not None and now - modified > max_age
+            too_big = max_size is not None and total > max_size
+            if expired or too_big:
+                deleted += self.delete(name)
+                total -= size
+        return deleted
+
+    def modified(self, name):
+        """When a file was written, as a timestamp."""
+        try:
+            return os.path.getmtime(self.storage.path(name))
+        except NotImplementedError:
+            return time.mktime(self.storage.modified_time(name).timetuple())
+
+    def delete(self, name):
+        try:
+            self.storage.delete(name)
+        except OSError:
+            # Already gone
+            return 0
+        return 1
+
+class FetchError(IOError):
+    """The chart API didn't return an image."""
+
+def fetch(query):
+    """
+    Fetch the image for a chart's query string from the chart API (or from
+    GOOGLECHARTS_FETCH_URL, if that's set).
+    """
+    from googlecharts.templatetags.charts import Chart
+    base = getattr(settings, "GOOGLECHARTS_FETCH_URL", None) or Chart.BASE
+    return http_get("%s?%s" % (base, query), getattr(settings, "GOOGLECHARTS_FETCH_TIMEOUT", 10))
+
+# Keep-alive connections, by (scheme, host), for each thread.
+_connections = threading.local()
+
+def http_get(url, timeout=None):
+    """
+    GET url, reusing this thread's connection to the host if it has one.
+    The timeout (in seconds) applies to each socket operation.
+    """
+    scheme, host, path, query, fragment = urlsplit(url)
+    if query:
+        path = "%s?%s" % (path, query)
+    pool = getattr(_connections, "pool", None)
+    if pool is None:
+        pool = _connections.pool = {}
+
+    key = (scheme, host)
+    while True:
+        connection = pool.get(key)
+        reused = connection is not None
+        if not reused:
+            if scheme == "https":
+                connection = httplib.HTTPSConnection(host, timeout=timeout)
+            else:
+                connection = httplib.HTTPConnection(host, timeout=timeout)
+            pool[key] = connection
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            data = response.read()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            del pool[key]
+            if reused:
+                # The server may have closed the idle connection; try again
+                # on a new one.
+                continue
+            raise
+        if response.status != 200:
+            raise FetchError("%s returned %s %s" % (url, response.status, response.reason))
+        return data
+
+# Image stores, by location; see get_image_store().
+_stores = {}
+
+def get_image_store(location):
+    """The ImageStore for location, made the first time it's asked for."""
+    try:
+        return _stores[location]
+    except KeyError:
+        store = _stores[location] = ImageStore(location)
+        return store
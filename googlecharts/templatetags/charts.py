@@ -1,8 +1,12 @@
 import sys
-import inspect
+import time
 import colorsys
 
-from itertools import chain
+from copy import deepcopy
+from hashlib import md5
+
+from array import array
+from itertools import chain, islice
 
 from django import template
 from django.conf import settings
@@ -11,6 +15,8 @@ from django.utils.encoding import smart_str
 from django.utils.html import escape
 from django.utils.safestring import mark_safe, SafeData
 
+from googlecharts import prefetch, sprite, tracing
+
 register = template.Library()
 
 # Set this to the color for the inactive areas of an interactive chart
@@ -18,45 +24,87 @@ _chart_inactive_color = 'eeeeee'
 _chart_color = '336699'
 
 #
-# Helper functions
+# Sparklines
 #
-extended_separator = ","
 
-def encode_text(values):
-    return extended_separator.join(str(v) for v in values)
+@register.simple_tag
+def sparkline(data, size="100x30", color=_chart_color):
+    return sparklines([data], size, color)[0]
 
-def num2chars(n, value_range):
-    if n is not None:
-        return _num2chars[norm(n, value_range)]
-    else:
-        return '__'
+def sparklines(datasets, size="100x30", color=_chart_color):
+    """
+    Return a sparkline <img> tag for each dataset in datasets. Use this
+    instead of {% sparkline %} for tables full of them: the data is encoded
+    in a single pass (vectorized if NumPy is installed) and the tags are
+    filled into a template that's only built once.
+    """
+    datasets = [Dataset(data_source(data)) for data in datasets]
+    encoders = [ExtendedEncoder(_sparkline_range(d)) for d in datasets]
+    url_template, tag_template = _sparkline_template(size, color)
+    current_sprite = sprite.current()
+    tags = []
+    for data, encoder, encoded in zip(datasets, encoders, encode_datasets(datasets, encoders)):
+        last = len(data) and data[-1] or 0
+        if is_missing(last):
+            label, position = "", 0
+        else:
+            # As many digits as it takes, without the ".0" of a whole number.
+            label = quote_plus("%.15g" % last, safe=url_safe)
+            # Put the label level with the last point.
+            position = "%g" % (100.0 * encoder.norm(last) / encoder.levels)
+        values = (encoded, len(data) - 1, label, position)
+        if current_sprite is not None:
+            placeholder = current_sprite.img(url_template % values)
+            if placeholder is not None:
+                tags.append(mark_safe(placeholder))
+                continue
+        tags.append(mark_safe(tag_template % values))
+    return tags
+
+@register.filter(name="sparklines")
+def sparklines_filter(datasets, arg=None):
+    """
+    A list of sparkline <img> tags for a list of datasets. Takes the size,
+    and optionally the color: {{ series|sparklines:"100x30,336699" }}.
+    """
+    args = arg and arg.split(",") or []
+    return sparklines(datasets, *args)
 
-_encoding_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-."
-_num2chars = [a+b for a in _encoding_chars for b in _encoding_chars]
+def _sparkline_range(data):
+    if data.min is None:
+        return (0, 0)
+    return (data.min, data.max)
 
-def encode_extended(values, value_range):
-    """Encode data using Google's "extended" encoding for the most granularity."""
-    return "".join(num2chars(v, value_range) for v in values)
+# Sparkline URL and <img> tag templates, by (base URL, size, color)
+_sparkline_templates = {}
 
-@register.simple_tag
-def sparkline(data, size="100x30", color=_chart_color):
-    maxvalue = max(data)
-    minvalue = min(data)
-    datarange = (minvalue, maxvalue)
-    encoded_data = encode_extended(data,datarange)
-
-    return '<img src="http://chart.apis.google.com/chart?\
-cht=lc&\
-chs=100x30&\
-chd=e:%s&\
-chco=%s&\
-chls=1,1,0&\
-chm=o,990000,0,%s,4&\
-chxt=r,x,y&\
-chxs=0,990000,11,0,_|1,990000,1,0,_|2,990000,1,0,_&\
-chxl=0:|%s|1:||2:||&\
-chxp=0,%s\
-    " alt="" />' % (encoded_data, color, len(data), data[-1], 100*(float(data[-1])/(maxvalue-minvalue)))
+def _sparkline_template(size, color):
+    key = (Chart.base_url(), size, color)
+    try:
+        return _sparkline_templates[key]
+    except KeyError:
+        pass
+    width, height = size.split("x")
+    parts = [
+        "%s?cht=lc&chs=%s&chd=e:" % (key[0], quote_plus(size)),
+        "&chco=%s&chls=1,1,0&chm=o,990000,0," % quote_plus(color, safe=url_safe),
+        ",4&chxt=r,x,y&chxs=0,990000,11,0,_|1,990000,1,0,_|2,990000,1,0,_&chxl=0:|",
+        "|1:||2:||&chxp=0,",
+    ]
+    def static(parts):
+        # Escaped once, here, and safe from the % formatting in sparklines().
+        return [part.replace("%", "%%") for part in parts]
+    def fill(parts):
+        return "".join(chain(*zip(parts, ["%s", "%d", "%s", "%s"])))
+    url = fill(static(parts))
+    tag = "".join([
+        '<img src="', fill(static([escape(part) for part in parts])),
+        '" width="%s" height="%s" alt="" />' % tuple(static([escape(width), escape(height)])),
+    ])
+    if len(_sparkline_templates) >= max_cached_encoders:
+        _sparkline_templates.clear()
+    _sparkline_templates[key] = url, tag
+    return url, tag
 
 #
 # {% chart %}
@@ -69,30 +117,119 @@ def chart(parser, token):
     varname = None
     saveas = None
     extends = None
+    cache_timeout = None
+    vary_on = []
     for bit in bits:
         if bit == "as":
             varname = bits.next()
         elif bit == "saveas":
-            raise template.TemplateSyntaxError("Sorry, 'saveas' isn't implemented yet!")
             saveas = template.Variable(bits.next())
         elif bit == "extends":
             extends = template.Variable(bits.next())
+        elif bit == "cache":
+            try:
+                cache_timeout = parser.compile_filter(bits.next())
+            except StopIteration:
+                raise template.TemplateSyntaxError("'%s cache' requires a timeout" % name)
+        elif cache_timeout is not None:
+            # Anything after "cache <timeout>" that isn't a keyword is a
+            # variable to vary the cache on.
+            vary_on.append(parser.compile_filter(bit))
         else:
             raise template.TemplateSyntaxError("Unknown argument to '%s': '%s'" % (name, bit))
     nodelist = parser.parse("end%s" % name)
     parser.delete_first_token()
-    return ChartNode(nodelist, varname, saveas, extends)
+    return ChartNode(nodelist, varname, saveas, extends, cache_timeout, vary_on)
 
 class ChartNode(template.Node):
 
-    def __init__(self, nodelist, varname, saveas, extends):
+    def __init__(self, nodelist, varname, saveas, extends, cache_timeout=None, vary_on=()):
         self.nodelist = nodelist
         self.saveas = saveas
         self.varname = varname
         self.extends = extends
+        self.cache_timeout = cache_timeout
+        self.vary_on = vary_on
+
+        # Options given nothing but literals, up to the first one that
+        # needs the context, are folded into one set of starting options
+        # here instead of being worked out on every render. (That doesn't
+        # work when extending another chart, whose options come first.)
+        self.static_options = SortedDict()
+        self.nodes = list(nodelist)
+        if not extends:
+            for node in nodelist:
+                if isinstance(node, ChartOptionNode) and not isinstance(node, MetadataNode):
+                    if node.static_data is None:
+                        break
+                    node.update_options(self.static_options, None)
+                    self.nodes.remove(node)
+
+        if cache_timeout is not None:
+            # Identifies this chart in cache keys; see _signature().
+            signature = (varname, extends and extends.var, saveas and saveas.var,
+                         _signature(nodelist))
+            self.signature = md5(repr(signature)).hexdigest()
 
     def render(self, context):
+        trace = tracing.start()
+        try:
+            if self.cache_timeout is None:
+                output, variables = self.render_chart(context)
+            else:
+                output, variables = self.render_cached(context)
+            for name, value in variables.items():
+                context[name] = value
+        finally:
+            # Even if the chart fails, or the next URL built in this thread
+            # would be counted towards it.
+            if trace is not None:
+                tracing.finish(trace)
+        return output
+
+    def render_cached(self, context):
+        """
+        Like Django's {% cache %} tag: look the rendered chart up in the cache
+        under a key made from the chart's signature and the vary-on
+        variables. The context variables the chart sets (including the "as"
+        variable) are cached along with the output.
+        """
+        try:
+            timeout = int(self.cache_timeout.resolve(context))
+        except (ValueError, TypeError):
+            raise template.TemplateSyntaxError("chart cache got a non-integer timeout value: %r" % self.cache_timeout.token)
+        vary_on = [smart_str(var.resolve(context)) for var in self.vary_on]
+        key = "googlecharts:chart:%s:%s" % (self.signature, md5(":".join(vary_on)).hexdigest())
+        cache = chart_cache()
+        cached = cache.get(key)
+        trace = tracing.current()
+        if trace is not None:
+            trace.cached = cached is not None
+        if cached is None:
+            # The placeholders {% chart-prefetch %} and {% chart-sprite %}
+            # put in the output would outlive them in the cache, so cached
+            # charts are neither prefetched nor put in sprites.
+            prefetcher = prefetch.activate(None)
+            current_sprite = sprite.activate(None)
+            try:
+                cached = self.render_chart(context)
+            finally:
+                prefetch.activate(prefetcher)
+                sprite.activate(current_sprite)
+            cache.set(key, cached, timeout)
+        return cached
+
+    def render_chart(self, context):
+        """
+        Build the chart; returns the output and a dict of the variables to
+        set in the context.
+        """
+        trace = tracing.current()
+        if trace is not None:
+            started = time.time()
+        variables = SortedDict()
         c = Chart()
+        c.options = self.static_options.copy()
         if self.extends:
             try:
                 parent = self.extends.resolve(context)
@@ -100,8 +237,13 @@ class ChartNode(template.Node):
                 pass
             else:
                 c = parent.clone()
-                
-        for node in self.nodelist:
+        if self.saveas:
+            try:
+                c.saveas = self.saveas.resolve(context)
+            except template.VariableDoesNotExist:
+                pass
+
+        for node in self.nodes:
             if isinstance(node, ChartDataNode):
                 c.datasets.extend(node.resolve(context))
             elif isinstance(node, ChartHiddenDataNode):
@@ -110,27 +252,142 @@ class ChartNode(template.Node):
                 node.update_chart(c, context)
             elif isinstance(node, AxisNode):
                 c.axes.append(node.resolve(context))
+            if trace is not None:
+                if isinstance(node, (ChartDataNode, ChartHiddenDataNode)):
+                    # The data nodes time themselves, resolving and
+                    # converting separately.
+                    started = time.time()
+                else:
+                    started = trace.add("resolve", started)
+        if trace is not None:
+            trace.describe_chart(c)
         
         # Take any options that begin with '_' and add them to the context,
         # omitting the underscore.
         for o in c.options:
             if o.startswith('_'):
-                context[o[1:]] = c.options[o]
+                variables[o[1:]] = c.options[o]
         
         # Create some additional images showing only one of the colors,
         # replacing the others with grayed-out images
         if '_final_color_map' in c.options:
-            for o in c.options['_final_color_map'].items():
-                context["chart_%s_only" % o[1]] = c.img(color_override=o[0])
+            for color, label, img in c.color_variants():
+                variables["chart_%s_only" % label] = img
 
         if self.varname:
-            context[self.varname] = c
-            return ""
+            variables[self.varname] = c
+            return "", variables
         else:
-            return c.img()
+            return c.img(), variables
+
+def _signature(nodelist):
+    """
+    Describe the nodes inside a {% chart %} tag: which tags were used, with
+    which arguments. Two charts with the same signature build the same chart
+    from the same context.
+    """
+    signature = []
+    for node in nodelist:
+        if isinstance(node, (ChartDataNode, ChartHiddenDataNode)):
+            signature.append((node.__class__.__name__, getattr(node, "type", None),
+                              [data.token for data in node.datasets]))
+        elif isinstance(node, OptionNode):
+            signature.append((node.__class__.__name__, node.callback.__name__,
+                              [arg.var for arg in node.args]))
+        elif isinstance(node, AxisNode):
+            signature.append((node.__class__.__name__, node.side.var,
+                              node.nodelist and _signature(node.nodelist)))
+    return signature
+
+#
+# {% chart-prefetch %}
+#
+
+@register.tag("chart-prefetch")
+def chart_prefetch(parser, token):
+    """
+    Make the images of all the saveas charts inside the block that haven't
+    been saved yet in parallel, once the block's been rendered. Takes an
+    optional budget, in seconds, to wait for them.
+    """
+    bits = token.split_contents()
+    if len(bits) > 2:
+        raise template.TemplateSyntaxError("%s tag takes at most one argument" % bits[0])
+    budget = None
+    if len(bits) == 2:
+        budget = parser.compile_filter(bits[1])
+    nodelist = parser.parse(("end%s" % bits[0],))
+    parser.delete_first_token()
+    return PrefetchNode(nodelist, budget)
+
+class PrefetchNode(template.Node):
+    def __init__(self, nodelist, budget=None):
+        self.nodelist = nodelist
+        self.budget = budget
+
+    def render(self, context):
+        if prefetch.current() is not None:
+            # Already inside {% chart-prefetch %}
+            return self.nodelist.render(context)
+        budget = self.budget and self.budget.resolve(context) or None
+        prefetcher = prefetch.Prefetcher(budget)
+        previous = prefetch.activate(prefetcher)
+        try:
+            output = self.nodelist.render(context)
+        finally:
+            prefetch.activate(previous)
+        return prefetcher.resolve(output)
+
+#
+# {% chart-sprite %}
+#
+
+@register.tag("chart-sprite")
+def chart_sprite(parser, token):
+    """
+    Draw the small charts inside the block as one image, saved under the
+    given location ("charts" by default), and show each chart as part of it.
+    """
+    bits = token.split_contents()
+    if len(bits) > 2:
+        raise template.TemplateSyntaxError("%s tag takes at most one argument" % bits[0])
+    location = None
+    if len(bits) == 2:
+        location = parser.compile_filter(bits[1])
+    nodelist = parser.parse(("end%s" % bits[0],))
+    parser.delete_first_token()
+    return SpriteNode(nodelist, location)
+
+class SpriteNode(template.Node):
+    def __init__(self, nodelist, location=None):
+        self.nodelist = nodelist
+        self.location = location
+
+    def render(self, context):
+        if sprite.current() is not None:
+            # Already inside {% chart-sprite %}
+            return self.nodelist.render(context)
+        location = self.location and self.location.resolve(context) or "charts"
+        current = sprite.Sprite(location)
+        previous = sprite.activate(current)
+        try:
+            output = self.nodelist.render(context)
+        finally:
+            sprite.activate(previous)
+        return current.resolve(output)
 
 class Chart(object):
 
+    # Charts stick around for the whole render when they're saved with "as",
+    # so their attributes are slots. The __dict__ slot is only filled in
+    # when something sets an attribute of its own on a chart, as it always
+    # could.
+    __slots__ = (
+        'options', 'datasets', 'hidden_datasets', 'axes', 'datarange', 'alt',
+        'downsample', 'downsample_points', 'max_url_length', 'degradation',
+        'encoding', 'grid_lines', 'saveas', '_segments', '_writer', '__dict__',
+    )
+
     BASE = "http://chart.apis.google.com/chart"
     defaults = {
         "chs": "200x200",
@@ -147,101 +404,873 @@ class Chart(object):
         self.axes = []
         self.datarange = None
         self.alt = None
+        # Name of a downsampling method (see downsamplers) and, optionally,
+        # the number of points to reduce each dataset to.
+        self.downsample = None
+        self.downsample_points = None
+        # Maximum length of the URL; if it's longer, the data is degraded
+        # until it fits. What was done is recorded in `degradation`.
+        self.max_url_length = None
+        self.degradation = []
+        # "text", "extended", "simple" or "auto"; see choose_encoding().
+        self.encoding = None
+        self.grid_lines = False
+        # Where to save the chart's image locally; see googlecharts.storage.
+        self.saveas = None
+        # Encoded datasets for the last URL built, handed down to clones;
+        # see _segment().
+        self._segments = {}
+        # The URLWriter for the last URL built; see _img_tag().
+        self._writer = None
+
+    def __getstate__(self):
+        state = _getstate(self)
+        del state['_segments']
+        del state['_writer']
+        return state
+
+    def __setstate__(self, state):
+        self._segments = {}
+        self._writer = None
+        _setstate(self, state)
 
     def clone(self):
+        # The clone gets its own lists, but shares the datasets themselves
+        # with this chart, and starts with the encodings this chart made
+        # for its last URL; nothing is copied point by point. What the clone
+        # encodes is kept to itself, so a long-lived chart doesn't collect
+        # the encodings of all its clones.
         clone = self.__class__()
         clone.options = self.options.copy()
         clone.datasets = self.datasets[:]
         clone.hidden_datasets = self.hidden_datasets[:]
         clone.axes = self.axes[:]
+        clone.downsample = self.downsample
+        clone.downsample_points = self.downsample_points
+        clone.max_url_length = self.max_url_length
+        clone.encoding = self.encoding
+        clone.saveas = self.saveas
+        clone._segments = self._segments.copy()
         return clone
 
     def img(self, color_override = None):
-        orig_colors = self.options.get('chco')
+        url = self.url()
         # If color_override is set, replace the chco option with this color
         if color_override is not None:
-            final_color = []
-            for c in self.options['chco'].split(','):
-                if c == color_override:
-                    c = orig_colors.split(',')[0]
-                else:
-                    c = _chart_inactive_color
-                final_color.append(c)
-            self.options['chco'] = ','.join(final_color)
-        url = self.url()
-        if orig_colors:
-            self.options['chco'] = orig_colors
+            url = self.recolor(url, color_override)
+        return self._img_tag(url)
+
+    def _img_tag(self, url):
+        current_sprite = sprite.current()
+        if current_sprite is not None:
+            placeholder = current_sprite.img(url, self.alt or "")
+            if placeholder is not None:
+                return mark_safe(placeholder)
+        if self.saveas:
+            # Imported here so that loading the tag library doesn't load
+            # the storage and the renderer.
+            from googlecharts.storage import get_image_store
+            store = get_image_store(self.saveas)
+            prefetcher = prefetch.current()
+            if prefetcher is None:
+                url = store.url_or_chart(url)
+            else:
+                url = prefetcher.url(store, url)
+        writer = self._writer
+        if writer is not None and writer.url is url:
+            # Straight from the writer, already escaped.
+            src = writer.html()
+        else:
+            src = escape(url)
         width, height = self.options["chs"].split("x")
         if self.alt:
             alt = '%s' % escape(self.alt)
         else:
             alt = ''
-        s = mark_safe('<img src="%s" width="%s" height="%s" alt="%s" />' % (escape(url), width, height, alt))
+        s = mark_safe('<img src="%s" width="%s" height="%s" alt="%s" />' % (src, width, height, alt))
 
         return s
 
+    def recolor(self, url, color_override):
+        """
+        Return a copy of `url` -- this chart's URL -- with `color_override`
+        shown in the chart's main color and every other color grayed out.
+        Only the chco parameter is swapped, so nothing is encoded again.
+        """
+        orig_colors = self.options['chco']
+        final_color = []
+        for c in orig_colors.split(','):
+            if c == color_override:
+                c = orig_colors.split(',')[0]
+            else:
+                c = _chart_inactive_color
+            final_color.append(c)
+        head, tail = _split_query(url, 'chco', orig_colors)
+        return head + quote_plus(','.join(final_color), safe=url_safe) + tail
+
+    def color_variants(self):
+        """
+        For each color in the chart-auto-colors color map, return a (color,
+        label, img) tuple with an image of the chart with just that color
+        highlighted. The chart's URL is only built once.
+        """
+        url = self.url()
+        return [(color, label, self._img_tag(self.recolor(url, color)))
+                for color, label in self.options['_final_color_map'].items()]
+
     def url(self):
-        if self.options.get('cht', None) == 't':
+        if self.options.get('cht', None) == 't' and "_mapdata" in self.options:
             self.datasets.append(self.options.pop("_mapdata"))
 
-        # Figure out the chart's data range
-        if not self.datarange:
-            maxvalue = max(max(d) for d in chain(self.datasets, self.hidden_datasets) if d)
-            minvalue = min(min(d) for d in chain(self.datasets, self.hidden_datasets) if d)
-            self.datarange = (minvalue, maxvalue)
-        
-        # Encode data
-        if "chds" in self.options or self.options.get('cht', None) == 'gom': 
-            # text encoding if scaling provided, or for google-o-meter type
-            data = "|".join(encode_text(d) for d in chain(self.datasets, self.hidden_datasets))
-            encoded_data = "t%d:%s" % (len(self.datasets), data)
-        else: 
-            # extended encoding otherwise
-            data = extended_separator.join(encode_extended(d, self.datarange) for d in chain(self.datasets, self.hidden_datasets))
-            encoded_data = "e%d:%s" % (len(self.datasets), data)
-        
         # Update defaults
         for k in self.defaults:
             if k not in self.options:
                 self.options[k] = self.defaults[k]
+
+        # Encoding is the expensive part, so look the URL up in the cache
+        # first if the URL cache is turned on.
+        if not getattr(settings, "GOOGLECHARTS_URL_CACHE", False):
+            return self._url()
+        cache = chart_cache()
+        key = self.cache_key()
+        cached = cache.get(key)
+        if isinstance(cached, tuple):
+            # What building the URL would have worked out is cached along
+            # with it.
+            url, self.degradation, self.datarange = cached
+            self._writer = None
+            return url
+        url = self._url()
+        if len(url) <= getattr(settings, "GOOGLECHARTS_URL_CACHE_MAX_LENGTH", 8192):
+            cache.set(key, (url, self.degradation, self.datarange),
+                      getattr(settings, "GOOGLECHARTS_URL_CACHE_TIMEOUT", 3600))
+        return url
+
+    def base_url(cls):
+        """
+        Where the chart is drawn: the GOOGLECHARTS_BASE_URL setting (the
+        googlecharts.views.chart view, say) or the Google Chart API.
+        """
+        return getattr(settings, "GOOGLECHARTS_BASE_URL", None) or cls.BASE
+    base_url = classmethod(base_url)
+
+    def cache_key(self):
+        """
+        A cache key that's a stable digest of everything that ends up in
+        the chart's URL.
+        """
+        state = (
+            self.base_url(),
+            self.options.items(),
+            [(axis.side, axis.options.items()) for axis in self.axes],
+            self.datarange,
+            self.downsample,
+            self.downsample_points,
+            self.max_url_length,
+            self.encoding,
+            getattr(settings, "GOOGLECHARTS_MAX_URL_LENGTH", None),
+            getattr(settings, "GOOGLECHARTS_ENCODING", None),
+        )
+        digest = md5(repr(state))
+        _hash_datasets(digest, self.datasets)
+        _hash_datasets(digest, self.hidden_datasets)
+        return "googlecharts:url:%s" % digest.hexdigest()
+
+    # Chart types whose data is plotted against its index, so the data can
+    # be downsampled without changing the shape of the chart.
+    downsample_types = ('lc', 'ls')
+
+    # The image can't show more points than this per pixel of its width.
+    points_per_pixel = 2
+
+    def downsample_budget(self):
+        """
+        The number of points to downsample each dataset to: downsample_points
+        if it's been set, or enough for the chart's width otherwise.
+        """
+        if self.downsample_points:
+            return self.downsample_points
+        width = self.options["chs"].split("x")[0]
+        return int(width) * self.points_per_pixel
+
+    def _url(self):
+        trace = tracing.current()
+        if trace is not None:
+            started = time.time()
+
+        # Figure out the chart's data range
+        if not self.datarange:
+            self.datarange = data_range(chain(self.datasets, self.hidden_datasets))
+
+        # The plan says how to turn the data into a URL; when the URL goes
+        # over the length budget it's changed one step at a time (see
+        # degradation_steps) until the URL fits.
+        encoding, datarange = self.choose_encoding()
+        plan = {
+            "points": None,
+            "precision": None,
+            "encoding": encoding,
+            "datarange": datarange,
+        }
+        if self.downsample and self.options.get('cht') in self.downsample_types:
+            plan["points"] = self.downsample_budget()
+        if trace is not None:
+            started = trace.add("datarange", started)
+
+        axis_params = self._axis_params()
+        if trace is not None:
+            trace.add("urlencode", started)
+        # Only the encodings made (or reused) for this URL are kept, so a
+        # chart that's built again and again with new data doesn't collect
+        # them all.
+        previous, self._segments = self._segments, {}
+        writer, data_length = self._build_url(plan, axis_params, previous)
+        url = writer.getvalue()
+
+        self.degradation = []
+        budget = self.max_url_length or getattr(settings, "GOOGLECHARTS_MAX_URL_LENGTH", None)
+        if budget:
+            for step in self.degradation_steps:
+                degrade = getattr(self, "_degrade_%s" % step)
+                while len(url) > int(budget):
+                    changes = degrade(plan, len(url), data_length, int(budget))
+                    if not changes:
+                        break
+                    plan.update(changes)
+                    writer, data_length = self._build_url(plan, axis_params, previous)
+                    url = writer.getvalue()
+                    changes.update(step=step, length=len(url))
+                    self.degradation.append(changes)
+        self._writer = writer
+        if trace is not None:
+            trace.url_length = len(url)
+        return url
+
+    def choose_encoding(self):
+        """
+        Decide how to encode the data: returns the name of the encoding
+        ("text", "extended" or "simple") and the data range to encode with.
         
-        # Start to calculate the URL
-        url = "%s?%s&chd=%s" % (self.BASE, urlencode(self.options), encoded_data)
-        
-        # Calculate axis options
-        if self.axes:
-            axis_options = SortedDict()
-            axis_sides = []
-            for i, axis in enumerate(self.axes):
-                axis_sides.append(axis.side)
-                for opt in axis.options:
-                    try:
-                        axis_options.setdefault(opt, []).append(axis.options[opt] % i)
-                    except TypeError:
-                        pass
+        Unless another encoding is asked for (with Chart.encoding or the
+        GOOGLECHARTS_ENCODING setting), data is sent as text if scaling is
+        provided, or for google-o-meter charts, and in extended encoding
+        otherwise. "auto" picks the most compact encoding that's precise
+        enough for the chart's size.
+        """
+        encoding = self.encoding or getattr(settings, "GOOGLECHARTS_ENCODING", None)
+        if "chds" in self.options or self.options.get('cht', None) == 'gom':
+            # Scaled data can only be sent as text, unless the scale is a
+            # single range that can double as the data range.
+            if encoding in (None, "text"):
+                return "text", self.datarange
+            datarange = self._chds_range()
+            if not datarange:
+                return "text", self.datarange
+        else:
+            datarange = self.datarange
+            if encoding == "text":
+                return "text", datarange
+        if encoding == "auto":
+            if self.value_pixels() <= 2 * SimpleEncoder.levels:
+                encoding = "simple"
+            else:
+                encoding = "extended"
+        return encoding or "extended", datarange
+
+    def value_pixels(self):
+        """The size, in pixels, of the chart's value axis."""
+        width, height = self.options["chs"].split("x")
+        if self.options.get('cht', '').startswith('bh'):
+            return int(width)
+        return int(height)
+
+    def _chds_range(self):
+        """
+        The data scaling as a (min, max) data range, if it's a single range
+        that all of the data fits in.
+        """
+        try:
+            minvalue, maxvalue = map(float, self.options["chds"].split(","))
+        except (KeyError, ValueError):
+            return None
+        lower, upper = data_range(chain(self.datasets, self.hidden_datasets))
+        if lower < minvalue or upper > maxvalue:
+            return None
+        return (minvalue, maxvalue)
+
+    def _build_url(self, plan, axis_params, previous=None):
+        """
+        Build the URL following a plan made by _url(), reusing the encodings
+        in previous (see _segment()). Returns a URLWriter and the length of
+        the encoded data in the URL.
+        """
+        # Encode data
+        options = self.options
+        if plan["encoding"] == "text":
+            precision = plan["precision"]
+            encode = lambda d: encode_text(d, precision)
+            separator = "|"
+            prefix = "t"
+            segment_key = ("text", precision)
+        else:
+            encoder = get_encoder(plan["datarange"], encoders[plan["encoding"]])
+            encode = encoder.encode
+            separator = extended_separator
+            prefix = encoder.prefix
+            segment_key = (encoder.__class__, encoder.value_range)
+            if "chds" in options:
+                # The scaling has been folded into the data range.
+                options = options.copy()
+                del options["chds"]
+
+        # Downsample the data (after working out the range, so the scale
+        # stays the same)
+        if plan["points"]:
+            points, method = plan["points"], self.downsample or "lttb"
+            encode_all = encode
+            encode = lambda d: encode_all(downsample(d, points, method))
+            segment_key += (points, method)
+
+        trace = tracing.current()
+        if trace is not None:
+            started = time.time()
+        data = separator.join(self._segment(d, encode, segment_key, previous)
+                              for d in chain(self.datasets, self.hidden_datasets))
+        encoded_data = "%s%d:%s" % (prefix, len(self.datasets), data)
+        if trace is not None:
+            started = trace.add("encode", started)
         
-            # Turn the option lists into strings
-            axis_sides = smart_join(",", *axis_sides)
-            for opt in axis_options:
-                axis_options[opt] = smart_join("|", *axis_options[opt])
-            
-            url += "&chxt=%s&%s" % (axis_sides, urlencode(axis_options))
-            
-        return url
+        writer = URLWriter(self.base_url())
+        writer.add_options(options)
+        writer.add_quoted("chd", encoded_data)
+        writer.params.extend(axis_params)
+        if trace is not None:
+            trace.add("urlencode", started)
+        return writer, len(encoded_data)
+
+    def _segment(self, dataset, encode, key, previous=None):
+        """
+        Encode one dataset, reusing the result if it's already been encoded
+        the same way for this URL, or in previous: the encodings kept from
+        the chart's last URL (or from the chart it was cloned from). Datasets
+        are recognized by identity, and by their version, which changes
+        whenever their points do; lists have no version, so they shouldn't be
+        changed in place once they've been encoded.
+        """
+        key = (id(dataset), len(dataset), getattr(dataset, "_version", None)) + key
+        for segments in (self._segments, previous or {}):
+            try:
+                encoded_dataset, encoded = segments[key]
+            except KeyError:
+                continue
+            if encoded_dataset is dataset:
+                break
+        else:
+            encoded = encode(dataset)
+        # Hold on to the dataset so its id() can't be reused.
+        self._segments[key] = (dataset, encoded)
+        return encoded
+
+    def _axis_params(self):
+        """The quoted parameters for the axis options."""
+        if not self.axes:
+            return []
+
+        axis_options = SortedDict()
+        axis_sides = []
+        for i, axis in enumerate(self.axes):
+            axis_sides.append(smart_str(axis.side, errors="ignore"))
+            for opt in axis.options:
+                try:
+                    value = axis.options[opt] % i
+                except TypeError:
+                    continue
+                axis_options.setdefault(opt, []).append(smart_str(value, errors="ignore"))
+
+        params = ["chxt=%s" % quote(",".join(axis_sides))]
+        for opt, values in axis_options.items():
+            params.append("%s=%s" % (quote_key(opt), quote("|".join(values))))
+        return params
+
+    # The ways of making a URL shorter, in the order they're tried. Each
+    # _degrade_<step> method gets the current plan and returns the changes
+    # to make to it, or None when the step can't help any more.
+    degradation_steps = ('downsample', 'precision', 'encoding')
+
+    # Don't downsample below this many points.
+    min_points = 3
+
+    def _degrade_downsample(self, plan, length, data_length, budget):
+        if self.options.get('cht') not in self.downsample_types:
+            return None
+        points = plan["points"] or max([len(d) for d in chain(self.datasets, self.hidden_datasets)] or [0])
+        if points <= self.min_points:
+            # Including charts with no data: nothing to downsample.
+            return None
+        # The encoded data grows linearly with the number of points.
+        available = budget - (length - data_length)
+        target = int(points * float(max(available, 0)) / data_length)
+        return {"points": max(min(target, points - 1), self.min_points)}
 
+    def _degrade_precision(self, plan, length, data_length, budget):
+        if plan["encoding"] != "text" or plan["precision"] == 0:
+            return None
+        if plan["precision"] is None:
+            return {"precision": 2}
+        return {"precision": plan["precision"] - 1}
+
+    def _degrade_encoding(self, plan, length, data_length, budget):
+        if plan["encoding"] == "text":
+            # Text data scaled with a single "min,max" pair can be sent in
+            # extended encoding, using that pair as the data range.
+            datarange = self._chds_range()
+            if datarange:
+                return {"encoding": "extended", "datarange": datarange}
+        elif plan["encoding"] == "extended":
+            return {"encoding": "simple"}
+        return None
 
     def charts(self):
         res = []
         count = 1
-        for o in self.options['_final_color_map'].items():
+        for color, label, img in self.color_variants():
             res.append({  'id': count,
-                          'color': o[0],
-                          'label': o[1],
-                          'img': self.img(color_override=o[0])
+                          'color': color,
+                          'label': label,
+                          'img': img
                        })
             count += 1
         return res
+
+    def freeze(self):
+        """
+        Return an immutable ChartSpec snapshot of this chart.
+        """
+        options = SortedDict()
+        for key, value in self.options.items():
+            if key.startswith('_'):
+                # Internal values like the color map might be mutable.
+                value = deepcopy(value)
+            options[key] = value
+        datasets = list(self.datasets)
+        if options.get('cht', None) == 't' and "_mapdata" in options:
+            datasets.append(options.pop("_mapdata"))
+        for k in self.defaults:
+            if k not in options:
+                options[k] = self.defaults[k]
+
+        datarange = self.datarange
+        if not datarange:
+            datarange = data_range(chain(datasets, self.hidden_datasets))
+
+        return ChartSpec(
+            chart_class = self.__class__,
+            options = tuple(options.items()),
+            datasets = tuple(map(_copy_dataset, datasets)),
+            hidden_datasets = tuple(map(_copy_dataset, self.hidden_datasets)),
+            axes = tuple((axis.side, tuple(axis.options.items())) for axis in self.axes),
+            datarange = tuple(datarange),
+            alt = self.alt,
+            downsample = self.downsample,
+            downsample_points = self.downsample_points,
+            max_url_length = self.max_url_length,
+            encoding = self.encoding,
+            saveas = self.saveas,
+        )
+
+class ChartSpec(object):
+    """
+    A frozen, hashable description of a chart, made by Chart.freeze().
+    
+    Unlike Chart, building a ChartSpec's URL or image tag doesn't change
+    it, so a spec can be rendered any number of times, shared between
+    threads and kept in a process-wide cache. Specs describing the same
+    chart are equal and hash the same.
+    """
+    fields = (
+        'chart_class', 'options', 'datasets', 'hidden_datasets', 'axes',
+        'datarange', 'alt', 'downsample', 'downsample_points',
+        'max_url_length', 'encoding', 'saveas',
+    )
+    __slots__ = fields + ('key', '_url')
+
+    def __init__(self, **kwargs):
+        for name in self.fields:
+            object.__setattr__(self, name, kwargs.get(name))
+        digest = md5(repr(tuple(kwargs.get(name) for name in self.fields
+                                if name not in ('datasets', 'hidden_datasets'))))
+        _hash_datasets(digest, self.datasets or ())
+        _hash_datasets(digest, self.hidden_datasets or ())
+        object.__setattr__(self, 'key', digest.hexdigest())
+        object.__setattr__(self, '_url', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ChartSpec objects are immutable")
+
+    __delattr__ = __setattr__
+
+    def __getstate__(self):
+        return _getstate(self)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def __eq__(self, other):
+        return isinstance(other, ChartSpec) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def thaw(self):
+        """Return a new, mutable, Chart built from this spec."""
+        c = self._chart()
+        c.datasets = map(_copy_dataset, c.datasets)
+        c.hidden_datasets = map(_copy_dataset, c.hidden_datasets)
+        return c
+
+    def _chart(self):
+        # A Chart sharing the spec's datasets, for url() and img(), which
+        # don't change them.
+        c = self.chart_class()
+        c.options = SortedDict(deepcopy(self.options))
+        c.datasets = list(self.datasets)
+        c.hidden_datasets = list(self.hidden_datasets)
+        for side, options in self.axes:
+            axis = Axis(side)
+            axis.options = SortedDict(options)
+            c.axes.append(axis)
+        c.datarange = self.datarange
+        c.alt = self.alt
+        c.downsample = self.downsample
+        c.downsample_points = self.downsample_points
+        c.max_url_length = self.max_url_length
+        c.encoding = self.encoding
+        c.saveas = self.saveas
+        return c
+
+    def url(self):
+        # The URL is worked out from a throwaway Chart, and kept: the spec
+        # can't change, so neither can its URL.
+        if self._url is None:
+            object.__setattr__(self, '_url', self._chart().url())
+        return self._url
+
+    def img(self, color_override=None):
+        c = self._chart()
+        url = self.url()
+        if color_override is not None:
+            url = c.recolor(url, color_override)
+        return c._img_tag(url)
+
+def _copy_dataset(dataset):
+    """A copy of a dataset for a ChartSpec: arrays stay arrays, anything else is a tuple."""
+    if isinstance(dataset, Dataset):
+        return dataset.copy()
+    if isinstance(dataset, array):
+        return array(dataset.typecode, dataset)
+    return tuple(dataset)
+
+def _hash_datasets(digest, datasets):
+    # Datasets are hashed straight from their buffers: repr() of every point
+    # would cost more than encoding them.
+    digest.update("|%d" % len(datasets))
+    for dataset in datasets:
+        if isinstance(dataset, array):
+            digest.update("|%s%d:" % (dataset.typecode, len(dataset)))
+            digest.update(buffer(dataset))
+        else:
+            digest.update("|" + repr(dataset))
         
+#
+# Datasets
+#
+
+class Dataset(array):
+    """
+    A compact sequence of data points -- floats, in an array('d') buffer --
+    that keeps track of its smallest and largest values and how many points
+    are missing as data is added to it, so that Chart.url() doesn't have to
+    scan every point again to find the chart's data range.
+    
+    Points are converted with safefloat() on the way in; missing values are
+    stored (and read back) as NaN.
+    """
+    __slots__ = ('_min', '_max', '_nulls', '_stale', '_version')
+
+    def __new__(cls, values=()):
+        return array.__new__(cls, 'd')
+
+    def __init__(self, values=()):
+        self._min = self._max = None
+        self._nulls = 0
+        self._stale = False
+        # Goes up every time the points change
+        self._version = 0
+        self.extend(values)
+
+    def __reduce__(self):
+        return (self.__class__, (self.tolist(),))
+
+    def copy(self):
+        """A copy of the dataset, made without converting the points again."""
+        copy = self.__class__()
+        array.extend(copy, self)
+        copy._min, copy._max, copy._nulls, copy._stale = (
+            self._min, self._max, self._nulls, self._stale)
+        return copy
+
+    def append(self, value):
+        self.extend((value,))
+
+    # Iterators are consumed this many points at a time.
+    chunk_size = 10000
+
+    def extend(self, values):
+        if isinstance(values, (list, tuple)):
+            self._extend_chunk(values)
+        else:
+            values = iter(values)
+            while True:
+                chunk = list(islice(values, self.chunk_size))
+                if not chunk:
+                    break
+                self._extend_chunk(chunk)
+
+    def _extend_chunk(self, values):
+        points = map(_point, values)
+        present = [n for n in points if n == n]
+        if present:
+            minvalue, maxvalue = min(present), max(present)
+            if self._min is None or minvalue < self._min:
+                self._min = minvalue
+            if self._max is None or maxvalue > self._max:
+                self._max = maxvalue
+        self._nulls += len(points) - len(present)
+        array.fromlist(self, points)
+        self._version += 1
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def fromlist(self, values):
+        self.extend(values)
+
+    # Anything else that changes the points means the stats need to be
+    # worked out again the next time they're needed.
+
+    def _recalculate(self):
+        present = [n for n in self if n == n]
+        if present:
+            self._min, self._max = min(present), max(present)
+        else:
+            self._min = self._max = None
+        self._nulls = len(self) - len(present)
+        self._stale = False
+
+    def _stats(self):
+        if self._stale:
+            self._recalculate()
+        return self._min, self._max, self._nulls
+
+    @property
+    def min(self):
+        return self._stats()[0]
+
+    @property
+    def max(self):
+        return self._stats()[1]
+
+    @property
+    def nulls(self):
+        """The number of missing points."""
+        return self._stats()[2]
+
+    @property
+    def count(self):
+        """The number of points that aren't missing."""
+        return len(self) - self.nulls
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = array('d', map(_point, value))
+        else:
+            value = _point(value)
+        array.__setitem__(self, index, value)
+        self._stale = True
+        self._version += 1
+
+    def __setslice__(self, i, j, values):
+        array.__setslice__(self, i, j, array('d', map(_point, values)))
+        self._stale = True
+        self._version += 1
+
+    def insert(self, index, value):
+        array.insert(self, index, _point(value))
+        self._stale = True
+        self._version += 1
+
+    def _changes_points(method):
+        def wrapper(self, *args):
+            result = method(self, *args)
+            self._stale = True
+            self._version += 1
+            return result
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    __delitem__ = _changes_points(array.__delitem__)
+    __delslice__ = _changes_points(array.__delslice__)
+    __imul__ = _changes_points(array.__imul__)
+    pop = _changes_points(array.pop)
+    remove = _changes_points(array.remove)
+    byteswap = _changes_points(array.byteswap)
+    fromfile = _changes_points(array.fromfile)
+    fromstring = _changes_points(array.fromstring)
+    fromunicode = _changes_points(array.fromunicode)
+    del _changes_points
+
+_nan = float("nan")
+
+def _point(n):
+    """Convert n to a float for a Dataset, with NaN for missing values."""
+    n = safefloat(n)
+    if n is None:
+        return _nan
+    return n
+
+def is_missing(n):
+    """Missing points are None in lists, and NaN in datasets."""
+    return n is None or n != n
+
+def data_source(data):
+    """
+    Return something to iterate over to read the points from `data`.
+    
+    QuerySets that haven't been evaluated yet are read with iterator() so
+    that rows are streamed from the database instead of all being loaded
+    into the QuerySet's result cache.
+    """
+    if hasattr(data, "iterator") and getattr(data, "_result_cache", None) is None:
+        return data.iterator()
+    return data
+
+def data_range(datasets):
+    """
+    Return the (min, max) range covering several datasets. Dataset instances
+    already know their range; other sequences are scanned.
+    """
+    minimums = []
+    maximums = []
+    for d in datasets:
+        if isinstance(d, Dataset):
+            if d.count:
+                minimums.append(d.min)
+                maximums.append(d.max)
+        elif d:
+            minimums.append(min(d))
+            maximums.append(max(d))
+    if not minimums:
+        # Every point is missing, so any range will do.
+        return (0, 0)
+    return (min(minimums), max(maximums))
+
+#
+# Downsampling
+#
+
+def lttb(values, threshold):
+    """
+    Reduce `values` to `threshold` points using the Largest-Triangle-Three-
+    Buckets algorithm, which keeps the visual shape of a line. The points are
+    split into buckets and from each bucket the point forming the largest
+    triangle with the previously chosen point and the average of the next
+    bucket is kept. The first and last points are always kept.
+    
+    Values can't be missing (None); use minmax() for data with gaps.
+    """
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return values
+
+    sampled = [values[0]]
+    every = float(n - 2) / (threshold - 2)
+    a = 0
+    for i in xrange(threshold - 2):
+        # Average point of the next bucket
+        start = int((i + 1) * every) + 1
+        end = min(int((i + 2) * every) + 1, n)
+        avg_x = (start + end - 1) / 2.0
+        avg_y = sum(values[start:end]) / (end - start)
+
+        # Pick the point in this bucket with the largest triangle
+        ax, ay = a, values[a]
+        max_area = -1
+        for j in xrange(int(i * every) + 1, start):
+            area = abs((ax - avg_x) * (values[j] - ay) - (ax - j) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                a = j
+        sampled.append(values[a])
+
+    sampled.append(values[-1])
+    return sampled
+
+def minmax(values, threshold):
+    """
+    Reduce `values` to at most `threshold` points by splitting them into
+    threshold/2 buckets and keeping the smallest and largest value of each
+    bucket, in their original order. Every bucket becomes exactly two
+    points, so the points stay evenly spaced and datasets sampled together
+    stay lined up: a flat bucket repeats its value, and a bucket holding
+    only missing values becomes two missing values (None).
+    """
+    n = len(values)
+    buckets = threshold // 2
+    if threshold >= n or buckets < 1:
+        return values
+
+    sampled = []
+    size = float(n) / buckets
+    for i in xrange(buckets):
+        bucket = values[int(i * size):int((i + 1) * size)]
+        present = [v for v in bucket if not is_missing(v)]
+        if not present:
+            sampled.extend((None, None))
+            continue
+        low, high = min(present), max(present)
+        if bucket.index(low) < bucket.index(high):
+            sampled.extend((low, high))
+        else:
+            sampled.extend((high, low))
+    return sampled
+
+downsamplers = {
+    'lttb': lttb,
+    'minmax': minmax,
+}
+
+def downsample(values, threshold, method="lttb"):
+    """
+    Reduce `values` to about `threshold` points with one of the
+    `downsamplers`. Data with missing values is always reduced with
+    minmax(), which can handle the gaps.
+    """
+    if len(values) <= threshold:
+        return values
+    if method == "lttb":
+        if isinstance(values, Dataset):
+            has_gaps = values.nulls
+        else:
+            has_gaps = [v for v in values if is_missing(v)]
+        if has_gaps:
+            method = "minmax"
+    return downsamplers[method](values, threshold)
+
 #
 # {% chart-data %} and {% chart-grid-lines-data %}
 #
@@ -286,51 +1315,27 @@ class ChartDataNode(template.Node):
         
     def resolve(self, context):
         resolved = []
+        trace = tracing.current()
         
         # If the data is provided by the {% chart-data %} tag ...
         if self.type == 'chart-data':
             for data in self.datasets:
-                try:
-                    data = data.resolve(context)
-                except template.VariableDoesNotExist:
-                    data = []
-            
-                # XXX need different ways of representing pre-encoded data, data with
-                # different separators, etc.
-                if isinstance(data, basestring):
-                    data = filter(None, map(safefloat, data.split(",")))
-                else:
-                    # I don't understand why you would remove zero values, as this does?
-                    # I'm going to comment it out and use my own version
-                    # data = filter(None, map(safefloat, data))
-                    data = map(safefloat, data)
-                resolved.append(data)
+                data, started = _resolve_data(data, context, trace)
+                resolved.append(make_dataset(data))
+                if trace is not None:
+                    trace.add("convert", started)
         
         # If the data is provided by the {% chart-grid-lines-data %} tag ...
         elif self.type == 'chart-grid-lines-data':
             for data in self.datasets:
+                if trace is not None:
+                    started = time.time()
                 data = data.resolve(context)
-                
-                # Since this variable can contain multiple lists,
-                # We'll add an extra loop that doesn't exist above.
-                for series in data:
-                    
-                    # Split the tuple
-                    value_count, value = series
-                    # Extend the series to the length of the count
-                    series = [value] * value_count
-                    
-                    # Conduct the same filtering as above
-                    if isinstance(data, basestring):
-                        series = filter(None, map(safefloat, series.split(",")))
-                    else:
-                        series = map(safefloat, series)
-                    
-                    # And if there's anything there ...
-                    if series:
-                        # Add it to the final set
-                        resolved.append(series)
-                
+                if trace is not None:
+                    started = trace.add("resolve", started)
+                resolved.extend(grid_line_datasets(data))
+                if trace is not None:
+                    trace.add("convert", started)
 
         return resolved
         
@@ -344,26 +1349,76 @@ class ChartHiddenDataNode(template.Node):
 
     def resolve(self, context):
         resolved = []
+        trace = tracing.current()
 
         for data in self.datasets:
-            try:
-                data = data.resolve(context)
-            except template.VariableDoesNotExist:
-                data = []
-
-            # XXX need different ways of representing pre-encoded data, data with
-            # different separators, etc.
-            if isinstance(data, basestring):
-                data = filter(None, map(safefloat, data.split(",")))
-            else:
-                data = map(safefloat, data)
-            resolved.append(data)
+            data, started = _resolve_data(data, context, trace)
+            resolved.append(make_dataset(data))
+            if trace is not None:
+                trace.add("convert", started)
 
         return resolved
 
     def render(self, context):
         return ""
 
+def _resolve_data(data, context, trace=None):
+    """
+    Look up a data variable (no data if it doesn't exist), counting the time
+    towards trace's "resolve" phase. Returns the data and, when tracing, the
+    time after.
+    """
+    if trace is not None:
+        started = time.time()
+    try:
+        data = data.resolve(context)
+    except template.VariableDoesNotExist:
+        data = []
+    if trace is not None:
+        return data, trace.add("resolve", started)
+    return data, None
+
+def make_dataset(data):
+    """
+    Turn the data given to {% chart-data %}: a string of comma-separated
+    numbers, or any sequence data_source() understands, into a Dataset.
+    """
+    # XXX need different ways of representing pre-encoded data, data with
+    # different separators, etc.
+    if isinstance(data, basestring):
+        return Dataset(filter(None, map(safefloat, data.split(","))))
+    # I don't understand why you would remove zero values, as this does?
+    # I'm going to comment it out and use my own version
+    # data = filter(None, map(safefloat, data))
+    return Dataset(data_source(data))
+
+def grid_line_datasets(data):
+    """
+    The datasets for {% chart-grid-lines-data %}: one for each (count,
+    value) pair in data, repeating value count times.
+    """
+    resolved = []
+    # Since this variable can contain multiple lists,
+    # We'll add an extra loop that doesn't exist above.
+    for series in data:
+        
+        # Split the tuple
+        value_count, value = series
+        # Extend the series to the length of the count
+        series = [value] * value_count
+        
+        # Conduct the same filtering as above
+        if isinstance(data, basestring):
+            series = Dataset(filter(None, map(safefloat, series.split(","))))
+        else:
+            series = Dataset(series)
+        
+        # And if there's anything there ...
+        if series:
+            # Add it to the final set
+            resolved.append(series)
+    return resolved
+
 #
 # Chart options
 #
@@ -374,10 +1429,32 @@ class OptionNode(template.Node):
         self.args = args
         self.multi = multi
 
+        # When all the arguments are literals (e.g. {% chart-type "pie" %}),
+        # resolve them -- and, for options, call the callback -- just once,
+        # here, instead of on every render.
+        self.static_args = self.static_data = None
+        if [arg for arg in args if not _is_literal(arg)]:
+            return
+        self.static_args = [arg.literal for arg in args]
+        if self.folds_options:
+            try:
+                self.static_data = self.callback(*self.static_args)
+            except Exception:
+                # Leave any errors for render time, as usual.
+                pass
+
+    # Whether the callback just returns options, so that its result for
+    # literal arguments can be kept.
+    folds_options = True
+
     def render(self, context):
         return ""
 
     def resolve_arguments(self, context):
+        if self.static_args is not None:
+            for arg in self.static_args:
+                yield arg
+            return
         for arg in self.args:
             try:
                 yield arg.resolve(context)
@@ -385,15 +1462,27 @@ class OptionNode(template.Node):
                 yield None
 
     def update_options(self, options, context):
-        data = self.callback(*self.resolve_arguments(context))
-        if self.multi:
-            for key in data:
-                if key in options:
-                    options[key] = options[key] + self.multi + data[key]
-                else:
-                    options[key] = data[key]
+        if self.static_data is not None:
+            data = self.static_data
         else:
-            options.update(data)
+            data = self.callback(*self.resolve_arguments(context))
+        merge_options(options, data, self.multi)
+
+def merge_options(options, data, multi=None):
+    """
+    Add the options an option callback returned to options. For options
+    that can be given more than once, values for a key that's already set
+    are joined on to it with `multi`, the separator; otherwise they replace
+    it.
+    """
+    if multi:
+        for key in data:
+            if key in options:
+                options[key] = options[key] + multi + data[key]
+            else:
+                options[key] = data[key]
+    else:
+        options.update(data)
 
 class ChartOptionNode(OptionNode):
     def update_chart(self, chart, context):
@@ -402,6 +1491,17 @@ class ChartOptionNode(OptionNode):
 class AxisOptionNode(OptionNode):
     pass
 
+def _is_literal(arg):
+    """Whether a template.Variable is a constant (a string or a number)."""
+    return arg.lookups is None and not arg.translate
+
+# The code object flag for functions with *args
+CO_VARARGS = 0x04
+
+# Every option registered with option(): the tag's name -> (callback, multi,
+# node class). ChartBuilder finds its options here.
+option_callbacks = {}
+
 def option(tagname, multi=None, nodeclass=ChartOptionNode):
     """
     Decorator-helper to register a chart-foo option tag. The decorated function
@@ -410,14 +1510,14 @@ def option(tagname, multi=None, nodeclass=ChartOptionNode):
     which will be used as arguments in the chart URL.
     """
     def decorator(func):
-        # Figure out how to validate the args to the tag
-        args, varargs, varkw, defaults = inspect.getargspec(func)
-        max_args = min_args = 0
-        if args:
-            max_args = len(args)
-        if defaults:
-            min_args = max_args - len(defaults)
-        unlimited = bool(varargs)
+        # Figure out how to validate the args to the tag, straight from the
+        # function's code object (cheaper than inspect.getargspec(), and
+        # this runs for every option when the library is loaded).
+        max_args = func.func_code.co_argcount
+        min_args = 0
+        if func.func_defaults:
+            min_args = max_args - len(func.func_defaults)
+        unlimited = bool(func.func_code.co_flags & CO_VARARGS)
         
         def template_tag_callback(parser, token):
             bits = iter(token.split_contents())
@@ -433,6 +1533,7 @@ def option(tagname, multi=None, nodeclass=ChartOptionNode):
         template_tag_callback.__name__ = func.__name__
         template_tag_callback.__doc__ = func.__doc__        
         register.tag(tagname, template_tag_callback)
+        option_callbacks[tagname] = (func, multi, nodeclass)
         return func
         
     return decorator
@@ -817,14 +1918,26 @@ class AxisNode(template.Node):
 class NoAxisNode(AxisNode):
     def resolve(self, context):
         a = self.get_axis(context)
-        a.options["chxs"] = "%s,000000,11,0,_"
-        a.options["chxl"] = "%s:||"
+        a.hide()
         return a
         
 class Axis(object):
+    __slots__ = ('side', 'options')
+
     def __init__(self, side):
         self.side = side
         self.options = SortedDict()
+
+    def __getstate__(self):
+        return _getstate(self)
+
+    def __setstate__(self, state):
+        _setstate(self, state)
+
+    def hide(self):
+        """Draw the axis without its line, ticks or labels."""
+        self.options["chxs"] = "%s,000000,11,0,_"
+        self.options["chxl"] = "%s:||"
         
 # Axis options use %s placeholders for the axis index; this gets
 # filled in by Chart.url()
@@ -861,6 +1974,9 @@ def axis_range(length):
 # "Metadata" nodes
 #
 class MetadataNode(ChartOptionNode):
+    # The callback changes the chart itself, so it has to run every time.
+    folds_options = False
+
     def update_chart(self, chart, context):
         self.callback(chart, *self.resolve_arguments(context))
         
@@ -886,37 +2002,456 @@ def chart_grid_lines(chart):
     """
     chart.grid_lines = True
 
+@option("chart-downsample", nodeclass=MetadataNode)
+def chart_downsample(chart, method="lttb", points=None):
+    """
+    Downsample each dataset of a line chart to about two points per pixel of
+    the chart's width (or to `points` points) using "lttb" (Largest-Triangle-
+    Three-Buckets) or "minmax" (the smallest and largest value from each
+    bucket).
+    """
+    if method not in downsamplers:
+        return
+    try:
+        points = points and int(points)
+    except ValueError:
+        return
+    chart.downsample = method
+    chart.downsample_points = points
+
+@option("chart-encoding", nodeclass=MetadataNode)
+def chart_encoding(chart, encoding):
+    """
+    Choose how the data is encoded: "text", "extended", "simple", or "auto"
+    to use the most compact encoding that's precise enough for the chart's
+    size.
+    """
+    if encoding in ("text", "extended", "simple", "auto"):
+        chart.encoding = encoding
+
+@option("chart-max-url-length", nodeclass=MetadataNode)
+def chart_max_url_length(chart, length):
+    """
+    Keep the chart's URL under `length` characters by downsampling the data,
+    dropping precision and switching to a more compact encoding, in that
+    order, until it fits.
+    """
+    try:
+        chart.max_url_length = int(length)
+    except (TypeError, ValueError):
+        return
+
+#
+# Building charts in Python
+#
+class ChartBuilder(object):
+    """
+    Builds a Chart without a template, with the same options as the tags.
+    Each {% chart-foo-bar %} option tag (and {% data-point-labels %}) is a
+    method, foo_bar(), taking the tag's arguments; {% chart-data %} is
+    data(), {% chart-data-hidden %} is hidden_data() and
+    {% chart-grid-lines-data %} is grid_lines_data(). They return the
+    builder, so they can be chained:
+
+        chart = (ChartBuilder().type("line").size("300x200")
+                 .data(sales, costs).colors("336699", "CC0000")
+                 .chart())
+
+    axis() adds an axis, returning an AxisBuilder for its options:
+
+        builder.axis("left").labels(0, 50, 100).range(0, 100)
+
+    Arguments are used as given, so there's no template or context to build
+    -- the cheap way to make lots of charts in a view, an API or a batch job.
+    """
+    def __init__(self, extends=None, saveas=None):
+        if extends is not None:
+            self._chart = extends.clone()
+        else:
+            self._chart = Chart()
+        if saveas:
+            self._chart.saveas = saveas
+
+    def __getattr__(self, name):
+        tagname = name.replace("_", "-")
+        callback, multi, nodeclass = (option_callbacks.get("chart-" + tagname) or
+                                      option_callbacks.get(tagname) or
+                                      (None, None, None))
+        if callback is None or issubclass(nodeclass, AxisOptionNode):
+            raise AttributeError("ChartBuilder has no option '%s'" % name)
+        chart = self._chart
+        def set_option(*args):
+            if issubclass(nodeclass, MetadataNode):
+                callback(chart, *args)
+            else:
+                merge_options(chart.options, callback(*args), multi)
+            return self
+        set_option.__name__ = name
+        set_option.__doc__ = callback.__doc__
+        return set_option
+
+    def data(self, *datasets):
+        """Add datasets: strings of comma-separated numbers, or sequences."""
+        self._chart.datasets.extend(map(make_dataset, datasets))
+        return self
+
+    def hidden_data(self, *datasets):
+        self._chart.hidden_datasets.extend(map(make_dataset, datasets))
+        return self
+
+    def grid_lines_data(self, *data):
+        for series in data:
+            self._chart.datasets.extend(grid_line_datasets(series))
+        return self
+
+    def axis(self, side, hide=False):
+        """
+        Add an axis on side ("left", "right", "top" or "bottom", or the chart
+        API's name for it), hidden if hide is true; returns its AxisBuilder.
+        """
+        axis = Axis(AxisNode.sides.get(side, side))
+        if hide:
+            axis.hide()
+        self._chart.axes.append(axis)
+        return AxisBuilder(axis)
+
+    def chart(self):
+        """The Chart built so far (not a copy)."""
+        return self._chart
+
+    def url(self):
+        return self._chart.url()
+
+    def img(self):
+        return self._chart.img()
+
+class AxisBuilder(object):
+    """
+    Sets an axis's options: each {% axis-foo-bar %} tag is a method,
+    foo_bar(), returning the AxisBuilder.
+    """
+    def __init__(self, axis):
+        self.axis = axis
+
+    def __getattr__(self, name):
+        callback, multi, nodeclass = option_callbacks.get(
+            "axis-" + name.replace("_", "-"), (None, None, None))
+        if callback is None or not issubclass(nodeclass, AxisOptionNode):
+            raise AttributeError("AxisBuilder has no option '%s'" % name)
+        options = self.axis.options
+        def set_option(*args):
+            merge_options(options, callback(*args), multi)
+            return self
+        set_option.__name__ = name
+        set_option.__doc__ = callback.__doc__
+        return set_option
+
 #
 # Helper functions
 #
 extended_separator = ","
 
-def encode_text(values):
-    return extended_separator.join(str(v) for v in values)
+def encode_text(values, precision=None):
+    if precision is None:
+        return extended_separator.join(is_missing(v) and "_" or str(v) for v in values)
+    return extended_separator.join(_round_text(v, precision) for v in values)
+
+def _round_text(n, precision):
+    """Format n with at most `precision` decimal places."""
+    if is_missing(n):
+        return "_"
+    text = "%.*f" % (precision, n)
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return text
 
 def encode_extended(values, value_range):
     """Encode data using Google's "extended" encoding for the most granularity."""
-    return "".join(num2chars(v, value_range) for v in values)
+    return get_encoder(value_range).encode(values)
 
 _encoding_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-."
-_num2chars = [a+b for a in _encoding_chars for b in _encoding_chars]
+
+class lazy_table(object):
+    """
+    A class attribute that's built by calling build() the first time it's
+    read, rather than when the module is imported.
+    """
+    def __init__(self, build):
+        self.build = build
+        self.table = None
+
+    def __get__(self, instance, owner):
+        if self.table is None:
+            self.table = self.build()
+        return self.table
 
 def num2chars(n, value_range):
-    if n is not None:
-        return _num2chars[norm(n, value_range)]
-    else:
-        return '__'
+    return get_encoder(value_range).encode_point(n)
     
 def norm(n, value_range):
-    minvalue, maxvalue = value_range
-    if minvalue == maxvalue == 0:
-        return 0
-    elif minvalue >= 0:
-        return int(round(float(n) / maxvalue * 4095, 0))
-    elif maxvalue <= 0:
-        return 4095 - int(round(float(n) * 4095 / minvalue))
-    else:
-        return int(round((n - minvalue) * (float(4095) / (maxvalue - minvalue))))
+    return get_encoder(value_range).norm(n)
+
+# NumPy is optional; when it's around, long datasets are normalized in one
+# array operation instead of one norm() call per point. Shorter datasets
+# aren't worth the cost of building the arrays -- or of importing NumPy,
+# which waits until the first long dataset; see get_numpy().
+numpy = None
+_numpy_checked = False
+
+numpy_threshold = 1000
+
+def get_numpy():
+    """The numpy module, or None if it isn't installed."""
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+        _numpy_checked = True
+    return numpy
+
+class ExtendedEncoder(object):
+    """
+    Encodes data against a fixed (min, max) value range.
+    
+    Everything norm() used to work out for every single point -- which way
+    to scale the data and the scale factor itself -- is worked out once
+    here, so use get_encoder() to share encoders between datasets and
+    charts with the same range.
+    """
+    # All 4096 two-character codes, in order
+    chars = lazy_table(lambda: [a+b for a in _encoding_chars for b in _encoding_chars])
+    missing = '__'
+    levels = 4095
+    prefix = 'e'
+
+    def __init__(self, value_range):
+        # The bounds can be strings, from {% chart-data-range %}; they have
+        # to be numbers before they're compared.
+        minvalue, maxvalue = map(float, value_range)
+        self.value_range = value_range
+        self.offset = 0
+        self.scale = None
+        if minvalue == maxvalue == 0:
+            self.mode = "zero"
+        elif minvalue >= 0:
+            # n / max * levels
+            self.mode = "positive"
+            self.scale = maxvalue
+        elif maxvalue <= 0:
+            # levels - n * levels / min
+            self.mode = "negative"
+            self.scale = minvalue
+        else:
+            # (n - min) * (levels / (max - min))
+            self.mode = "mixed"
+            self.offset = minvalue
+            self.scale = float(self.levels) / (maxvalue - minvalue)
+
+    def norm(self, n):
+        levels = self.levels
+        if self.mode == "zero":
+            return 0
+        elif self.mode == "positive":
+            return int(round(float(n) / self.scale * levels, 0))
+        elif self.mode == "negative":
+            return levels - int(round(float(n) * levels / self.scale))
+        else:
+            return int(round((n - self.offset) * self.scale))
+
+    def encode_point(self, n):
+        if is_missing(n):
+            return self.missing
+        return self.chars[self.norm(n)]
+
+    def encode(self, values):
+        if len(values) >= numpy_threshold and get_numpy() is not None:
+            return self._encode_numpy(values)
+
+        # The scaling is spelled out for each mode (rather than calling
+        # norm()) to keep function calls out of the per-point loop.
+        chars, missing, levels = self.chars, self.missing, self.levels
+        scale, offset = self.scale, self.offset
+        if self.mode == "zero":
+            zero = chars[0]
+            encoded = [missing if n is None or n != n else zero for n in values]
+        elif self.mode == "positive":
+            encoded = [missing if n is None or n != n else chars[int(round(float(n) / scale * levels, 0))]
+                       for n in values]
+        elif self.mode == "negative":
+            encoded = [missing if n is None or n != n else chars[levels - int(round(float(n) * levels / scale))]
+                       for n in values]
+        else:
+            encoded = [missing if n is None or n != n else chars[int(round((n - offset) * scale))]
+                       for n in values]
+        return "".join(encoded)
+
+    def _encode_numpy(self, values):
+        """
+        Vectorized version of encode(); the output is identical to the
+        pure-Python path, including the missing value marker.
+        """
+        if isinstance(values, array):
+            # Datasets can be read straight from their buffer.
+            points = numpy.frombuffer(values, dtype=float)
+        else:
+            points = numpy.fromiter((_nan if v is None else v for v in values), float, len(values))
+        missing = numpy.isnan(points)
+        points = numpy.where(missing, 0, points)
+
+        # Same arithmetic, in the same order, as norm().
+        levels = self.levels
+        if self.mode == "zero":
+            scaled = numpy.zeros(len(points))
+        elif self.mode == "positive":
+            scaled = points / self.scale * levels
+        elif self.mode == "negative":
+            scaled = levels - _round(points * levels / self.scale)
+        else:
+            scaled = (points - self.offset) * self.scale
+
+        indexes = _round(scaled).astype(int)
+        indexes[missing] = 0
+        chars = _chars_array(self.chars)[indexes]
+        chars[missing] = self.missing
+        return "".join(chars.tolist())
+
+_simple_encoding_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+class SimpleEncoder(ExtendedEncoder):
+    """
+    Google's "simple" encoding: one character per point, so only 62 levels,
+    but half the size of extended encoding.
+    """
+    chars = list(_simple_encoding_chars)
+    missing = '_'
+    levels = 61
+    prefix = 's'
+
+def encode_simple(values, value_range):
+    """Encode data using Google's "simple" encoding for the most compact URLs."""
+    return get_encoder(value_range, SimpleEncoder).encode(values)
+
+encoders = {
+    'extended': ExtendedEncoder,
+    'simple': SimpleEncoder,
+}
+
+def encode_datasets(datasets, encoders):
+    """
+    Encode each dataset with its own encoder. With NumPy, all the points are
+    scaled in one vectorized pass, whatever each encoder's range; the output
+    is the same as encoder.encode(dataset) for each one. The encoders have
+    to be of the same class.
+    """
+    if sum(len(d) for d in datasets) < numpy_threshold or get_numpy() is None:
+        return [encoder.encode(d) for d, encoder in zip(datasets, encoders)]
+
+    encoder_class = encoders[0].__class__
+    counts = [len(d) for d in datasets]
+    points = numpy.concatenate([numpy.frombuffer(d, dtype=float) for d in datasets if len(d)])
+    missing = numpy.isnan(points)
+    points = numpy.where(missing, 0, points)
+
+    # Each point gets its dataset's encoder's mode, scale and offset, and is
+    # scaled the way that mode scales it in _encode_numpy().
+    modes = ("zero", "positive", "negative", "mixed")
+    mode = numpy.repeat([modes.index(e.mode) for e in encoders], counts)
+    scale = numpy.repeat([e.scale or 1.0 for e in encoders], counts)
+    offset = numpy.repeat([e.offset for e in encoders], counts)
+    levels = encoder_class.levels
+    scaled = numpy.select([mode == 1, mode == 2, mode == 3], [
+        points / scale * levels,
+        levels - _round(points * levels / scale),
+        (points - offset) * scale,
+    ], 0)
+
+    indexes = _round(scaled).astype(int)
+    indexes[missing] = 0
+    chars = _chars_array(encoder_class.chars)[indexes]
+    chars[missing] = encoder_class.missing
+    encoded = "".join(chars.tolist())
+
+    # Every point is encoded in the same number of characters.
+    width = len(encoder_class.missing)
+    result, start = [], 0
+    for count in counts:
+        result.append(encoded[start:start + count * width])
+        start += count * width
+    return result
+
+# Encoders are cached by value range, so charts with the same fixed
+# {% chart-data-range %} share one.
+_encoders = {}
+max_cached_encoders = 128
+
+def get_encoder(value_range, encoder_class=ExtendedEncoder):
+    key = (encoder_class, tuple(value_range))
+    try:
+        return _encoders[key]
+    except KeyError:
+        pass
+    if len(_encoders) >= max_cached_encoders:
+        _encoders.clear()
+    encoder = _encoders[key] = encoder_class(value_range)
+    return encoder
+
+def _round(a):
+    """
+    Round half away from zero, like the builtin round() (numpy.round()
+    rounds half to even, which would give different output).
+    """
+    magnitude = numpy.abs(a)
+    whole = numpy.floor(magnitude)
+    return numpy.sign(a) * (whole + (magnitude - whole >= 0.5))
+
+_chars_arrays = {}
+
+def _chars_array(chars):
+    try:
+        return _chars_arrays[id(chars)]
+    except KeyError:
+        array = _chars_arrays[id(chars)] = numpy.array(chars, dtype=object)
+        return array
+
+#
+# Caching
+#
+
+_caches = {}
+
+def chart_cache():
+    """
+    Return the cache used for chart URLs: the GOOGLECHARTS_CACHE_BACKEND
+    setting (a cache alias, or a backend URI on older versions of Django),
+    or Django's default cache if that's not set.
+    """
+    backend = getattr(settings, "GOOGLECHARTS_CACHE_BACKEND", None)
+    if backend is None:
+        from django.core.cache import cache
+        return cache
+    try:
+        return _caches[backend]
+    except KeyError:
+        from django.core.cache import get_cache
+        cache = _caches[backend] = get_cache(backend)
+        return cache
+
+# Objects with __slots__ need some help to be pickled (e.g. to be cached) with
+# the older pickle protocols.
+
+def _getstate(obj):
+    state = dict(getattr(obj, "__dict__", {}))
+    for name in obj.__slots__:
+        if name != "__dict__" and hasattr(obj, name):
+            state[name] = getattr(obj, name)
+    return state
+
+def _setstate(obj, state):
+    for name, value in state.items():
+        setattr(obj, name, value)
 
 def safefloat(n):
     try:
@@ -932,15 +2467,106 @@ def smart_join(sep, *args):
 # make reading gchart URLs much easier.
 from urllib import quote_plus
 
-def urlencode(query, safe="/:,|"):
+url_safe = "/:,|"
+
+# Quoted values, by the string quoted; see quote().
+_quoted = {}
+
+# Only strings up to this long are kept in _quoted, and no more than
+# max_quoted of them.
+max_quoted_length = 256
+max_quoted = 1024
+
+def quote(s):
+    """
+    quote_plus(s, safe=url_safe). Labels, legends, colors and keys turn up
+    in chart after chart, so short strings are only quoted once.
+    """
+    try:
+        return _quoted[s]
+    except (KeyError, TypeError):
+        pass
+    quoted = quote_plus(s, safe=url_safe)
+    if len(s) <= max_quoted_length:
+        if len(_quoted) >= max_quoted:
+            _quoted.clear()
+        _quoted[s] = quoted
+    return quoted
+
+# Quoted option keys. There are only so many of them, so they're kept for
+# good.
+_quoted_keys = {}
+
+def quote_key(key):
+    try:
+        return _quoted_keys[key]
+    except KeyError:
+        quoted = _quoted_keys[key] = quote_plus(key, safe=url_safe)
+        return quoted
+
+def urlencode(query, safe=url_safe):
     '''Omit any options that begin with _; for internal use'''
 
     if hasattr(query, "items"):
         query = query.items()
 
-    qlist = ["%s=%s" % (quote_plus(k, safe=safe), quote_plus(v, safe=safe))
-             for (k,v) in query if not k.startswith('_')]
+    if safe == url_safe:
+        qlist = ["%s=%s" % (quote_key(k), quote(v))
+                 for (k,v) in query if not k.startswith('_')]
+    else:
+        qlist = ["%s=%s" % (quote_plus(k, safe=safe), quote_plus(v, safe=safe))
+                 for (k,v) in query if not k.startswith('_')]
     return "&".join(qlist)
+
+class URLWriter(object):
+    """
+    Builds a chart URL out of quoted "key=value" parameters, which are only
+    joined together at the end.
+
+    Quoting leaves nothing in a parameter that needs escaping in HTML, so
+    html() escapes the URL by joining the parameters with "&amp;" instead of
+    "&" -- there's no escaping pass over the data.
+    """
+    __slots__ = ('base', 'params', 'url')
+
+    def __init__(self, base):
+        self.base = base
+        self.params = []
+        self.url = None
+
+    def add(self, key, value):
+        self.params.append("%s=%s" % (quote_key(key), quote(value)))
+
+    def add_quoted(self, key, value):
+        """Add a parameter whose value is already safe, like encoded data."""
+        self.params.append("%s=%s" % (key, value))
+
+    def add_options(self, options):
+        """Add a chart's options, leaving out the ones that begin with _."""
+        params = self.params
+        for key, value in options.items():
+            if not key.startswith('_'):
+                params.append("%s=%s" % (quote_key(key), quote(value)))
+
+    def getvalue(self):
+        """The URL, built once."""
+        if self.url is None:
+            self.url = "%s?%s" % (self.base, "&".join(self.params))
+        return self.url
+
+    def html(self):
+        """The URL, escaped for HTML."""
+        return "%s?%s" % (escape(self.base), "&amp;".join(self.params))
+
+def _split_query(url, key, value):
+    """
+    Split `url` around the value of the `key` parameter, which is `value`;
+    returns the parts before and after it.
+    """
+    quoted = quote(value)
+    start = url.index("%s=%s" % (key, quoted)) + len(key) + 1
+    end = start + len(quoted)
+    return url[:start], url[end:]
     
 def flatten(iterator):
     for i in iterator:
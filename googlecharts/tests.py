@@ -1,5 +1,1144 @@
+import sys
 import unittest
 
+from googlecharts.templatetags import charts
+
 class MyTests(unittest.TestCase):
     def test_it(self):
-        self.fail()
\ No newline at end of file
+        self.fail()
+
+
+class EncodingTests(unittest.TestCase):
+    def setUp(self):
+        self.old_threshold = charts.numpy_threshold
+
+    def tearDown(self):
+        charts.numpy_threshold = self.old_threshold
+
+    def test_encode_extended(self):
+        self.assertEqual(charts.encode_extended([0, None, 5, 10], (0, 10)), "AA__gA..")
+
+    def test_numpy_matches_pure_python(self):
+        if charts.get_numpy() is None:
+            self.skipTest("NumPy isn't installed")
+        for sign, offset, value_range in [(1, -20, (-20, 720)), (1, 0, (0, 740)),
+                                          (-1, 0, (-740, 0))]:
+            values = [sign * i * 0.37 + offset for i in range(2000)]
+            values[10] = None
+            charts.numpy_threshold = 1000
+            vectorized = charts.encode_extended(values, value_range)
+            charts.numpy_threshold = sys.maxint
+            pure = charts.encode_extended(values, value_range)
+            self.assertEqual(vectorized, pure)
+
+    def test_encode_simple(self):
+        self.assertEqual(charts.encode_simple([0, None, 5, 10], (0, 10)), "A_f9")
+
+    def test_encoders_are_shared(self):
+        encoder = charts.get_encoder((-10, 10))
+        self.assert_(charts.get_encoder((-10, 10)) is encoder)
+        self.assertEqual(encoder.mode, "mixed")
+        self.assertEqual(encoder.encode([-10, None, 10]), "AA__..")
+
+    def test_string_bounds(self):
+        # As given by {% chart-data-range "-10" "10" %}
+        self.assertEqual(charts.get_encoder(("-10", "10")).mode, "mixed")
+        self.assertEqual(charts.encode_extended([-10, 10], ("-10", "10")), "AA..")
+        self.assertEqual(charts.encode_extended([-100, 0], ("-100", "0")), "AA..")
+
+
+class URLCacheTests(unittest.TestCase):
+    def setUp(self):
+        from django.conf import settings
+        self.settings = settings
+        settings.GOOGLECHARTS_URL_CACHE = True
+        settings.GOOGLECHARTS_CACHE_BACKEND = "locmem://"
+
+    def tearDown(self):
+        self.settings.GOOGLECHARTS_URL_CACHE = False
+        del self.settings.GOOGLECHARTS_CACHE_BACKEND
+
+    def make_chart(self):
+        c = charts.Chart()
+        c.options["cht"] = "lc"
+        c.datasets.append([1.0, 2.0, 3.0])
+        return c
+
+    def test_cache_key_is_stable(self):
+        self.assertEqual(self.make_chart().cache_key(), self.make_chart().cache_key())
+        other = self.make_chart()
+        other.datasets.append([4.0])
+        self.assertNotEqual(self.make_chart().cache_key(), other.cache_key())
+
+    def test_cache_key_covers_data_and_settings(self):
+        c = self.make_chart()
+        c.datasets = [charts.Dataset([1, 2, 3])]
+        key = c.cache_key()
+        c.datasets[0][0] = 9
+        self.assertNotEqual(c.cache_key(), key)
+        c.datasets[0][0] = 1
+        self.assertEqual(c.cache_key(), key)
+        # Datasets split differently are different charts.
+        c.datasets = [charts.Dataset([1, 2]), charts.Dataset([3])]
+        self.assertNotEqual(c.cache_key(), key)
+
+        c = self.make_chart()
+        key = c.cache_key()
+        self.settings.GOOGLECHARTS_ENCODING = "simple"
+        try:
+            self.assertNotEqual(c.cache_key(), key)
+        finally:
+            del self.settings.GOOGLECHARTS_ENCODING
+
+    def test_pickle(self):
+        import pickle
+        c = self.make_chart()
+        c.axes.append(charts.Axis("x"))
+        for protocol in (0, pickle.HIGHEST_PROTOCOL):
+            copy = pickle.loads(pickle.dumps(c, protocol))
+            self.assertEqual(copy.cache_key(), c.cache_key())
+
+    def test_hit_skips_encoding(self):
+        url = self.make_chart().url()
+        c = self.make_chart()
+        c._url = lambda: self.fail("URL should have come from the cache")
+        self.assertEqual(c.url(), url)
+
+    def test_hit_restores_degradation(self):
+        def make_chart():
+            c = self.make_chart()
+            c.datasets = [charts.Dataset(range(500))]
+            c.options["chs"] = "300x100"
+            c.max_url_length = 300
+            return c
+        miss = make_chart()
+        url = miss.url()
+        self.assert_(miss.degradation)
+        hit = make_chart()
+        self.assertEqual(hit.url(), url)
+        self.assertEqual(hit.degradation, miss.degradation)
+        self.assertEqual(hit.datarange, miss.datarange)
+        self.assertEqual(hit.img(), miss.img())
+
+
+class ChartCacheTests(unittest.TestCase):
+    def setUp(self):
+        from django.conf import settings
+        self.settings = settings
+        settings.GOOGLECHARTS_CACHE_BACKEND = "locmem://"
+
+    def tearDown(self):
+        del self.settings.GOOGLECHARTS_CACHE_BACKEND
+
+    def render(self, source, **context):
+        from django import template
+        context = template.Context(context)
+        return template.Template("{% load charts %}" + source).render(context), context
+
+    def test_cached_output(self):
+        source = '{% chart cache 60 key %}{% chart-data data %}{% endchart %}'
+        first, _ = self.render(source, key="a", data=[1, 2, 3])
+        second, _ = self.render(source, key="a", data=[3, 2, 1])
+        third, _ = self.render(source, key="b", data=[3, 2, 1])
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, third)
+
+    def test_cached_context_variables(self):
+        source = ('{% chart cache 60 as c %}{% chart-data data %}'
+                  '{% chart-auto-colors "336699" labels %}{% endchart %}')
+        _, context = self.render(source, data=[1, 2], labels=["one", "two"])
+        _, cached = self.render(source, data=[2, 1], labels=["one", "two"])
+        self.assertEqual(cached["c"].datasets, context["c"].datasets)
+        self.assertEqual(cached["chart_one_only"], context["chart_one_only"])
+        self.assertEqual(cached["final_color_map"], context["final_color_map"])
+
+
+class DatasetTests(unittest.TestCase):
+    def test_stats(self):
+        d = charts.Dataset(["1", 5, None, "x", -2.5])
+        # Missing points are stored, and read back, as NaN (see is_missing()).
+        self.assertEqual(map(charts.is_missing, d), [False, False, True, True, False])
+        self.assertEqual((d.min, d.max, d.count, d.nulls), (-2.5, 5.0, 3, 2))
+        d.extend([10, None])
+        self.assertEqual((d.min, d.max, d.count, d.nulls), (-2.5, 10.0, 4, 3))
+
+    def test_stats_after_removal(self):
+        d = charts.Dataset([1, 5, 10])
+        d.remove(10.0)
+        del d[0]
+        self.assertEqual((d.min, d.max, d.count), (5.0, 5.0, 1))
+
+    def test_pickle(self):
+        import pickle
+        d = charts.Dataset([1, None, 3])
+        for protocol in (0, pickle.HIGHEST_PROTOCOL):
+            copy = pickle.loads(pickle.dumps(d, protocol))
+            self.assertEqual(copy.__class__, charts.Dataset)
+            self.assertEqual((copy.min, copy.max, copy.nulls), (1.0, 3.0, 1))
+
+    def test_data_range(self):
+        datasets = [charts.Dataset([1, None, 3]), charts.Dataset([]), [-4.0, 2.0]]
+        self.assertEqual(charts.data_range(datasets), (-4.0, 3.0))
+
+    def test_all_missing(self):
+        self.assertEqual(charts.data_range([charts.Dataset([None, None])]), (0, 0))
+        c = charts.Chart()
+        c.datasets.append(charts.Dataset([None, None]))
+        self.assert_(c.url().endswith("chd=e1:____"))
+
+    def test_streamed_ingestion(self):
+        class Source(object):
+            _result_cache = None
+            def __iter__(self):
+                raise AssertionError("should have used iterator()")
+            def iterator(self):
+                return (i % 7 for i in xrange(25))
+
+        class SmallChunks(charts.Dataset):
+            chunk_size = 10
+
+        d = SmallChunks()
+        d.extend(charts.data_source(Source()))
+        self.assertEqual(len(d), 25)
+        self.assertEqual((d.min, d.max), (0.0, 6.0))
+
+
+class DownsampleTests(unittest.TestCase):
+    values = [float(i % 50) for i in range(1000)]
+
+    def test_lttb(self):
+        sampled = charts.lttb(self.values, 100)
+        self.assertEqual(len(sampled), 100)
+        self.assertEqual((sampled[0], sampled[-1]), (self.values[0], self.values[-1]))
+        self.assertEqual(charts.lttb(self.values[:50], 100), self.values[:50])
+
+    def test_minmax(self):
+        values = self.values[:]
+        values[0:40] = [None] * 40
+        values[60:80] = [7.0] * 20
+        sampled = charts.minmax(values, 100)
+        # Every bucket keeps two points: the first two are all gaps, and
+        # the flat ones repeat their value.
+        self.assertEqual(len(sampled), 100)
+        self.assertEqual(sampled[:4], [None] * 4)
+        self.assertEqual(sampled[6:8], [7.0, 7.0])
+        self.assertEqual((min(sampled[4:]), max(sampled[4:])), (0.0, 49.0))
+
+    def test_gaps_use_minmax(self):
+        values = self.values + [None]
+        self.assertEqual(charts.downsample(values, 100), charts.minmax(values, 100))
+
+    def test_chart(self):
+        c = charts.Chart()
+        c.options["chs"] = "50x50"
+        c.datasets.append(charts.Dataset(self.values))
+        full = c.clone().url()
+        c.downsample = "lttb"
+        self.assertEqual(len(full) - len(c.url()), 2 * (1000 - 100))
+
+
+class URLBudgetTests(unittest.TestCase):
+    def make_chart(self, values, **options):
+        c = charts.Chart()
+        c.options.update(options)
+        c.datasets.append(charts.Dataset(values))
+        return c
+
+    def test_under_budget(self):
+        c = self.make_chart(range(10))
+        c.max_url_length = 2000
+        c.url()
+        self.assertEqual(c.degradation, [])
+
+    def test_downsample(self):
+        c = self.make_chart([i % 100 for i in range(3000)], chs="300x200")
+        c.max_url_length = 500
+        url = c.url()
+        self.assert_(len(url) <= 500)
+        self.assertEqual([d["step"] for d in c.degradation][:1], ["downsample"])
+        self.assertEqual(c.degradation[-1]["length"], len(url))
+
+    def test_precision_then_encoding(self):
+        values = [i / 3.0 for i in range(50)]
+        c = self.make_chart(values, cht="bvg", chds="0,20")
+        full = len(c.clone().url())
+        c.max_url_length = full - 300
+        c.url()
+        self.assertEqual(c.degradation, [{"step": "precision", "precision": 2, "length": len(c.url())}])
+        self.assert_("chd=t1:0,0.33,0.67,1," in c.url())
+
+        c = self.make_chart(values, cht="bvg", chds="0,20")
+        c.max_url_length = 180
+        url = c.url()
+        self.assertEqual(c.degradation[-1]["step"], "encoding")
+        self.assert_("chd=e1:" in url and "chds" not in url)
+
+    def test_simple_encoding(self):
+        c = self.make_chart([i % 100 for i in range(100)], cht="bvg")
+        c.max_url_length = len(c.clone().url()) - 50
+        url = c.url()
+        self.assertEqual(c.degradation, [{"step": "encoding", "encoding": "simple", "length": len(url)}])
+        self.assert_("chd=s1:" in url)
+
+    def test_no_data(self):
+        # No points to downsample; the URL is left over budget.
+        c = charts.Chart()
+        c.options["cht"] = "lc"
+        c.options["chtt"] = "A long title " * 10
+        c.max_url_length = 100
+        url = c.url()
+        self.assert_(len(url) > 100)
+        self.assertEqual([d["step"] for d in c.degradation], ["encoding"])
+
+
+class EncodingChoiceTests(unittest.TestCase):
+    def make_chart(self, size, **options):
+        c = charts.Chart()
+        c.options["chs"] = size
+        c.options.update(options)
+        c.datasets.append(charts.Dataset([1, 2, 3]))
+        return c
+
+    def test_default(self):
+        self.assertEqual(self.make_chart("300x100").choose_encoding(), ("extended", None))
+        self.assertEqual(self.make_chart("300x100", chds="0,5").choose_encoding(), ("text", None))
+
+    def test_auto(self):
+        c = self.make_chart("300x100")
+        c.encoding = "auto"
+        self.assertEqual(c.choose_encoding()[0], "simple")
+        self.assert_("chd=s1:" in c.url())
+        c = self.make_chart("300x200")
+        c.encoding = "auto"
+        self.assertEqual(c.choose_encoding()[0], "extended")
+        c = self.make_chart("100x300", cht="bhg")
+        c.encoding = "auto"
+        self.assertEqual(c.choose_encoding()[0], "simple")
+
+    def test_auto_with_scaling(self):
+        c = self.make_chart("300x100", chds="0,5")
+        c.encoding = "auto"
+        self.assertEqual(c.choose_encoding(), ("simple", (0.0, 5.0)))
+        self.assert_("chds" not in c.url())
+
+
+class CloneTests(unittest.TestCase):
+    def test_clone_reuses_encoded_data(self):
+        parent = charts.Chart()
+        parent.datasets.append(charts.Dataset([1, 2, 3]))
+        parent.datarange = (0, 10)
+        parent.url()
+        self.assertEqual(len(parent._segments), 1)
+
+        child = parent.clone()
+        child.datarange = (0, 10)
+        child.datasets.append(charts.Dataset([4, 5, 6]))
+        url = child.url()
+        # The child reused the parent's encoding, but kept its own to itself.
+        segment = parent._segments.values()[0][1]
+        self.assert_(segment in [encoded for dataset, encoded in child._segments.values()])
+        self.assertEqual(len(child._segments), 2)
+        self.assertEqual(len(parent._segments), 1)
+
+        fresh = charts.Chart()
+        fresh.datasets = child.datasets[:]
+        fresh.datarange = (0, 10)
+        self.assertEqual(fresh.url(), url)
+
+    def test_only_last_url_is_kept(self):
+        c = charts.Chart()
+        c.options["chs"] = "300x100"
+        c.max_url_length = 300
+        c.datasets.append(charts.Dataset(range(500)))
+        c.url()
+        kept = dict(c._segments)
+        self.assert_(len(kept) > 1)
+        # Building the same URL again reuses all of it.
+        c.url()
+        self.assertEqual(c._segments, kept)
+        for i in range(20):
+            c.datasets = [charts.Dataset(range(i, i + 500))]
+            c.datarange = None
+            c.url()
+            self.assertEqual(len(c._segments), len(kept))
+
+    def test_changed_dataset_is_encoded_again(self):
+        c = charts.Chart()
+        c.datasets.append(charts.Dataset([1, 2, 3]))
+        c.datarange = (0, 10)
+        before = c.url()
+        c.datasets[0][0] = 9
+        after = c.url()
+        self.assertNotEqual(after, before)
+        fresh = charts.Chart()
+        fresh.datasets.append(charts.Dataset([9, 2, 3]))
+        fresh.datarange = (0, 10)
+        self.assertEqual(fresh.url(), after)
+
+
+class ConstantFoldingTests(unittest.TestCase):
+    def compile(self, source):
+        from django import template
+        return template.Template("{% load charts %}" + source)
+
+    def chart_node(self, t):
+        # Templates may load the tag library under another module name, so
+        # go by the class name.
+        return [n for n in t.nodelist if n.__class__.__name__ == "ChartNode"][0]
+
+    def test_literal_options_are_folded(self):
+        t = self.compile('{% chart %}{% chart-type "pie" %}{% chart-size "300" "200" %}'
+                         '{% chart-data data %}{% chart-colors color %}{% chart-labels "a" %}{% endchart %}')
+        node = self.chart_node(t)
+        self.assertEqual(node.static_options.items(), [("cht", "p"), ("chs", "300x200")])
+        labels = [n for n in node.nodes if hasattr(n, "static_data")][-1]
+        self.assertEqual(labels.static_data, {"chl": "a"})
+
+        from django.template import Context
+        rendered = t.render(Context({"data": [1, 2], "color": "ff0000"}))
+        self.assert_("cht=p&amp;chs=300x200&amp;chco=ff0000&amp;chl=a&amp;chd=" in rendered)
+
+    def test_variables_are_not_folded(self):
+        t = self.compile('{% chart %}{% chart-type kind %}{% chart-data data %}{% endchart %}')
+        node = self.chart_node(t)
+        self.assertEqual(node.static_options.items(), [])
+        self.assertEqual(node.nodes[0].static_data, None)
+
+
+class ColorVariantTests(unittest.TestCase):
+    def test_variants_match_full_rebuild(self):
+        c = charts.Chart()
+        c.options.update(charts.chart_auto_colors("336699", ["a", "b", "c"]))
+        c.datasets.append(charts.Dataset([1, 2, 3]))
+        variants = c.color_variants()
+        self.assertEqual([label for color, label, img in variants], ["a", "b", "c"])
+
+        colors = c.options["chco"].split(",")
+        for i, (color, label, img) in enumerate(variants):
+            expected = c.clone()
+            expected.options["chco"] = ",".join(
+                j == i and colors[0] or charts._chart_inactive_color for j in range(3))
+            self.assertEqual(img, expected.img())
+            self.assertEqual(img, c.img(color_override=color))
+
+
+class ChartSpecTests(unittest.TestCase):
+    def make_chart(self):
+        c = charts.Chart()
+        c.options.update(charts.chart_auto_colors("336699", ["a", "b"]))
+        c.datasets.append(charts.Dataset([1, None, 3]))
+        c.datasets.append(charts.Dataset([2, 4, 6]))
+        c.axes.append(charts.Axis("x"))
+        return c
+
+    def test_freeze(self):
+        c = self.make_chart()
+        spec = c.freeze()
+        self.assertEqual(spec, self.make_chart().freeze())
+        self.assertEqual(hash(spec), hash(self.make_chart().freeze()))
+        self.assertEqual(c.options.get("chs"), None)
+        self.assertRaises(AttributeError, setattr, spec, "alt", "x")
+
+    def test_pure(self):
+        spec = self.make_chart().freeze()
+        key = spec.key
+        self.assertEqual(spec.url(), self.make_chart().url())
+        color = dict(spec.options)["chco"].split(",")[1]
+        self.assertEqual(spec.img(color_override=color), self.make_chart().img(color_override=color))
+        self.assertEqual(spec.img(), self.make_chart().img())
+        self.assertEqual(spec.key, key)
+        self.assertEqual(spec.thaw().freeze(), spec)
+
+    def test_datasets(self):
+        c = self.make_chart()
+        spec = c.freeze()
+        c.datasets[1][0] = 3
+        self.assertNotEqual(c.freeze(), spec)
+        c.datasets[1][0] = 2
+        self.assertEqual(c.freeze(), spec)
+        # Thawed charts get datasets of their own, still skipping missing points.
+        thawed = spec.thaw()
+        self.assertEqual([d.__class__ for d in thawed.datasets], [charts.Dataset] * 2)
+        self.assertEqual(charts.data_range(thawed.datasets), (1.0, 6.0))
+        thawed.datasets[0][0] = 9
+        self.assertEqual(spec.thaw().datasets[0][0], 1.0)
+        self.assertEqual(spec.url(), c.url())
+
+    def test_pickle(self):
+        import pickle
+        spec = self.make_chart().freeze()
+        self.assertEqual(pickle.loads(pickle.dumps(spec, pickle.HIGHEST_PROTOCOL)), spec)
+
+
+class RenderTests(unittest.TestCase):
+    def make_chart(self, cht="lc"):
+        c = charts.Chart()
+        c.options["cht"] = cht
+        c.options["chs"] = "100x50"
+        c.options["chco"] = "CC0000"
+        c.datasets.append(charts.Dataset([0, 5, None, 10]))
+        return c
+
+    def test_decode(self):
+        from googlecharts.render.parse import decode_data
+        self.assertEqual(decode_data("e1:AA__..,gA"), ([[0.0, None, 1.0], [2048 / 4095.0]], 1))
+        self.assertEqual(decode_data("s2:A_9"), ([[0.0, None, 1.0]], 1))
+        self.assertEqual(decode_data("t1:5,_|20", "0,10,0,40"), ([[0.5, None], [0.5]], 1))
+
+    def test_svg(self):
+        from googlecharts.render import render
+        svg = render(self.make_chart(), "svg")
+        self.assert_(svg.startswith('<?xml'))
+        # The missing point splits the line in two.
+        self.assertEqual(svg.count('<polyline points="0,50 33.33,24.99"'), 1)
+        self.assertEqual(svg.count('<polyline points="100,0 100,0"'), 1)
+        self.assert_('stroke="#cc0000"' in svg)
+        for cht in ("ls", "bvg", "bhs", "p", "p3", "s", "lxy"):
+            self.assert_("<svg" in render(self.make_chart(cht), "svg"))
+
+    def test_png(self):
+        from googlecharts.render import png, render
+        if png.Image is None:
+            self.skipTest("PIL isn't installed")
+        self.assert_(render(self.make_chart("bvs"), "png").startswith("\x89PNG"))
+
+    def test_font_sizes(self):
+        from django.conf import settings
+        from googlecharts.render import png
+        loaded = []
+        class ImageFont(object):
+            @staticmethod
+            def truetype(path, size):
+                loaded.append(size)
+                return size
+        old_font = getattr(png, "ImageFont", None)
+        png.ImageFont = ImageFont
+        settings.GOOGLECHARTS_RENDER_FONT = "/fonts/test.ttf"
+        try:
+            sizes = [png.get_font(size) for size in
+                     (11.4, 11, 0, -5, 1e9, float("inf"), float("nan"), 72.2)]
+        finally:
+            png.ImageFont = old_font
+            del settings.GOOGLECHARTS_RENDER_FONT
+            png._fonts.clear()
+        self.assertEqual(sizes, [11, 11, 1, 1, 72, 72, 72, 72])
+        self.assertEqual(loaded, [11, 1, 72])
+
+    def test_unsupported(self):
+        from googlecharts.render import render, RenderError
+        self.assertRaises(RenderError, render, self.make_chart("v"), "svg")
+        self.assertRaises(RenderError, render, self.make_chart(), "gif")
+        c = self.make_chart()
+        c.options["chs"] = "1000x1000"
+        self.assertRaises(RenderError, render, c, "svg")
+        c = self.make_chart("p")
+        c.options["chp"] = "x"
+        self.assertRaises(RenderError, render, c, "svg")
+
+    def test_view(self):
+        from django.http import HttpRequest, QueryDict
+        from googlecharts.views import chart
+        request = HttpRequest()
+        request.GET = QueryDict(self.make_chart().url().split("?", 1)[1] + "&chof=svg")
+        response = chart(request)
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assert_("max-age" in response["Cache-Control"])
+        for query in ["chs=10x&chd=t:1", "cht=p&chd=t:1,2&chp=x", "chd=t:1,2&chm=o,000000,0,x,4"]:
+            request.GET = QueryDict(query)
+            self.assertEqual(chart(request).status_code, 400)
+        # Misconfiguration isn't the request's fault.
+        from django.conf import settings
+        settings.GOOGLECHARTS_RENDER_BACKENDS = {"broken": "googlecharts.no_such_module.Canvas"}
+        try:
+            request.GET = QueryDict("chd=t:1,2&chof=broken")
+            self.assertRaises(ImportError, chart, request)
+        finally:
+            del settings.GOOGLECHARTS_RENDER_BACKENDS
+
+    def test_hostile_options(self):
+        # Options that used to draw forever: dashes of 0 or negative length,
+        # and grid steps too small to see.
+        import signal
+        from googlecharts.render import ChartImage, render_image, png
+        formats = ["svg"]
+        if png.Image is not None:
+            formats.append("png")
+        def timeout(signum, frame):
+            self.fail("Drawing took too long")
+        previous = signal.signal(signal.SIGALRM, timeout)
+        signal.alarm(10)
+        try:
+            for query in ("chls=2,-1,1", "chls=2,0,0", "chls=2,1,-1",
+                          "chg=10,10,-1,1", "chg=10,10,0,0", "chg=1e-9,1e-9"):
+                image = ChartImage.from_url("chd=t:1,2&" + query)
+                for format in formats:
+                    render_image(image, format)
+        finally:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous)
+        self.assertEqual(ChartImage.from_url("chg=1e-9,0,0,-2").grid, [1.0, 0.0, 1.0, 0.0])
+        from googlecharts.render import RenderError
+        self.assertRaises(RenderError, ChartImage.from_url, "chg=nan,10")
+
+    def test_base_url(self):
+        from django.conf import settings
+        settings.GOOGLECHARTS_BASE_URL = "/charts/chart"
+        try:
+            self.assert_(self.make_chart().url().startswith("/charts/chart?"))
+        finally:
+            del settings.GOOGLECHARTS_BASE_URL
+        self.assert_(self.make_chart().url().startswith(charts.Chart.BASE))
+
+
+class ImageStoreTests(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from django.core.files.storage import FileSystemStorage
+        from googlecharts.storage import ImageStore
+        self.root = tempfile.mkdtemp()
+        self.rendered = []
+        class CountingStore(ImageStore):
+            def image(store, url):
+                self.rendered.append(url)
+                return ImageStore.image(store, url)
+        storage = FileSystemStorage(location=self.root, base_url="/media/")
+        self.store = CountingStore("charts", storage=storage, format="svg")
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+
+    def make_chart(self):
+        c = charts.Chart()
+        c.options["chs"] = "100x50"
+        c.datasets.append(charts.Dataset([1, 2, 3]))
+        return c
+
+    def test_saved_once(self):
+        import os
+        url = self.make_chart().url()
+        local = self.store.url(url)
+        self.assert_(local.startswith("/media/charts/") and local.endswith(".svg"))
+        self.assertEqual(self.store.url(url), local)
+        self.assertEqual(len(self.rendered), 1)
+        self.assertEqual(os.listdir(os.path.join(self.root, "charts")), [local.split("/")[-1]])
+
+    def test_cleanup(self):
+        import os, time
+        names = []
+        for i in range(3):
+            c = self.make_chart()
+            c.options["chco"] = "00000%d" % i
+            name = self.store.name(c.url())
+            self.store.url(c.url())
+            # Make them a minute apart, the first one oldest.
+            then = time.time() - 60 * (3 - i)
+            os.utime(os.path.join(self.root, name), (then, then))
+            names.append(name)
+        size = os.path.getsize(os.path.join(self.root, names[2]))
+        self.assertEqual(self.store.cleanup(max_age=150), 1)
+        self.assertEqual(self.store.cleanup(max_size=size), 1)
+        self.assertEqual([self.store.storage.exists(name) for name in names], [False, False, True])
+
+    def test_saveas(self):
+        from django.conf import settings
+        from django import template
+        from googlecharts import storage
+        settings.GOOGLECHARTS_SAVEAS_FORMAT = "svg"
+        settings.GOOGLECHARTS_STORAGE = "django.core.files.storage.FileSystemStorage"
+        settings.MEDIA_ROOT, old_root = self.root, settings.MEDIA_ROOT
+        settings.MEDIA_URL, old_url = "/media/", settings.MEDIA_URL
+        try:
+            t = template.Template('{% load charts %}{% chart saveas "sparks" %}'
+                                  '{% chart-data "1,2,3" %}{% endchart %}')
+            output = t.render(template.Context())
+        finally:
+            del settings.GOOGLECHARTS_SAVEAS_FORMAT, settings.GOOGLECHARTS_STORAGE
+            settings.MEDIA_ROOT, settings.MEDIA_URL = old_root, old_url
+            storage._stores.clear()
+        self.assert_('src="/media/sparks/' in output)
+
+    def test_png_without_pil(self):
+        # PNGs are fetched from the chart API when they can't be drawn.
+        from googlecharts import storage
+        from googlecharts.render import png
+        old_image, old_fetch = png.Image, storage.fetch
+        png.Image = None
+        storage.fetch = lambda query: "fetched " + query
+        try:
+            store = storage.ImageStore("charts", storage=self.store.storage, format="png")
+            url = self.make_chart().url()
+            self.assertEqual(store.image(url), "fetched " + url.split("?", 1)[1])
+        finally:
+            png.Image, storage.fetch = old_image, old_fetch
+
+    def test_image_fails(self):
+        # Charts whose images can't be made are shown from the chart API.
+        import socket, logging
+        from django.utils.html import escape
+        from googlecharts import storage
+        from googlecharts.render import png
+        def fetch(query):
+            raise socket.error(111, "Connection refused")
+        warnings = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                warnings.append(record.getMessage())
+        handler = Handler()
+        storage.logger.addHandler(handler)
+        old_image, old_fetch = png.Image, storage.fetch
+        png.Image = None
+        storage.fetch = fetch
+        storage._stores["png"] = storage.ImageStore("png", storage=self.store.storage, format="png")
+        storage._stores["svg"] = self.store
+        try:
+            line = self.make_chart()
+            line.saveas = "png"
+            venn = self.make_chart()
+            venn.options["cht"] = "v"
+            venn.saveas = "svg"
+            for c in (line, venn):
+                self.assert_('src="%s"' % escape(c.url()) in c.img())
+        finally:
+            png.Image, storage.fetch = old_image, old_fetch
+            storage._stores.clear()
+            storage.logger.removeHandler(handler)
+        self.assertEqual(len(warnings), 2)
+        self.assert_("Connection refused" in warnings[0])
+        self.assert_("RenderError: Can't draw" in warnings[1])
+
+
+class PrefetchTests(unittest.TestCase):
+    """Prefetching against a stand-in for the chart API on localhost."""
+
+    def setUp(self):
+        import tempfile, threading
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn
+        from django.conf import settings
+        self.connections = []
+        self.requests = []
+        tests = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Drop idle keep-alive connections
+            timeout = 0.5
+            def setup(self):
+                tests.connections.append(self.client_address)
+                BaseHTTPRequestHandler.setup(self)
+            def do_GET(self):
+                tests.requests.append(self.path)
+                if "slow" in self.path:
+                    import time
+                    time.sleep(0.5)
+                body = "\x89PNG %s" % self.path
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+            def handle_error(self, request, client_address):
+                pass
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+        self.root = tempfile.mkdtemp()
+        self.settings = settings
+        self.old = settings.MEDIA_ROOT, settings.MEDIA_URL
+        settings.MEDIA_ROOT, settings.MEDIA_URL = self.root, "/media/"
+        settings.GOOGLECHARTS_STORAGE = "django.core.files.storage.FileSystemStorage"
+        settings.GOOGLECHARTS_SAVEAS_SOURCE = "fetch"
+        settings.GOOGLECHARTS_FETCH_URL = "http://127.0.0.1:%d/chart" % self.server.server_address[1]
+
+    def tearDown(self):
+        import shutil
+        from googlecharts import storage
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+        settings = self.settings
+        settings.MEDIA_ROOT, settings.MEDIA_URL = self.old
+        del settings.GOOGLECHARTS_STORAGE, settings.GOOGLECHARTS_SAVEAS_SOURCE
+        del settings.GOOGLECHARTS_FETCH_URL
+        storage._stores.clear()
+
+    def render(self, charts, budget=""):
+        from django import template
+        t = template.Template("{% load charts %}{% chart-prefetch " + budget + " %}"
+                              "{% for c in charts %}{{ c.img }}{% endfor %}{% endchart-prefetch %}")
+        return t.render(template.Context({"charts": charts}))
+
+    def make_chart(self, color):
+        c = charts.Chart()
+        c.options["chco"] = color
+        c.datasets.append(charts.Dataset([1, 2, 3]))
+        c.saveas = "prefetched"
+        return c
+
+    def test_keep_alive(self):
+        from googlecharts.storage import fetch
+        self.assertEqual(fetch("a=1"), "\x89PNG /chart?a=1")
+        self.assertEqual(fetch("a=2"), "\x89PNG /chart?a=2")
+        self.assertEqual(len(self.connections), 1)
+
+    def test_prefetch(self):
+        import os
+        from googlecharts.storage import get_image_store
+        # More than ten, so that placeholders "-1" and "-10" both turn up.
+        made = [self.make_chart("0000%02d" % i) for i in range(12)]
+        output = self.render(made)
+        store = get_image_store("prefetched")
+        expected = "".join(['<img src="%s" width="200" height="200" alt="" />'
+                            % store.storage.url(store.name(c.url())) for c in made])
+        self.assertEqual(output, expected)
+        self.assertEqual(len(self.requests), 12)
+        self.assertEqual(len(os.listdir(os.path.join(self.root, "prefetched"))), 12)
+        # Once they're saved, they're not fetched again.
+        output = self.render([self.make_chart("0000%02d" % i) for i in range(12)])
+        self.assertEqual(output, expected)
+        self.assertEqual(len(self.requests), 12)
+
+    def test_budget(self):
+        c = self.make_chart("slow00")
+        output = self.render([c, self.make_chart("000000")], "0.1")
+        self.assert_('src="%s"' % charts.escape(c.url()) in output)
+        self.assertEqual(output.count('src="/media/prefetched/'), 1)
+        # The slow image is still saved, for next time.
+        import os, time
+        from googlecharts.storage import get_image_store
+        path = os.path.join(self.root, get_image_store("prefetched").name(c.url()))
+        for i in range(50):
+            if os.path.exists(path):
+                break
+            time.sleep(0.1)
+        self.assert_(os.path.exists(path))
+
+
+class SparklineTests(unittest.TestCase):
+    def setUp(self):
+        self.old_threshold = charts.numpy_threshold
+
+    def tearDown(self):
+        charts.numpy_threshold = self.old_threshold
+
+    def test_sparkline(self):
+        tag = charts.sparkline([1, 5, 3, 9, 4], "120x20", "cc0000")
+        self.assert_("chs=120x20&amp;chd=e:HHjjVV..cc&amp;chco=cc0000" in tag)
+        self.assert_('width="120" height="20"' in tag)
+        # The label is the last value, level with the last point.
+        self.assert_("chm=o,990000,0,4,4" in tag)
+        self.assert_("chxl=0:|4|1:||2:||&amp;chxp=0,44.4444" in tag)
+
+    def test_label(self):
+        # The value itself, as before sparklines were built in batches.
+        self.assert_("chxl=0:|1234567|" in charts.sparkline([1, 1234567]))
+        self.assert_("chxl=0:|0.123456789|" in charts.sparkline([1, 0.123456789]))
+        self.assert_("chxl=0:|-2.5|" in charts.sparkline([1, -2.5]))
+
+    def test_batch(self):
+        series = [[i * j - 20 for i in range(30)] for j in range(40)] + [[], [None, 2]]
+        tags = charts.sparklines(series, "80x16")
+        self.assertEqual(tags, [charts.sparkline(s, "80x16") for s in series])
+        if charts.get_numpy() is not None:
+            charts.numpy_threshold = 1
+            self.assertEqual(charts.sparklines(series, "80x16"), tags)
+
+    def test_filter(self):
+        from django import template
+        t = template.Template('{% load charts %}{% for s in series|sparklines:"50x10" %}{{ s }}{% endfor %}')
+        output = t.render(template.Context({"series": [[1, 2], [3, 4]]}))
+        self.assertEqual(output.count('<img src="http://chart.apis.google.com/chart?cht=lc&amp;chs=50x10'), 2)
+
+class SpriteTests(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from django.conf import settings
+        self.root = tempfile.mkdtemp()
+        self.settings = settings
+        self.old = settings.MEDIA_ROOT, settings.MEDIA_URL
+        settings.MEDIA_ROOT, settings.MEDIA_URL = self.root, "/media/"
+        settings.GOOGLECHARTS_STORAGE = "django.core.files.storage.FileSystemStorage"
+        settings.GOOGLECHARTS_SAVEAS_FORMAT = "svg"
+        settings.GOOGLECHARTS_SPRITE_WIDTH = 250
+
+    def tearDown(self):
+        import shutil
+        from googlecharts import storage
+        shutil.rmtree(self.root)
+        settings = self.settings
+        settings.MEDIA_ROOT, settings.MEDIA_URL = self.old
+        del settings.GOOGLECHARTS_STORAGE, settings.GOOGLECHARTS_SAVEAS_FORMAT
+        del settings.GOOGLECHARTS_SPRITE_WIDTH
+        storage._stores.clear()
+
+    def render(self, source, **context):
+        from django import template
+        t = template.Template("{% load charts %}{% chart-sprite %}" + source + "{% endchart-sprite %}")
+        return t.render(template.Context(context))
+
+    def test_sprite(self):
+        import os, re
+        source = ('{% for s in series|sparklines:"100x30" %}{{ s }}{% endfor %}'
+                  '{% chart %}{% chart-size "400x300" %}{% chart-data "1,2" %}{% endchart %}')
+        output = self.render(source, series=[[1, 2], [3, 4], [5, 6]])
+        self.assertEqual(os.listdir(os.path.join(self.root, "charts")), [
+            re.search(r"/media/charts/(\w+\.svg)", output).group(1)])
+        # Two to a row, and the big chart keeps its own image.
+        offsets = re.findall(r"width:100px;height:30px;background:url\(\S+\) (-\d+px -\d+px)", output)
+        self.assertEqual(offsets, ["-0px -0px", "-100px -0px", "-0px -30px"])
+        self.assert_('<img src="http://chart.apis.google.com/chart?' in output)
+        svg = open(os.path.join(self.root, "charts", os.listdir(os.path.join(self.root, "charts"))[0])).read()
+        self.assert_('width="200" height="60"' in svg)
+
+        # The same charts make the same sprite.
+        self.assertEqual(self.render(source, series=[[1, 2], [3, 4], [5, 6]]), output)
+        self.assertEqual(len(os.listdir(os.path.join(self.root, "charts"))), 1)
+
+    def test_many(self):
+        import re
+        # More than ten, so that placeholders "-1" and "-10" both turn up.
+        output = self.render('{% for s in series|sparklines:"100x30" %}{{ s }}{% endfor %}',
+                             series=[[i, 2 * i] for i in range(1, 13)])
+        offsets = re.findall(r"background:url\(\S+\) (-\d+px -\d+px)", output)
+        self.assertEqual(offsets, ["-%dpx -%dpx" % (i % 2 * 100, i // 2 * 30) for i in range(12)])
+        # Nothing but the tags, with nothing left over from the placeholders.
+        self.assertEqual(re.sub(r'<span class="chart-sprite"[^>]*></span>', "", output), "")
+
+    def test_unsupported(self):
+        output = self.render('{% chart %}{% chart-type "map" %}{% chart-size "40x40" %}'
+                             '{% chart-alt "A map" %}{% chart-data "1" %}{% endchart %}')
+        self.assert_(output.startswith('<img src="http://chart.apis.google.com/chart?'))
+        self.assert_('alt="A map"' in output)
+
+class TracingTests(unittest.TestCase):
+    def setUp(self):
+        from googlecharts import tracing
+        self.traces = []
+        tracing.chart_rendered.connect(self.record)
+
+    def tearDown(self):
+        from googlecharts import tracing
+        tracing.chart_rendered.disconnect(self.record)
+
+    def record(self, sender, trace, **kwargs):
+        self.traces.append(trace)
+
+    def render(self, source, **context):
+        from django import template
+        t = template.Template("{% load charts %}" + source)
+        return t.render(template.Context(context))
+
+    def test_trace(self):
+        from googlecharts import tracing
+        output = self.render('{% chart %}{% chart-size "300x100" %}{% chart-data data %}'
+                             '{% axis "left" %}{% endaxis %}{% endchart %}', data=range(50))
+        self.assertEqual(len(self.traces), 1)
+        trace = self.traces[0]
+        self.assertEqual(trace.phases.keys(), list(tracing.phases))
+        self.assertEqual((trace.type, trace.size, trace.points), ("lc", "300x100", 50))
+        self.assertEqual(trace.url_length, len(output.split('"')[1].replace("&amp;", "&")))
+        self.assert_(trace.duration >= sum(trace.phases.values()) > 0)
+        self.assertEqual(tracing.current(), None)
+
+    def test_phases(self):
+        import time
+        class Report(object):
+            @property
+            def data(self):
+                time.sleep(0.05)
+                return range(10)
+        self.render('{% chart %}{% chart-data report.data %}{% endchart %}', report=Report())
+        phases = self.traces[0].phases
+        # Looking the data up is resolving; only making Datasets is converting.
+        self.assert_(phases["resolve"] >= 0.05 > phases["convert"], phases)
+
+    def test_failed_chart(self):
+        from googlecharts import tracing
+        class Broken(object):
+            def __iter__(self):
+                raise RuntimeError("broken")
+        self.assertRaises(RuntimeError, self.render,
+                          '{% chart %}{% chart-data data %}{% endchart %}', data=Broken())
+        self.assertEqual(tracing.current(), None)
+        charts.Chart().url()
+        self.assertEqual(len(self.traces), 1)
+
+    def test_slow_chart_log(self):
+        import logging
+        from django.conf import settings
+        records = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+        handler = Handler()
+        logger = logging.getLogger("googlecharts.slow")
+        logger.addHandler(handler)
+        settings.GOOGLECHARTS_TRACERS = ["googlecharts.tracing.SlowChartLogger"]
+        settings.GOOGLECHARTS_SLOW_CHART_MS = 0
+        try:
+            self.render('{% chart %}{% chart-data "1,2,3" %}{% endchart %}')
+        finally:
+            logger.removeHandler(handler)
+            del settings.GOOGLECHARTS_TRACERS, settings.GOOGLECHARTS_SLOW_CHART_MS
+        self.assertEqual(len(records), 1)
+        self.assert_("lc chart 200x200 with 3 points, URL 67 bytes" in records[0], records[0])
+
+class URLWriterTests(unittest.TestCase):
+    def test_html(self):
+        from django.utils.html import escape
+        c = charts.Chart()
+        c.options["chtt"] = "Sales <& profit>"
+        c.options["chdl"] = u"North|South \"quoted\"|'East'"
+        c.datasets.append(charts.Dataset([1, 2, 3]))
+        axis = charts.Axis("x")
+        axis.options.update(charts.axis_labels("Jan", "Feb & Mar"))
+        c.axes.append(axis)
+        url = c.url()
+        self.assertEqual(url, "http://chart.apis.google.com/chart?chtt=Sales+%3C%26+profit%3E"
+                              "&chdl=North|South+%22quoted%22|%27East%27&chs=200x200&cht=lc"
+                              "&chd=e1:VVqq..&chxt=x&chxl=0:|Jan|Feb+%26+Mar")
+        self.assertEqual(c.img(), '<img src="%s" width="200" height="200" alt="" />' % escape(url))
+
+    def test_quote(self):
+        self.assertEqual(charts.quote("a b/c:d,e|f&g"), "a+b/c:d,e|f%26g")
+        self.assertEqual(charts.quote("a b/c:d,e|f&g"), "a+b/c:d,e|f%26g")
+        self.assertEqual(charts.urlencode([("chl", "A|B C"), ("_x", "y")]), "chl=A|B+C")
+
+class OptionArityTests(unittest.TestCase):
+    def compile(self, source):
+        from django import template
+        return template.Template("{% load charts %}{% chart %}" + source + "{% endchart %}")
+
+    def test_arity(self):
+        from django import template
+        self.compile('{% chart-size "300x200" %}{% chart-size 300 200 %}{% chart-colors "a" "b" "c" %}'
+                     '{% chart-grid-lines %}{% chart-alt "x" %}')
+        self.assertRaises(template.TemplateSyntaxError, self.compile, '{% chart-size 300 200 1 %}')
+        self.assertRaises(template.TemplateSyntaxError, self.compile, '{% chart-bar-width %}')
+
+class ChartBuilderTests(unittest.TestCase):
+    def test_same_as_template(self):
+        from django import template
+        t = template.Template(
+            '{% load charts %}{% chart as c %}'
+            '{% chart-type "line" %}{% chart-size "300x200" %}'
+            '{% chart-data data "1,2,3" %}{% chart-colors "336699" %}{% chart-colors "CC0000" %}'
+            '{% chart-data-range 0 10 %}{% chart-alt "Sales" %}'
+            '{% axis "left" %}{% axis-labels 0 5 10 %}{% axis-range 0 10 %}{% endaxis %}'
+            '{% axis "bottom" hide %}'
+            '{% endchart %}')
+        context = template.Context({"data": [4, 5, 6]})
+        t.render(context)
+        expected = context["c"]
+
+        builder = (charts.ChartBuilder().type("line").size("300x200")
+                   .data([4, 5, 6], "1,2,3").colors("336699").colors("CC0000")
+                   .data_range(0, 10).alt("Sales"))
+        builder.axis("left").labels(0, 5, 10).range(0, 10)
+        builder.axis("bottom", hide=True)
+        self.assertEqual(builder.chart().options, expected.options)
+        self.assertEqual(builder.url(), expected.url())
+        self.assertEqual(builder.img(), expected.img())
+
+    def test_unknown_option(self):
+        builder = charts.ChartBuilder()
+        self.assertRaises(AttributeError, getattr, builder, "no_such_option")
+        # Axis options only go on axes.
+        self.assertRaises(AttributeError, getattr, builder, "axis_labels")
+        self.assertRaises(AttributeError, getattr, builder.axis("left"), "colors")
+
+class BatchTests(unittest.TestCase):
+    specs = [
+        '{"id": "a", "type": "line", "size": "300x200", "data": [[1, 2, 3]],'
+        ' "axes": [{"side": "left", "labels": [0, 5]}]}',
+        '',
+        '{"type": "pie", "size": "100x100", "data": ["1,2"], "labels": ["x", "y"]}',
+        '{"id": "c", "type": "line", "no_such_option": 1}',
+    ]
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def write_specs(self):
+        import os
+        path = os.path.join(self.dir, "specs.jsonl")
+        f = open(path, "w")
+        f.write("\n".join(self.specs) + "\n")
+        f.close()
+        return path
+
+    def read(self, path):
+        import json
+        results = []
+        for line in open(path):
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                pass
+        return results
+
+    def test_make_chart(self):
+        from googlecharts.batch import make_chart, read_specs
+        specs = list(read_specs(self.specs))
+        self.assertEqual([id for id, spec in specs], ["a", 3, "c"])
+        builder = charts.ChartBuilder().type("line").size("300x200").data([1, 2, 3])
+        builder.axis("left").labels(0, 5)
+        self.assertEqual(make_chart(specs[0][1]).url(), builder.url())
+
+    def test_build_file(self):
+        import os
+        from googlecharts.batch import build_file
+        specs, output = self.write_specs(), os.path.join(self.dir, "out.jsonl")
+        seen = []
+        stats = build_file(specs, output, processes=1, chunk_size=2, progress=seen.append)
+        self.assertEqual((stats.charts, stats.errors, stats.total), (3, 1, 3))
+        self.assertEqual(len(seen), 2)
+        results = self.read(output)
+        self.assertEqual([r["id"] for r in results], ["a", 3, "c"])
+        self.assert_(results[0]["url"].startswith("http://chart.apis.google.com/chart?"))
+        self.assert_(results[2]["error"].startswith("AttributeError"))
+
+        # Running it again only retries the failed chart, after finishing
+        # off a line cut short.
+        f = open(output, "a")
+        f.write('{"id": "d", "u')
+        f.close()
+        stats = build_file(specs, output, processes=1)
+        self.assertEqual((stats.charts, stats.skipped), (1, 2))
+        self.assertEqual([r["id"] for r in self.read(output)[3:]], ["c"])
+
+    def test_malformed_lines(self):
+        import os
+        from googlecharts.batch import build_file
+        self.specs = self.specs[:1] + ['{"id": "b", ', '[1, 2]'] + self.specs[1:]
+        specs, output = self.write_specs(), os.path.join(self.dir, "out.jsonl")
+        stats = build_file(specs, output, processes=1, chunk_size=2)
+        self.assertEqual((stats.charts, stats.errors, stats.total), (5, 3, 5))
+        results = self.read(output)
+        self.assertEqual([r["id"] for r in results], ["a", 2, 3, 5, "c"])
+        self.assert_("url" in results[0] and "url" in results[3])
+        self.assert_(results[1]["error"].startswith("InvalidSpec: Line 2 isn't valid JSON"))
+        self.assertEqual(results[2]["error"], "InvalidSpec: Line 3 isn't a JSON object")
+
+    def test_pool(self):
+        import os
+        from googlecharts.batch import build_file
+        specs = self.write_specs()
+        build_file(specs, os.path.join(self.dir, "one.jsonl"), processes=1)
+        build_file(specs, os.path.join(self.dir, "two.jsonl"), processes=2, chunk_size=1)
+        self.assertEqual(self.read(os.path.join(self.dir, "one.jsonl")),
+                         self.read(os.path.join(self.dir, "two.jsonl")))
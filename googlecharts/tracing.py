@@ -0,0 +1,132 @@
+"""
+Timing how {% chart %} tags spend their time.
+
+While tracing is on, each chart tag gets a Trace recording how long it spent
+in each phase of building the chart:
+
+    resolve     looking up variables (the data too) and working out options
+                and axes
+    convert     turning the data into Datasets (safefloat() on every point)
+    datarange   finding the range of the data
+    encode      encoding (and downsampling) the data
+    urlencode   quoting the options and axes into the URL
+
+along with the chart's point count and URL length. When the tag is done, the
+trace is sent with the chart_rendered signal and handed to each tracer in the
+GOOGLECHARTS_TRACERS setting, a list of import paths of Tracer subclasses --
+such as SlowChartLogger, which logs charts that take too long. Tracing is on
+whenever there's a tracer or a chart_rendered receiver.
+
+Charts saved with "as" are only built when they're used, so the encoding of
+charts used outside their tag isn't traced.
+"""
+import time
+import thread
+import threading
+
+from django.conf import settings
+from django.dispatch import Signal
+from django.utils.datastructures import SortedDict
+from django.utils.importlib import import_module
+
+# Sent with the Trace of each chart tag once it's been rendered.
+chart_rendered = Signal(providing_args=["trace"])
+
+phases = ("resolve", "convert", "datarange", "encode", "urlencode")
+
+class Trace(object):
+    """What one chart tag cost."""
+    def __init__(self):
+        # Seconds spent in each phase
+        self.phases = SortedDict([(phase, 0.0) for phase in phases])
+        self.type = self.size = None
+        self.points = 0
+        self.url_length = None
+        # Whether the tag's output came from the cache ({% chart cache %})
+        self.cached = False
+        self.thread = thread.get_ident()
+        self.started = time.time()
+        # Seconds for the whole tag, once it's done
+        self.duration = None
+
+    def add(self, phase, started):
+        """Count the time since started towards phase; returns the time now."""
+        now = time.time()
+        self.phases[phase] += now - started
+        return now
+
+    def describe_chart(self, chart):
+        """Note the chart's type, size and number of points."""
+        self.type = chart.options.get("cht", chart.defaults.get("cht"))
+        self.size = chart.options.get("chs", chart.defaults.get("chs"))
+        self.points = sum([len(d) for d in chart.datasets + chart.hidden_datasets])
+
+    def __repr__(self):
+        return "<Trace %s %s: %d points, %.2fms>" % (
+            self.type, self.size, self.points, (self.duration or 0) * 1000)
+
+class Tracer(object):
+    """Base class for GOOGLECHARTS_TRACERS."""
+    def chart_rendered(self, trace):
+        pass
+
+class SlowChartLogger(Tracer):
+    """
+    Logs a warning, to the "googlecharts.slow" logger, for each chart that
+    takes longer than threshold milliseconds (the GOOGLECHARTS_SLOW_CHART_MS
+    setting, 100 by default).
+    """
+    def __init__(self, threshold=None, logger=None):
+        if threshold is None:
+            threshold = getattr(settings, "GOOGLECHARTS_SLOW_CHART_MS", 100)
+        self.threshold = threshold
+        if logger is None:
+            # Not imported until it's needed: it's slow to import, and
+            # every chart tag imports this module.
+            import logging
+            logger = logging.getLogger("googlecharts.slow")
+        self.logger = logger
+
+    def chart_rendered(self, trace):
+        if trace.duration * 1000 < self.threshold:
+            return
+        self.logger.warning(
+            "Slow chart: %.1fms for %s chart %s with %d points, URL %s bytes (%s)",
+            trace.duration * 1000, trace.type, trace.size, trace.points, trace.url_length,
+            ", ".join(["%s %.1fms" % (phase, seconds * 1000)
+                       for phase, seconds in trace.phases.items()]))
+
+# The GOOGLECHARTS_TRACERS setting, and the tracers made from it.
+_tracers = ((), [])
+
+def get_tracers():
+    global _tracers
+    paths = tuple(getattr(settings, "GOOGLECHARTS_TRACERS", ()))
+    if paths != _tracers[0]:
+        tracers = []
+        for path in paths:
+            module, name = path.rsplit(".", 1)
+            tracers.append(getattr(import_module(module), name)())
+        _tracers = (paths, tracers)
+    return _tracers[1]
+
+# The Trace of the chart being rendered in this thread, if any.
+_local = threading.local()
+
+def current():
+    return getattr(_local, "trace", None)
+
+def start():
+    """Start tracing a chart tag; returns its Trace, or None if tracing is off."""
+    if not (chart_rendered.receivers or get_tracers()):
+        return None
+    trace = _local.trace = Trace()
+    return trace
+
+def finish(trace):
+    """Finish a chart tag's Trace, and send it to the tracers."""
+    trace.duration = time.time() - trace.started
+    _local.trace = None
+    for tracer in get_tracers():
+        tracer.chart_rendered(trace)
+    chart_rendered.send(sender=Trace, trace=trace)
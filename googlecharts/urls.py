@@ -0,0 +1,5 @@
+from django.conf.urls.defaults import *
+
+urlpatterns = patterns('googlecharts.views',
+    url(r'^chart$', 'chart', name='googlecharts-chart'),
+)
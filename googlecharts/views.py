@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils.cache import patch_cache_control
+
+from googlecharts.render import ChartImage, render_image
+
+def chart(request):
+    """
+    Draw the chart described by the chart API options in the query string.
+
+    Point GOOGLECHARTS_BASE_URL at this view to draw charts locally instead
+    of with the Google Chart API. Images are PNGs unless chof (or the
+    GOOGLECHARTS_RENDER_FORMAT setting) asks for "svg".
+    """
+    format = request.GET.get("chof") or getattr(settings, "GOOGLECHARTS_RENDER_FORMAT", "png")
+    options = dict((key, request.GET[key]) for key in request.GET)
+    try:
+        canvas = render_image(ChartImage(options), format)
+    except ValueError, e:
+        # A RenderError, or a bad number in an option that's only read when
+        # it's drawn: the request's fault. Anything else is ours, and a 500.
+        return HttpResponseBadRequest(str(e), content_type="text/plain")
+    response = HttpResponse(canvas.getvalue(), content_type=canvas.content_type)
+    # The image only depends on the URL, so it can be cached for a long time.
+    patch_cache_control(response, public=True,
+                        max_age=getattr(settings, "GOOGLECHARTS_RENDER_MAX_AGE", 86400))
+    return response
@@ -20,7 +20,7 @@ setup(
         'Programming Language :: Python',
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
-    packages = find_packages(),
+    packages = find_packages(exclude=["benchmarks"]),
     install_requires = ['Django>=1.0'],
     test_suite = "googlecharts.runtests.runtests",
 )
\ No newline at end of file